@@ -0,0 +1,59 @@
+"""
+Checks for Soupy features that older commits don't have.
+
+asv runs the benchmarks against every commit in the history, so
+benchmarks that use newer features are decorated with ``requires``,
+which skips them on commits that don't have the feature (setups that
+raise NotImplementedError mark a benchmark as skipped).
+"""
+import soupy
+
+
+def has(path):
+    """
+    Whether soupy has an attribute, like ``'Schema'`` or ``'Node.text_'``
+    """
+    obj = soupy
+    for name in path.split('.'):
+        if not hasattr(obj, name):
+            return False
+        obj = getattr(obj, name)
+    return True
+
+
+def accepts(**kwargs):
+    """
+    Whether Soupy accepts some keyword arguments. Older versions
+    pass them on to BeautifulSoup, which raises TypeError.
+    """
+    try:
+        soupy.Soupy('', 'html.parser', **kwargs)
+    except (TypeError, ImportError):
+        return False
+    return True
+
+
+def require(*paths, **kwargs):
+    """
+    Raise NotImplementedError unless soupy has every attribute
+    in paths, and Soupy accepts kwargs
+    """
+    missing = [path for path in paths if not has(path)]
+    missing.extend('Soupy(%s=%r)' % item for item in sorted(kwargs.items())
+                   if not accepts(**dict([item])))
+    if missing:
+        raise NotImplementedError("soupy has no %s" % ', '.join(missing))
+
+
+def requires(*paths, **kwargs):
+    """
+    Decorator that skips a benchmark unless soupy has every attribute
+    in paths, and Soupy accepts kwargs
+    """
+    def decorate(func):
+        # asv runs a benchmark's own setup after the class setup
+        def setup(*params):
+            require(*paths, **kwargs)
+        func.setup = setup
+        return func
+    return decorate
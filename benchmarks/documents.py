@@ -0,0 +1,80 @@
+"""
+Synthetic documents used by the benchmarks.
+
+Documents are generated deterministically, so that results are
+comparable across commits, and cached, since the largest ones take
+a while to build.
+"""
+
+# document sizes, in bytes
+KB, MB = 1000, 1000 * 1000
+SIZES = [1 * KB, 100 * KB, 1 * MB, 10 * MB, 50 * MB]
+
+_cache = {}
+
+
+ARTICLE = """
+<div class="article" id="article-{i}">
+  <h2 class="title"><a href="/articles/{i}" rel="bookmark">Article {i}</a></h2>
+  <div class="meta">
+    <span class="author">  Author {author}  </span>
+    <span class="date">2015-04-{day:02d}</span>
+    {price}
+  </div>
+  <div class="body">
+    <p>Lorem ipsum dolor sit amet, <b>consectetur</b> adipiscing elit.
+       Sed do eiusmod tempor <i>incididunt</i> ut labore et dolore.</p>
+    <p>Ut enim ad minim veniam, quis <a href="/tags/{tag}">nostrud</a>
+       exercitation ullamco laboris nisi ut aliquip ex ea commodo.</p>
+    <ul class="tags">
+      <li class="tag">t{tag}</li><li class="tag">t{tag2}</li>
+    </ul>
+  </div>
+</div>
+"""
+
+
+def article(i):
+    # only some articles have a price, so that queries hit Nulls
+    price = ('<span class="price">{0}.99</span>'.format(i % 100)
+             if i % 3 == 0 else '')
+    return ARTICLE.format(i=i, author=i % 17, day=i % 28 + 1, price=price,
+                          tag=i % 13, tag2=i % 7)
+
+
+def page(size):
+    """
+    An HTML page of roughly ``size`` bytes, made of repeated articles
+    """
+    key = ('page', size)
+    if key not in _cache:
+        parts = ['<html><head><title>Benchmark</title></head><body>'
+                 '<div id="main">']
+        total = 0
+        i = 0
+        while total < size or i == 0:
+            part = article(i)
+            parts.append(part)
+            total += len(part)
+            i += 1
+        parts.append('</div></body></html>')
+        _cache[key] = ''.join(parts)
+    return _cache[key]
+
+
+def table(rows, columns=5):
+    """
+    An HTML page with one large table
+    """
+    key = ('table', rows, columns)
+    if key not in _cache:
+        cell = '<td class="c{0}">{1}</td>'
+        body = ''.join(
+            '<tr>%s</tr>' % ''.join(cell.format(c, r * columns + c)
+                                    for c in range(columns))
+            for r in range(rows))
+        _cache[key] = (
+            '<html><body><table id="data"><thead><tr>%s</tr></thead>'
+            '<tbody>%s</tbody></table></body></html>' % (
+                ''.join('<th>h%i</th>' % c for c in range(columns)), body))
+    return _cache[key]
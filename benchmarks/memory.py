@@ -0,0 +1,79 @@
+"""
+Memory benchmarks for Soupy's wrapper objects.
+
+These follow the conventions of airspeed velocity (asv): ``track_*``
+methods return a number that asv records for each commit, and
+``peakmem_*`` methods are measured for their peak memory use.
+"""
+import tracemalloc
+
+from soupy import Soupy, Q, Scalar, Null, NullNode
+
+from .documents import table
+
+
+def _allocated(func):
+    """
+    Bytes still allocated by the result of func()
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+
+class WrapperSize(object):
+
+    """
+    Bytes used per wrapper object
+    """
+
+    unit = 'bytes'
+    count = 100000
+
+    def setup(self):
+        self.node = Soupy('<p>hi</p>', 'html.parser').find('p').val()
+
+    def track_scalar(self):
+        count = self.count
+        return _allocated(lambda: [Scalar(i) for i in range(count)]) / count
+
+    def track_node(self):
+        count, node = self.count, self.node
+        return _allocated(lambda: [Soupy(node) for _ in range(count)]) / count
+
+    def track_null(self):
+        count = self.count
+        return _allocated(lambda: [Null() for _ in range(count)]) / count
+
+    def track_null_node(self):
+        count = self.count
+        return _allocated(lambda: [NullNode() for _ in range(count)]) / count
+
+
+class NullHeavyQuery(object):
+
+    """
+    Queries where most optional fields are missing
+    """
+
+    unit = 'bytes'
+
+    def setup(self):
+        self.rows = Soupy(table(5000), 'html.parser').find_all('tr')
+        self.fields = [Q.find('missing%i' % i) for i in range(10)]
+
+    def track_missing_fields(self):
+        rows, fields = self.rows, self.fields
+        return _allocated(
+            lambda: [rows.each(field) for field in fields]) / len(rows)
+
+    def peakmem_missing_fields(self):
+        fields = dict(('f%i' % i, field.text.orelse(None))
+                      for i, field in enumerate(self.fields))
+        self.rows.dump(**fields).val()
@@ -0,0 +1,117 @@
+"""
+Benchmarks for building Soupy documents.
+"""
+import os
+import tempfile
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+from soupy import Soupy
+
+from .compat import require, requires
+from .documents import SIZES, MB, page
+
+PARSERS = ['html.parser', 'lxml', 'html5lib']
+
+
+def _require_parser(parser):
+    try:
+        BeautifulSoup('', parser)
+    except FeatureNotFound:
+        raise NotImplementedError("%s is not installed" % parser)
+
+
+class Parse(object):
+
+    params = (SIZES, PARSERS)
+    param_names = ['size', 'parser']
+    timeout = 600
+
+    def setup(self, size, parser):
+        _require_parser(parser)
+        if parser == 'html5lib' and size > 10 * MB:
+            raise NotImplementedError("too slow")
+        self.html = page(size)
+        self.data = self.html.encode('utf-8')
+
+    def time_soupy(self, size, parser):
+        Soupy(self.html, parser)
+
+    def peakmem_soupy(self, size, parser):
+        Soupy(self.html, parser)
+
+    @requires(index=True)
+    def time_soupy_index(self, size, parser):
+        Soupy(self.html, parser, index=True).find('a')
+
+    def time_soupy_bytes(self, size, parser):
+        # BeautifulSoup detects the encoding
+        Soupy(self.data, parser)
+
+    @requires('Soupy.from_bytes')
+    def time_from_bytes(self, size, parser):
+        Soupy.from_bytes(self.data, parser)
+
+
+class LxmlEngine(object):
+
+    params = [SIZES]
+    param_names = ['size']
+    timeout = 600
+
+    def setup(self, size):
+        _require_parser('lxml')
+        require(engine='lxml')
+        self.html = page(size)
+        self.data = self.html.encode('utf-8')
+
+    def time_soupy(self, size):
+        Soupy(self.html, engine='lxml')
+
+    def time_soupy_bytes(self, size):
+        Soupy(self.data, engine='lxml')
+
+    @requires('Soupy.from_bytes')
+    def time_from_bytes(self, size):
+        Soupy.from_bytes(self.data, engine='lxml')
+
+    def peakmem_soupy(self, size):
+        Soupy(self.html, engine='lxml')
+
+
+class Saved(object):
+
+    """
+    Reloading documents written by Soupy.save, instead of parsing them
+    """
+
+    params = [SIZES]
+    param_names = ['size']
+    timeout = 600
+
+    def setup(self, size):
+        _require_parser('lxml')
+        require('Soupy.save', 'Soupy.load')
+        self.doc = Soupy(page(size), 'lxml')
+        handle, self.path = tempfile.mkstemp(suffix='.soupy')
+        os.close(handle)
+        self.doc.save(self.path)
+
+    def teardown(self, size):
+        os.remove(self.path)
+
+    def time_save(self, size):
+        self.doc.save(self.path)
+
+    def time_load(self, size):
+        Soupy.load(self.path)
+
+    def peakmem_load(self, size):
+        Soupy.load(self.path)
+
+    def time_load_first_subtree(self, size):
+        Soupy.load(self.path, 'div').first()
+
+    def track_file_size(self, size):
+        return os.path.getsize(self.path) / float(size)
+    track_file_size.unit = 'bytes per byte of HTML'
@@ -0,0 +1,275 @@
+"""
+Benchmarks for searching documents and evaluating queries.
+"""
+import soupy
+from soupy import Soupy, Q, Scalar, Collection, Null
+
+from .compat import accepts, has, requires
+from .documents import SIZES, MB, page, table
+
+# Documents larger than this take too long to query repeatedly
+QUERY_SIZES = [size for size in SIZES if size <= 10 * MB]
+
+
+class Search(object):
+
+    # searches stop at the first match until the rest is needed, and
+    # matches are only wrapped in Nodes as they are used, so these
+    # iterate over the results to find and wrap every match
+
+    params = [QUERY_SIZES]
+    param_names = ['size']
+    timeout = 300
+
+    def setup(self, size):
+        self.doc = Soupy(page(size), 'html.parser')
+        if accepts(engine='lxml'):
+            self.lxml = Soupy(page(size), engine='lxml')
+        if accepts(index=True):
+            self.indexed = Soupy(page(size), 'html.parser', index=True)
+            self.indexed.find('a')  # build the index
+
+    def time_find(self, size):
+        self.doc.find('span', 'price')
+
+    def time_find_all(self, size):
+        list(self.doc.find_all('a'))
+
+    @requires(engine='lxml')
+    def time_find_all_lxml(self, size):
+        list(self.lxml.find_all('a'))
+
+    @requires(index=True)
+    def time_find_all_indexed(self, size):
+        list(self.indexed.find_all('a'))
+
+    def time_find_all_class(self, size):
+        list(self.doc.find_all('span', class_='price'))
+
+    @requires(index=True)
+    def time_find_all_class_indexed(self, size):
+        list(self.indexed.find_all('span', class_='price'))
+
+    def time_descendants(self, size):
+        list(self.doc.descendants)
+
+    def time_descendants_val(self, size):
+        self.doc.descendants.val()
+
+    def time_descendants_filter(self, size):
+        self.doc.descendants.filter(Q.name == 'a')
+
+    def time_select(self, size):
+        list(self.doc.select('div.article > h2 a[href]'))
+
+    @requires(engine='lxml')
+    def time_select_lxml(self, size):
+        list(self.lxml.select('div.article > h2 a[href]'))
+
+    @requires('compile_selector')
+    def time_select_compiled(self, size):
+        selector = soupy.compile_selector('div.article > h2 a[href]')
+        list(self.doc.select(selector))
+
+    def time_select_simple(self, size):
+        list(self.doc.select('span.price'))
+
+    @requires(index=True)
+    def time_select_simple_indexed(self, size):
+        list(self.indexed.select('span.price'))
+
+    def time_any(self, size):
+        # stops at the first match
+        self.doc.find_all('a').any()
+
+    def time_any_missing(self, size):
+        # has to search the whole document
+        self.doc.find_all('img').any()
+
+    def peakmem_descendants(self, size):
+        list(self.doc.descendants)
+
+
+class Extract(object):
+
+    params = [QUERY_SIZES]
+    param_names = ['size']
+    timeout = 300
+
+    def setup(self, size):
+        self.articles = Soupy(page(size), 'html.parser').find_all(
+            'div', 'article')
+        if accepts(cache=10000):
+            self.cached = Soupy(page(size), 'html.parser',
+                                cache=10000).find_all('div', 'article')
+        self.fields = dict(
+            title=Q.find('h2').text.strip(),
+            link=Q.find('h2').find('a')['href'],
+            author=Q.find('span', 'author').text.strip().lower(),
+            price=Q.find('span', 'price').text.map(float).orelse(None),
+            tags=Q.find_all('li', 'tag').each(Q.text).val(),
+        )
+        self.missing = dict(('f%i' % i, Q.find('missing%i' % i).text
+                             .orelse(None))
+                            for i in range(10))
+
+        # a page-level description, with many fields that each search
+        # the whole document
+        self.page = Soupy(page(size), 'html.parser')
+        self.page_fields = dict(self.missing)
+        for i, tag in enumerate(('h2', 'a', 'li', 'p', 'span')):
+            self.page_fields['first%i' % i] = Q.find(tag).text.orelse(None)
+            self.page_fields['count%i' % i] = Q.find_all(tag).count()
+            self.page_fields['class%i' % i] = Q.select(
+                '%s.tag' % tag).count()
+        for name in ('author', 'date', 'price', 'tag', 'meta', 'article'):
+            self.page_fields[name] = Q.find(class_=name).name.orelse(None)
+        if has('Schema'):
+            self.page_schema = soupy.Schema(**self.page_fields)
+        self.spans = Collection(list(self.page.find_all('span')))
+
+        # page-level fields that share the same search
+        articles = Q.find_all('div', 'article')
+        self.page_shared = dict(
+            count=articles.count(),
+            titles=articles.each(Q.find('h2').text).val(),
+            first=articles[0].find('h2').text,
+            last=articles[-1].find('h2').text)
+
+    def time_deep_chain(self, size):
+        self.articles.each(
+            Q.find('div', 'meta').find('span', 'author').text.strip()
+            .lower().replace('author', '').strip())
+
+    def time_dump(self, size):
+        self.articles.dump(**self.fields)
+
+    @requires(cache=10000)
+    def time_dump_cached(self, size):
+        # several fields share the find('div', 'meta') sub-query
+        self.cached.dump(
+            author=Q.find('div', 'meta').find('span', 'author').text,
+            date=Q.find('div', 'meta').find('span', 'date').text,
+            price=Q.find('div', 'meta').find('span', 'price').text
+            .orelse(None))
+
+    @requires('Collection.dump_columns')
+    def time_dump_columns(self, size):
+        self.articles.dump_columns(**self.fields)
+
+    def time_null_heavy(self, size):
+        self.articles.dump(**self.missing)
+
+    def time_page_dump(self, size):
+        self.page.dump(**self.page_fields)
+
+    @requires('Schema')
+    def time_page_schema(self, size):
+        self.page_schema(self.page)
+
+    def time_page_dump_shared(self, size):
+        self.page.dump(**self.page_shared)
+
+    def time_text_strip(self, size):
+        self.articles.each(Q.text.map(lambda text: ' '.join(text.split())))
+
+    @requires('Node.text_')
+    def time_text_(self, size):
+        self.articles.each(Q.text_())
+
+    def time_page_text_prefix(self, size):
+        self.page.text.map(lambda text: ' '.join(text.split())[:200])
+
+    @requires('Node.text_')
+    def time_page_text_limit(self, size):
+        self.page.text_(limit=200)
+
+    def time_filter_startswith(self, size):
+        self.spans.filter(Q.text.strip().startswith('Author'))
+
+    @requires('Collection.match')
+    def time_match(self, size):
+        self.spans.match(r'\s*Author')
+
+    def time_filter_in(self, size):
+        self.spans.filter(Q.text.map(lambda text: 'Author 7' in text))
+
+    @requires('Collection.contains')
+    def time_contains(self, size):
+        self.spans.contains('Author 7')
+
+    @requires('Collection.lazy')
+    def time_lazy_first(self, size):
+        (self.articles.lazy()
+         .each(Q.find('span', 'price').orelse(None))
+         .filter(Q.val()).first())
+
+    def peakmem_dump(self, size):
+        self.articles.dump(**self.fields).val()
+
+
+class Table(object):
+
+    params = [[100, 10000]]
+    param_names = ['rows']
+
+    def setup(self, rows):
+        self.doc = Soupy(table(rows), 'html.parser')
+        if accepts(engine='lxml'):
+            self.lxml = Soupy(table(rows), engine='lxml')
+
+    def time_find_all_cells(self, rows):
+        self.doc.find('tbody').find_all('tr').each(
+            Q.find_all('td').each(Q.text.strip()))
+
+    @requires('Node.table_rows')
+    def time_table_rows(self, rows):
+        self.doc.table_rows()
+
+    @requires('LxmlNode.table_rows', engine='lxml')
+    def time_table_rows_lxml(self, rows):
+        self.lxml.table_rows()
+
+    @requires('Node.to_records')
+    def time_to_records(self, rows):
+        self.doc.to_records()
+
+
+class Expressions(object):
+
+    """
+    The overhead of evaluating Q expressions, on plain values
+    """
+
+    def setup(self):
+        self.values = Collection(Scalar(' Value %i ' % i)
+                                 for i in range(10000))
+        self.expr = Q.strip().lower().replace('value', '').strip()[0:3]
+        self.arith = (Q.__len__() + 3) * 2 > 10
+        self.numbers = Collection(Scalar(i * 0.5) if i % 10 else Null()
+                                  for i in range(10000))
+        self.scale = (Q - 100) * 1.5 + 1
+
+    def time_eval(self):
+        expr = self.expr
+        for item in self.values:
+            expr.eval_(item)
+
+    @requires('Expression.compile_')
+    def time_compiled(self):
+        func = self.expr.compile_()
+        for item in self.values:
+            func(item)
+
+    def time_each(self):
+        self.values.each(self.expr)
+
+    def time_filter_binary_op(self):
+        self.values.filter(self.arith)
+
+    def time_each_numeric(self):
+        self.numbers.each(self.scale.orelse(None))
+
+    @requires('Collection.vmap')
+    def time_vmap_numeric(self):
+        self.numbers.vmap(self.scale)
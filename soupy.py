@@ -1,43 +1,140 @@
 from __future__ import print_function, division, unicode_literals
 
 from abc import ABCMeta, abstractproperty, abstractmethod
-from collections import namedtuple
+import array
+from bisect import bisect_left, bisect_right
+import codecs
+from collections import namedtuple, deque, OrderedDict
+try:
+    from collections.abc import Iterator
+except ImportError:  # Python 2
+    from collections import Iterator
 from distutils.version import LooseVersion
 from functools import wraps
-from itertools import takewhile, dropwhile
+from itertools import takewhile, dropwhile, islice, chain, compress
+import multiprocessing
 import operator
 import re
+import struct
 import sys
+import threading
+from timeit import default_timer
+from xml.etree import ElementTree
 
 try:
-    from bs4 import BeautifulSoup, PageElement, NavigableString
+    from bs4 import (BeautifulSoup, PageElement, NavigableString, Tag,
+                     SoupStrainer)
+    from bs4 import element as bs4_element
+    from bs4.builder import HTMLTreeBuilder
+    from bs4.dammit import UnicodeDammit
 except ImportError:  # pragma: no cover
     raise ImportError("Soupy requires beautifulsoup4")
 
 try:
     import six
-    from six.moves import map
+    from six.moves import map, filter
     assert LooseVersion(six.__version__) >= LooseVersion('1.9')
 except(ImportError, AssertionError):   # pragma: no cover
     raise ImportError("Soupy requires six version 1.9 or later")
 
+try:
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    futures = None
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    etree = None
+
+try:
+    from lxml.cssselect import CSSSelector
+except ImportError:  # pragma: no cover
+    CSSSelector = None
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # pragma: no cover
+    ContextVar = None
+
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+try:
+    import soupsieve
+except ImportError:  # pragma: no cover
+    soupsieve = None
+
 __version__ = '0.4.dev'
 
-__all__ = ['Soupy', 'Q', 'Node', 'Scalar', 'Collection',
-           'Null', 'NullNode', 'NullCollection',
-           'either', 'NullValueError', 'QDebug']
+__all__ = ['Soupy', 'Q', 'Node', 'LxmlNode', 'Scalar', 'Collection',
+           'LazyCollection', 'Null', 'NullNode', 'NullCollection',
+           'either', 'batch', 'strainer', 'aextract', 'abatch',
+           'compile_selector', 'CompiledSelector', 'profile', 'Profile',
+           'Schema', 'encoding_stats', 'NullValueError', 'QDebug',
+           'BatchResult', 'ProfileStats']
 
 
 # extract the thing inside string reprs (eg u'abc' -> abc)
 QUOTED_STR = re.compile("^[ub]?['\"](.*?)['\"]$")
 
+# CSS selectors like tag#id.class, which a document index can answer
+_IDENT = r'-?[^\W\d][\w-]*'
+SIMPLE_SELECTOR = re.compile(r'^({0})?((?:[#.]{0})*)$'.format(_IDENT),
+                             re.UNICODE)
+SELECTOR_TOKEN = re.compile(r'([#.])({0})'.format(_IDENT), re.UNICODE)
+
+# Encodings declared in Content-Type headers, <meta> tags and
+# XML declarations (see Soupy.from_bytes)
+HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([^"\';\s]+)', re.I)
+META_CHARSET = re.compile(br'<meta[^>]*?charset\s*=\s*["\']?\s*([\w.:-]+)',
+                          re.I)
+XML_ENCODING = re.compile(br'^\s*<\?xml[^>]*?encoding\s*=\s*["\']([\w.:-]+)')
+
 QDebug = namedtuple('QDebug', ('expr', 'inner_expr', 'val', 'inner_val'))
 """Namedtuple that holds information about a failed expression evaluation."""
 
+BatchResult = namedtuple('BatchResult', ('index', 'value', 'error'))
+"""Namedtuple that holds the outcome of one document processed by batch."""
+
+ProfileStats = namedtuple('ProfileStats', ('expr', 'step', 'depth', 'calls',
+                                           'time', 'nulls'))
+"""Namedtuple that holds the timings of one step of a profiled expression."""
+
+
+class _LocalVar(threading.local):
+
+    """
+    A thread-local stand-in for contextvars.ContextVar (Python < 3.7)
+    """
+
+    def __init__(self, name, default=None):
+        self.value = default
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+# Debugging info for the last failed expression evaluation. Each
+# thread (and asyncio task) has its own copy, so concurrent
+# evaluations don't race.
+_DEBUG_INFO = (ContextVar or _LocalVar)('soupy_debug_info', default=None)
+
+# The active Profile (see profile), or None
+_PROFILE = (ContextVar or _LocalVar)('soupy_profile', default=None)
+
 
 @six.add_metaclass(ABCMeta)
 class Wrapper(object):
 
+    # wrappers are created in large numbers, so avoid per-instance dicts
+    __slots__ = ()
+
     @abstractmethod
     def val(self):
         pass  # pragma: no cover
@@ -90,6 +187,10 @@ class Wrapper(object):
         if hasattr(value, 'children'):
             return Node(value)
 
+        if etree is not None and isinstance(value, (etree._Element,
+                                                    etree._ElementTree)):
+            return LxmlNode._from_element(value)
+
         return Scalar(value)
 
     def __getitem__(self, key):
@@ -124,16 +225,23 @@ class Wrapper(object):
             >> name, text = soup.dump(Q.name, Q.text).val()
             >> (name, text) == ('hi', 'b')
             True
+
+        Q expressions that start the same way, like ``Q.find('h1').text``
+        and ``Q.find('h1')['id']``, only evaluate the shared part
+        (``Q.find('h1')``) once.
         """
         if args and kwargs:
             raise ValueError('Cannot pass both arguments and keywords to dump')
 
-        if args:
-            result = tuple(_unwrap(self.apply(func)) for func in args)
+        names = None if args else list(kwargs.keys())
+        funcs = args or list(kwargs.values())
+
+        plan = _dump_plan(funcs) if isinstance(self, Some) else None
+        if plan is not None:
+            values = plan(self)
         else:
-            result = dict((name, _unwrap(self.apply(func)))
-                          for name, func in kwargs.items())
-        return Wrapper.wrap(result)
+            values = [_unwrap(self.apply(func)) for func in funcs]
+        return Wrapper.wrap(_dump_result(names, values))
 
     @abstractmethod
     def require(self, func, msg='Requirement Violated'):
@@ -169,8 +277,25 @@ class BaseNull(Wrapper):
     """
     This is the base class for null wrappers. Null values are returned
     when the result of a function is ill-defined.
+
+    Null wrappers are immutable, so each class has a single instance.
     """
 
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        instance = cls.__dict__.get('_instance')
+        if instance is None:
+            instance = super(BaseNull, cls).__new__(cls)
+            cls._instance = instance
+        return instance
+
+    def __setattr__(self, key, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __delattr__(self, key):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
     def val(self):
         """
         Raise :class:`NullValueError`
@@ -229,6 +354,9 @@ class BaseNull(Wrapper):
     def __hash__(self):
         return hash(type(self))
 
+    def __reduce__(self):
+        return type(self), ()
+
     def __eq__(self, other):
         return type(self)()
 
@@ -239,6 +367,8 @@ class BaseNull(Wrapper):
 @six.python_2_unicode_compatible
 class Some(Wrapper):
 
+    __slots__ = ('_value',)
+
     def __init__(self, value):
         self._value = value
 
@@ -335,6 +465,9 @@ class Some(Wrapper):
     def __hash__(self):
         return hash(self._value)
 
+    def __reduce__(self):
+        return type(self), (self._value,)
+
     def __eq__(self, other):
         return self.map(lambda x: x == other)
 
@@ -348,6 +481,8 @@ class Null(BaseNull):
     The class for ill-defined Scalars.
     """
 
+    __slots__ = ()
+
     def __getattr__(self, attr):
         return Null()
 
@@ -427,6 +562,8 @@ class Scalar(Some):
 
     """
 
+    __slots__ = ()
+
     def __getattr__(self, attr):
         return self.map(operator.attrgetter(attr))
 
@@ -502,6 +639,8 @@ class Collection(Some):
     They support most of the list methods (len, iter, getitem, etc).
     """
 
+    __slots__ = ('_items',)
+
     def __init__(self, items):
         super(Collection, self).__init__(list(items))
         self._items = self._value
@@ -512,11 +651,40 @@ class Collection(Some):
             if not isinstance(item, Wrapper):
                 raise TypeError("Collection can only hold other wrappers")
 
+    @staticmethod
+    def _from_wrappers(items):
+        """
+        Build a Collection from items that are known to be wrappers,
+        without checking each one
+        """
+        result = object.__new__(Collection)
+        result._value = result._items = list(items)
+        return result
+
+    def _derive(self, items):
+        """
+        Build a new collection of the same kind from an iterable of items
+        """
+        return Collection(items)
+
+    def lazy(self):
+        """
+        Return a :class:`LazyCollection` that streams over the items
+        in this collection.
+
+        Example:
+
+            >>> c = Collection(map(Scalar, range(100)))
+            >>> c.lazy().each(Q * 2).filter(Q > 10).first()
+            Scalar(12)
+        """
+        return LazyCollection(self._items)
+
     def val(self):
         """
         Unwraps each item in the collection, and returns as a list
         """
-        return list(self.iter_val())
+        return [item.val() for item in self._items]
 
     def first(self):
         """
@@ -528,7 +696,7 @@ class Collection(Some):
         """
         An iterator version of :meth:`val`
         """
-        return (item.val() for item in self._items)
+        return (item.val() for item in self)
 
     def each(self, *funcs):
         """
@@ -552,11 +720,11 @@ class Collection(Some):
         funcs = list(map(_make_callable, funcs))
 
         if len(funcs) == 1:
-            return Collection(map(funcs[0], self._items))
+            return self._derive(map(funcs[0], self))
 
         tupler = lambda item: Scalar(
             tuple(_unwrap(func(item)) for func in funcs))
-        return Collection(map(tupler, self._items))
+        return self._derive(map(tupler, self))
 
     def exclude(self, func=None):
         """
@@ -603,7 +771,7 @@ class Collection(Some):
             node.find_all('a').filter(Q['href'].startswith('http'))
         """
         func = _make_callable(func)
-        return Collection(filter(func, self._items))
+        return self._derive(filter(func, self))
 
     def takewhile(self, func=None):
         """
@@ -624,7 +792,7 @@ class Collection(Some):
 
         """
         func = _make_callable(func)
-        return Collection(takewhile(func, self._items))
+        return self._derive(takewhile(func, self))
 
     def dropwhile(self, func=None):
         """
@@ -640,7 +808,111 @@ class Collection(Some):
             before the first item where bool(func(item)) == True
         """
         func = _make_callable(func)
-        return Collection(dropwhile(func, self._items))
+        return self._derive(dropwhile(func, self))
+
+    def match(self, pattern, flags=0, mask=False):
+        """
+        Keep the items whose text matches a regular expression
+        at its start (like ``re.match``).
+
+        The pattern is compiled once, and matched against the text of
+        every item in a single loop, which is much faster than
+        ``filter(Q.text.map(...))``. Null items never match.
+
+        Parameters:
+
+            pattern : str or compiled regular expression
+            flags : int (optional)
+                Flags for ``re.compile``
+            mask : bool (optional)
+                If True, return a Scalar(list of bools) (one per item)
+                instead of a Collection
+
+        Examples:
+
+            >>> c = Collection([Scalar('Price: 3'), Scalar('Tax: 1')])
+            >>> c.match(r'Price: \\d')
+            Collection([Scalar(u'Price: 3')])
+            >>> c.match('price', re.I, mask=True)
+            Scalar([True, False])
+        """
+        match = re.compile(pattern, flags).match
+        return self._text_filter(
+            lambda texts: [text is not None and match(text) is not None
+                           for text in texts], mask)
+
+    def contains(self, substr, mask=False):
+        """
+        Keep the items whose text contains a substring.
+
+        The texts are joined, and searched for substr in one pass,
+        so this is fastest when few items match. Null items never match.
+
+        Parameters:
+
+            substr : str
+            mask : bool (optional)
+                If True, return a Scalar(list of bools) (one per item)
+                instead of a Collection
+
+        Examples:
+
+            >>> c = Collection([Scalar('a cat'), Null(), Scalar('a dog')])
+            >>> c.contains('cat')
+            Collection([Scalar(u'a cat')])
+            >>> c.contains('a', mask=True)
+            Scalar([True, False, True])
+        """
+        return self._text_filter(
+            lambda texts: _contains(texts, substr), mask)
+
+    def extract(self, pattern, group=None, flags=0):
+        """
+        Search the text of each item for a regular expression
+        (like ``re.search``), and collect one of its groups.
+
+        Parameters:
+
+            pattern : str or compiled regular expression
+            group : int or str (optional)
+                The group to extract. Default is the first group, or
+                the whole match if the pattern has no groups
+            flags : int (optional)
+                Flags for ``re.compile``
+
+        Returns:
+
+            A new Collection, with a Scalar of the group for each item,
+            or Null where the item is null or doesn't match
+
+        Examples:
+
+            >>> c = Collection([Scalar('$3.50'), Scalar('free')])
+            >>> c.extract(r'\\$([\\d.]+)')
+            Collection([Scalar(u'3.50'), Null()])
+        """
+        regex = re.compile(pattern, flags)
+        if group is None:
+            group = 1 if regex.groups else 0
+        search = regex.search
+
+        values = []
+        for text in _item_texts(self):
+            found = search(text) if text is not None else None
+            value = found.group(group) if found is not None else None
+            values.append(Null() if value is None else Scalar(value))
+        return self._derive(values)
+
+    def _text_filter(self, matcher, mask):
+        """
+        Filter the items (or build a mask) with matcher, which turns
+        the list of item texts into a list of bools
+        """
+        items = list(self)
+        hits = matcher(_item_texts(items))
+        if mask:
+            return Scalar(hits)
+        return self._derive(compress(items, hits))
 
     def __getitem__(self, key):
         if isinstance(key, int):
@@ -650,7 +922,7 @@ class Collection(Some):
                 return NullNode()
 
         # slice
-        return Collection(list(self._items).__getitem__(key))
+        return self._derive(self._items[key])
 
     def dump(self, *args, **kwargs):
         """
@@ -666,7 +938,161 @@ class Collection(Some):
             >>> c.dump(x2=Q*2, m1=Q-1).val()
             [{'x2': 2, 'm1': 0}, {'x2': 4, 'm1': 1}]
         """
-        return self.each(Q.dump(*args, **kwargs))
+        dump = Q.dump(*args, **kwargs)
+        if args and kwargs:
+            return self.each(dump)
+
+        # plan how to share the work between fields once,
+        # rather than for every item
+        names = None if args else list(kwargs.keys())
+        plan = _dump_plan(args or list(kwargs.values()))
+        if plan is None:
+            return self.each(dump)
+
+        dump = _make_callable(dump)
+
+        def dump_item(item):
+            if isinstance(item, Some) and not isinstance(item, Collection):
+                return Wrapper.wrap(_dump_result(names, plan(item)))
+            return dump(item)
+
+        return self.each(dump_item)
+
+    def dump_columns(self, *args, **kwargs):
+        """
+        Like :meth:`dump`, but build one list per field, instead
+        of one dict per item.
+
+        The result is a Scalar(dict) of lists (or a Scalar(tuple) of lists,
+        for positional arguments). No intermediate per-item dicts or
+        wrappers are created, and the items are only iterated over once.
+
+        A field can also be given as a ``(function, typecode)`` tuple,
+        to store the column in a typed container. Single-character
+        typecodes build an ``array.array`` (eg ``'d'`` for floats,
+        ``'l'`` for integers). Any other typecode is treated as a
+        NumPy dtype, and builds a NumPy array.
+
+        Examples:
+
+            >>> c = Collection([Scalar(1), Scalar(2)])
+            >>> c.dump_columns(x2=Q*2, m1=Q-1).val() == {'x2': [2, 4],
+            ...                                         'm1': [0, 1]}
+            True
+            >>> c.dump_columns(x=(Q * 1.5, 'd')).val()
+            {'x': array('d', [1.5, 3.0])}
+        """
+        if args and kwargs:
+            raise ValueError('Cannot pass both arguments and keywords '
+                             'to dump_columns')
+
+        names = list(kwargs.keys()) if kwargs else None
+        specs = list(kwargs.values()) if kwargs else list(args)
+
+        funcs, typecodes = [], []
+        for spec in specs:
+            if isinstance(spec, tuple):
+                spec, typecode = spec
+            else:
+                typecode = None
+            funcs.append(_make_callable(spec))
+            typecodes.append(typecode)
+
+        columns = [[] for _ in funcs]
+        fields = list(zip(funcs, [column.append for column in columns]))
+
+        for item in self:
+            for func, append in fields:
+                append(_unwrap(func(item)))
+
+        columns = [_typed_column(column, typecode)
+                   for column, typecode in zip(columns, typecodes)]
+
+        if names is None:
+            return Scalar(tuple(columns))
+        return Scalar(dict(zip(names, columns)))
+
+    def values_array(self, dtype=float):
+        """
+        Collect the values of the items into a NumPy masked array.
+
+        Null items are masked, instead of raising NullValueError.
+
+        Parameters:
+
+            dtype : NumPy dtype (optional)
+                The type of the array. Default is float. If None,
+                NumPy infers the type from the values.
+
+        Returns:
+
+            A Scalar(numpy.ma.MaskedArray)
+
+        Examples:
+
+            >>> c = Collection([Scalar('1.5'), Null(), Scalar(3)])
+            >>> c.values_array().val()
+            masked_array(data=[1.5, --, 3.0],
+                         mask=[False,  True, False],
+                   fill_value=1e+20)
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("values_array requires NumPy")
+
+        values, masked = [], []
+        for i, item in enumerate(self):
+            if isinstance(item, BaseNull):
+                masked.append(i)
+            else:
+                values.append(item.val())
+
+        present = np.asarray(values, dtype=dtype)
+        if not masked:
+            return Scalar(np.ma.MaskedArray(present))
+
+        mask = np.zeros(len(values) + len(masked), dtype=bool)
+        mask[masked] = True
+        data = np.zeros(len(mask), dtype=present.dtype)
+        data[~mask] = present
+        if len(present):
+            # a valid value keeps functions like log quiet
+            data[mask] = present[0]
+        return Scalar(np.ma.MaskedArray(data, mask=mask))
+
+    def vmap(self, func, dtype=float):
+        """
+        Call a function once, on an array of all the item values.
+
+        This is much faster than :meth:`each` for numeric work, since
+        functions like NumPy ufuncs and arithmetic Q expressions
+        (``Q * 10``, ``(Q - Q.mean()) / Q.std()``) process the
+        whole array at once. Null items are masked, and stay
+        masked in the result.
+
+        Parameters:
+
+            func : function(numpy.ma.MaskedArray)
+                The function to call
+            dtype : NumPy dtype (optional)
+                The type of the array (see :meth:`values_array`)
+
+        Returns:
+
+            A Scalar of the result (usually a masked array)
+
+        Examples:
+
+            >>> c = Collection([Scalar(1), Null(), Scalar(3)])
+            >>> c.vmap(Q * 10).val()
+            masked_array(data=[10.0, --, 30.0],
+                         mask=[False,  True, False],
+                   fill_value=1e+20)
+            >>> c.vmap(Q.sum()).val()
+            4.0
+        """
+        return self.values_array(dtype).map(func)
 
     def __len__(self):
         return self.map(len).val()
@@ -723,26 +1149,31 @@ class Collection(Some):
         return Scalar(dict(zip(_unwrap(keys), self.val())))
 
     def __iter__(self):
-        for item in self._items:
-            yield item
+        return iter(self._items)
 
     def all(self):
         """
         Scalar(True) if all items are truthy, or collection is empty.
+
+        Stops at the first falsey item.
         """
-        return self.map(all)
+        return Scalar(all(self))
 
     def any(self):
         """
         Scalar(True) if any items are truthy. False if empty.
+
+        Stops at the first truthy item.
         """
-        return self.map(any)
+        return Scalar(any(self))
 
     def none(self):
         """
         Scalar(True) if no items are truthy, or collection is empty.
+
+        Stops at the first truthy item.
         """
-        return self.map(lambda items: not any(items))
+        return Scalar(not any(self))
 
     def __bool__(self):
         return bool(self._items)
@@ -750,6 +1181,221 @@ class Collection(Some):
     __nonzero__ = __bool__
 
 
+class LazyCollection(Collection):
+
+    """
+    A Collection that streams its items instead of storing them.
+
+    Calls to :meth:`each`, :meth:`filter`, :meth:`takewhile`,
+    :meth:`dropwhile`, :meth:`first`, :meth:`any`, :meth:`all`,
+    :meth:`none` and slicing are fused into a single pass,
+    which only consumes as many items as it needs.
+    The items are only stored in a list when calling :meth:`val`,
+    ``len``, or indexing with an integer.
+
+    Like a generator, a LazyCollection can only be iterated over
+    once, unless it has been materialized.
+
+    Use :meth:`Collection.lazy` to build one.
+
+    Examples:
+
+        node.find_all('tr').lazy().each(Q.find('td')).filter(Q.text).first()
+    """
+
+    __slots__ = ('_source', '_cache')
+
+    def __init__(self, items):
+        self._source = iter(items)
+        self._cache = None
+
+    @property
+    def _items(self):
+        if self._cache is None:
+            self._cache = list(self._stream())
+        return self._cache
+
+    _value = _items
+
+    def _stream(self):
+        while self._cache is None:
+            try:
+                item = next(self._source)
+            except StopIteration:
+                return
+            if not isinstance(item, Wrapper):
+                raise TypeError("Collection can only hold other wrappers")
+            yield item
+
+        # materialized mid-stream (eg by len()), so
+        # the remaining items are in the cache
+        for item in self._cache:
+            yield item
+
+    def _derive(self, items):
+        return LazyCollection(items)
+
+    def lazy(self):
+        return self
+
+    def first(self):
+        for item in self:
+            return item
+        return NullNode()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and self._cache is None:
+            start, stop, step = key.start, key.stop, key.step
+            if all(k is None or k >= 0 for k in (start, stop, step)):
+                return LazyCollection(islice(self, start, stop, step))
+
+        return super(LazyCollection, self).__getitem__(key)
+
+    def __iter__(self):
+        if self._cache is not None:
+            return iter(self._cache)
+        return self._stream()
+
+    def __bool__(self):
+        if self._cache is not None:
+            return bool(self._cache)
+
+        for item in self._stream():
+            # put the item back, so it can still be iterated over
+            self._source = chain([item], self._source)
+            return True
+        return False
+
+    __nonzero__ = __bool__
+
+
+@six.python_2_unicode_compatible
+class _DeferredCollection(Collection):
+
+    """
+    The Collection of elements found by searching from a Node.
+
+    The search runs when it is called, but only up to the first
+    match, which answers :meth:`first`, :meth:`any`, :meth:`all`,
+    :meth:`none` and ``bool``. The rest of the search runs (once)
+    when anything else needs the items.
+
+    The elements that are found are stored unwrapped, and only
+    wrapped in Nodes as they are accessed. Each Node is kept once it
+    has been built, so every access to an item gives the same Node.
+    :meth:`val`, ``len`` and :meth:`count` don't create any Nodes.
+    """
+
+    __slots__ = ('_node', '_search', '_first', '_elements', '_nodes')
+
+    def __init__(self, node, search):
+        # search(limit) returns an iterable of the elements that match,
+        # and may stop after limit of them (None for all of them).
+        # Running it now raises errors at the time of the call.
+        found = list(search(1))
+        self._node = node
+        self._first = found[:1]
+        # no matches, or a search that ignores the limit, is complete
+        self._search = search if len(found) == 1 else None
+        self._elements = None if len(found) == 1 else found
+        self._nodes = {}  # index -> the Node for that element, once built
+
+    def _found(self):
+        """
+        Every element found by the search
+        """
+        elements = self._elements
+        if elements is None:
+            elements = self._elements = list(self._search(None))
+            self._search = None
+            if not elements or elements[0] is not self._first[0]:
+                # the tree has changed since the search was called
+                self._first = elements[:1]
+                self._nodes.pop(0, None)
+        return elements
+
+    def _wrapped(self, index):
+        node = self._nodes.get(index)
+        if node is None:
+            elements = self._first if index == 0 else self._found()
+            node = self._nodes[index] = self._node._wrap(elements[index])
+        return node
+
+    @property
+    def _items(self):
+        return [self._wrapped(i) for i in range(len(self._found()))]
+
+    _value = _items
+
+    def val(self):
+        return list(self._found())
+
+    def lazy(self):
+        return LazyCollection(self)
+
+    def first(self):
+        return self._wrapped(0) if self._first else NullNode()
+
+    def __getitem__(self, key):
+        size = len(self._found())
+        if not isinstance(key, int):
+            indices = range(size)[key]
+            return Collection._from_wrappers(map(self._wrapped, indices))
+
+        if key < 0:
+            key += size
+        if not 0 <= key < size:
+            return NullNode()
+        return self._wrapped(key)
+
+    def __iter__(self):
+        return map(self._wrapped, range(len(self._found())))
+
+    def __len__(self):
+        return len(self._found())
+
+    # Nodes are always truthy, so these only depend on whether
+    # there is a first item
+
+    def all(self):
+        return Scalar(True)
+
+    def any(self):
+        return Scalar(bool(self._first))
+
+    def none(self):
+        return Scalar(not self._first)
+
+    def __bool__(self):
+        return bool(self._first)
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        return "Collection(%s)" % _repr(self._items)
+
+    def __reduce__(self):
+        return Collection, (self._items,)
+
+
+def _limited_search(element, method, args, kwargs):
+    """
+    Build a search function for _DeferredCollection, that calls a
+    BeautifulSoup find_all-style method and passes the limit through
+    """
+    def search(limit):
+        func = getattr(element, method)
+        # limit's position varies between methods, so only
+        # add it if the positional arguments stop before it
+        if limit is None or len(args) > 2:
+            return func(*args, **kwargs)
+        if kwargs.get('limit'):
+            limit = min(limit, kwargs['limit'])
+        return func(*args, **dict(kwargs, limit=limit))
+
+    return search
+
+
 class NullCollection(BaseNull, Collection):
 
     """
@@ -758,6 +1404,8 @@ class NullCollection(BaseNull, Collection):
     Returned by some methods on other Null objects.
     """
 
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -776,6 +1424,18 @@ class NullCollection(BaseNull, Collection):
     def dropwhile(self, func=None):
         return self
 
+    def match(self, pattern, flags=0, mask=False):
+        return Null() if mask else self
+
+    def contains(self, substr, mask=False):
+        return Null() if mask else self
+
+    def extract(self, pattern, group=None, flags=0):
+        return self
+
+    def lazy(self):
+        return self
+
     def first(self):
         return NullNode()  # XXX don't like this assumption
 
@@ -789,16 +1449,340 @@ class NullCollection(BaseNull, Collection):
     def dump(self, *args, **kwargs):
         return NullCollection()
 
+    def dump_columns(self, *args, **kwargs):
+        return Null()
+
+    def values_array(self, dtype=float):
+        return Null()
+
+    def vmap(self, func, dtype=float):
+        return Null()
+
     def count(self):
         return Scalar(0)
 
 
-@six.add_metaclass(ABCMeta)
-class NodeLike(object):
+def _item_texts(items):
+    """
+    The text of each item in a Collection (the value, for Scalars),
+    or None for null items
+    """
+    texts = []
+    for item in items:
+        if isinstance(item, BaseNull):
+            texts.append(None)
+            continue
+        if isinstance(item, NodeLike):
+            item = item.text
+        value = item.val()
+        if not isinstance(value, six.string_types):
+            value = six.text_type(value)
+        texts.append(value)
+    return texts
+
+
+def _contains(texts, substr):
+    """
+    Whether each text (or None) contains substr, for Collection.contains
 
-    # should return NodeLike
-    parent = abstractproperty()
-    next_sibling = abstractproperty()
+    The texts are joined into one string, which is searched with
+    str.find. Hits are mapped back to texts by their offsets.
+    """
+    hits = [False] * len(texts)
+    if not substr:
+        return [text is not None for text in texts]
+
+    starts, ends, parts, offset = [], [], [], 0
+    for text in texts:
+        text = text or ''
+        starts.append(offset)
+        offset += len(text)
+        ends.append(offset)
+        offset += 1
+        parts.append(text)
+    buf = '\x00'.join(parts)
+
+    size = len(substr)
+    find = buf.find
+    pos = find(substr)
+    while pos != -1:
+        index = bisect_right(starts, pos) - 1
+        if pos + size <= ends[index]:
+            hits[index] = True
+            if index + 1 == len(starts):
+                break
+            # skip the rest of this text
+            pos = find(substr, starts[index + 1])
+        else:
+            # runs into the next text
+            pos = find(substr, pos + 1)
+    return hits
+
+
+def _memoized(method):
+    """
+    Decorator for Node methods, whose results are stored in the
+    document's query cache (see Soupy), if it has one
+    """
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        doc = self._doc
+        if doc is None or doc.cache is None:
+            return method(self, *args, **kwargs)
+
+        key = (id(self._value), name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:  # eg find(attrs={...})
+            return method(self, *args, **kwargs)
+
+        return doc.cache.get(key, self._value,
+                             lambda: method(self, *args, **kwargs))
+
+    return wrapper
+
+
+def _normalize_text(strings, strip=True, collapse=True, limit=None,
+                    separator=' '):
+    """
+    Join and normalize strings for Node.text_, stopping
+    once limit characters have been built
+    """
+    if limit is not None and limit < 0:
+        raise ValueError("limit must not be negative, got %r" % (limit,))
+
+    chunks = _separated(strings, separator)
+    if limit is None:
+        return _normalize(''.join(chunks), strip, collapse)
+
+    # The normalized prefix of some text is a prefix of the normalized
+    # text, so the result can be cut from any prefix that normalizes to
+    # at least limit characters. Doubling the prefix keeps this linear.
+    buffer, size, target = [], 0, max(limit, 1)
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= target:
+            text = _normalize(''.join(buffer), strip, collapse)
+            if len(text) >= limit:
+                return text[:limit]
+            target = 2 * size
+    return _normalize(''.join(buffer), strip, collapse)[:limit]
+
+
+def _separated(strings, separator):
+    first = True
+    for string in strings:
+        if not first and separator:
+            yield separator
+        first = False
+        yield string
+
+
+def _normalize(text, strip, collapse):
+    if collapse:
+        result = ' '.join(text.split())
+        if strip or not text:
+            return result
+        if not result:
+            return ' '
+        if text[0].isspace():
+            result = ' ' + result
+        if text[-1].isspace():
+            result += ' '
+        return result
+    return text.strip() if strip else text
+
+
+# HTML caps on cell spans
+_MAX_COLSPAN = 1000
+_MAX_ROWSPAN = 65534
+
+SPAN_VALUE = re.compile(r'\s*(\d+)')
+
+
+def _span(value, default, maximum):
+    """
+    Parse a colspan or rowspan attribute, like browsers do
+    """
+    if value is None:
+        return default
+    match = SPAN_VALUE.match(value)
+    if match is None:
+        return default
+    return min(int(match.group(1)), maximum)
+
+
+def _table_grid(sections):
+    """
+    Expand the cells of a table into a grid of text.
+
+    sections is a list of (name, rows) pairs for the thead, tbody and
+    tfoot of the table (rows outside of these belong to a 'tbody').
+    Each row is a list of (text, is_header, colspan, rowspan) cells.
+
+    Returns the rows of the grid, padded with None to the same width,
+    and the number of rows in thead.
+    """
+    order = {'thead': 0, 'tfoot': 2}
+    sections = sorted(sections, key=lambda section: order.get(section[0], 1))
+
+    rows, header_rows, width = [], 0, 0
+    for name, section in sections:
+        pending = {}  # column -> [rows left, text] for rowspans
+        for index, cells in enumerate(section):
+            row = dict((col, span[1]) for col, span in pending.items())
+            pending = dict((col, [left - 1, text])
+                           for col, (left, text) in pending.items()
+                           if left > 1)
+
+            col = 0
+            for text, _, colspan, rowspan in cells:
+                while col in row:
+                    col += 1
+                if rowspan == 0:  # until the end of the section
+                    rowspan = len(section) - index
+                for col in range(col, col + max(colspan, 1)):
+                    row[col] = text
+                    if rowspan > 1:
+                        pending[col] = [rowspan - 1, text]
+                col += 1
+
+            if name == 'thead':
+                header_rows += 1
+            rows.append(row)
+            if row:
+                width = max(width, max(row) + 1)
+
+    grid = [[row.get(col) for col in range(width)] for row in rows]
+    return grid, header_rows
+
+
+def _table_records(sections, header=True, columns=False):
+    """
+    Convert a table into records (or columns), for Node.to_records
+    """
+    grid, header_rows = _table_grid(sections)
+    width = len(grid[0]) if grid else 0
+
+    if header is True:
+        header_rows = header_rows or min(len(grid), 1)
+        names = _column_names(grid[:header_rows], width)
+        grid = grid[header_rows:]
+    elif not header:
+        names = list(range(width))
+    else:
+        names = list(header)
+        if len(names) > width:
+            padding = [None] * (len(names) - width)
+            grid = [row + padding for row in grid]
+        # name any extra columns by position, like unnamed header cells
+        names.extend(six.text_type(col) for col in range(len(names), width))
+
+    if columns:
+        return OrderedDict((name, [row[i] for row in grid])
+                           for i, name in enumerate(names))
+    return [dict(zip(names, row)) for row in grid]
+
+
+def _column_names(header_rows, width):
+    """
+    Name the columns of a table after the text of its header rows.
+
+    Spanning header cells are combined with the cells below them (like
+    'Score Math'), unnamed columns are named by position, and duplicate
+    names get a '.1', '.2', etc suffix.
+    """
+    names, seen = [], {}
+    for col in range(width):
+        parts = []
+        for row in header_rows:
+            if row[col] and (not parts or parts[-1] != row[col]):
+                parts.append(row[col])
+        name = ' '.join(parts) or six.text_type(col)
+
+        if name in seen:
+            seen[name] += 1
+            name = '%s.%i' % (name, seen[name])
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _table_sections(table, children, name, text):
+    """
+    Split a table element into the sections used by _table_grid.
+
+    children(element) yields the child elements of an element,
+    name(element) returns its tag name, and text(cell) the
+    normalized text of a cell.
+    """
+    def cells(row):
+        return [(text(cell), name(cell) == 'th',
+                 _span(cell.get('colspan'), 1, _MAX_COLSPAN),
+                 _span(cell.get('rowspan'), 1, _MAX_ROWSPAN))
+                for cell in children(row) if name(cell) in ('td', 'th')]
+
+    kind = name(table)
+    if kind in ('thead', 'tbody', 'tfoot'):
+        return [(kind, [cells(row) for row in children(table)
+                        if name(row) == 'tr'])]
+
+    sections = []
+    loose = None  # rows directly inside the table
+    for child in children(table):
+        kind = name(child)
+        if kind == 'tr':
+            if loose is None:
+                loose = []
+                sections.append(('tbody', loose))
+            loose.append(cells(child))
+        elif kind in ('thead', 'tbody', 'tfoot'):
+            sections.append((kind, [cells(row) for row in children(child)
+                                    if name(row) == 'tr']))
+            loose = None
+    return sections
+
+
+def _bs4_table(element):
+    """
+    The sections of the table at (or inside) a BeautifulSoup element
+    """
+    if element.name not in ('table', 'thead', 'tbody', 'tfoot'):
+        element = element.find('table')
+        if element is None:
+            return []
+
+    return _table_sections(
+        element,
+        lambda element: (child for child in element.children
+                         if isinstance(child, Tag)),
+        operator.attrgetter('name'),
+        _bs4_cell_text)
+
+
+def _bs4_cell_text(cell):
+    """
+    The normalized text of a table cell
+    """
+    contents = cell.contents
+    # most cells hold a single string
+    if len(contents) == 1 and type(contents[0]) is NavigableString:
+        return ' '.join(contents[0].split())
+    return _normalize_text(cell.strings)
+
+
+@six.add_metaclass(ABCMeta)
+class NodeLike(object):
+
+    __slots__ = ()
+
+    # should return NodeLike
+    parent = abstractproperty()
+    next_sibling = abstractproperty()
     previous_sibling = abstractproperty()
 
     # should return scalar-like
@@ -806,6 +1790,35 @@ class NodeLike(object):
     attrs = abstractproperty()
     name = abstractproperty()
 
+    def text_(self, strip=True, collapse=True, limit=None, separator=' '):
+        """
+        A scalar-like of this node's normalized text
+        (see :meth:`Node.text_`).
+
+        By default, this normalizes ``self.text``, which is
+        already joined, so separator isn't used.
+        """
+        return self.text.map(lambda text: _normalize_text(
+            (text,), strip, collapse, limit, separator))
+
+    def table_rows(self):
+        """
+        A scalar-like list of the rows of this table
+        (see :meth:`Node.table_rows`). Subclasses that can
+        read tables should override this.
+        """
+        raise NotImplementedError("%s can't read tables"
+                                  % type(self).__name__)
+
+    def to_records(self, header=True, columns=False):
+        """
+        Convert this table into a scalar-like list of dicts
+        (see :meth:`Node.to_records`). Subclasses that can
+        read tables should override this.
+        """
+        raise NotImplementedError("%s can't read tables"
+                                  % type(self).__name__)
+
     # should return CollectionLike
     children = abstractproperty()
     contents = abstractproperty()
@@ -872,19 +1885,65 @@ class Node(NodeLike, Some):
     same properties and methods as BeautifulSoup for navigating
     through documents, like find, select, parents, etc.
     """
+
+    # _doc holds state shared by the nodes of an indexed or cached document
+    # (see Soupy), or None
+    __slots__ = ('_doc',)
+
     def __new__(cls, value, *args, **kwargs):
         if isinstance(value, NavigableString):
             return object.__new__(NavigableStringNode)
 
         return object.__new__(cls)
 
+    def __init__(self, value, doc=None):
+        self._value = value
+        self._doc = doc
+
+    def _wrap(self, val):
+        """
+        Wrap an element from the same document as this Node
+        """
+        # equivalent to Node(val, self._doc), but this is called for
+        # every element in a search result, and avoids the overhead
+        # of __new__ and __init__
+        if isinstance(val, NavigableString):
+            node = object.__new__(NavigableStringNode)
+        else:
+            node = object.__new__(Node)
+        node._value = val
+        node._doc = self._doc
+        return node
+
     def _wrap_node(self, func):
         val = func(self._value)
-        return NullNode() if val is None else Node(val)
+        return NullNode() if val is None else self._wrap(val)
 
     def _wrap_multi(self, func):
-        vals = func(self._value)
-        return Collection(map(Node, vals))
+        value = self._value
+        return _DeferredCollection(
+            self, lambda limit: islice(func(value), limit))
+
+    def _wrap_search(self, method, args, kwargs):
+        return _DeferredCollection(
+            self, _limited_search(self._value, method, args, kwargs))
+
+    def _index_lookup(self, args, kwargs, find_all=True):
+        """
+        Answer a find (or find_all) query from the document index.
+
+        Returns a list of matching elements, or None if the query
+        can't be answered from the index.
+        """
+        doc = self._doc
+        if doc is None or doc.index is None:
+            return None
+
+        query = _SimpleQuery.parse(args, kwargs, find_all)
+        if query is None:
+            return None
+        limit = query.limit if find_all else 1
+        return doc.index.find_all(self._value, query, limit)
 
     def _wrap_scalar(self, func):
         val = func(self._value)
@@ -954,6 +2013,7 @@ class Node(NodeLike, Some):
         return self._wrap_node(operator.attrgetter('previous_sibling'))
 
     @property
+    @_memoized
     def attrs(self):
         """
         A :class:`Scalar` of this Node's attribute dictionary
@@ -966,6 +2026,7 @@ class Node(NodeLike, Some):
         return self._wrap_scalar(operator.attrgetter('attrs'))
 
     @property
+    @_memoized
     def text(self):
         """
         A :class:`Scalar` of this Node's text.
@@ -981,6 +2042,102 @@ class Node(NodeLike, Some):
         """
         return self._wrap_scalar(operator.attrgetter('text'))
 
+    @_memoized
+    def text_(self, strip=True, collapse=True, limit=None, separator=' '):
+        """
+        A :class:`Scalar` of this Node's normalized text.
+
+        The strings inside the Node are joined and normalized in a
+        single pass, which stops once ``limit`` characters are built.
+        This is faster than ``node.text.strip()`` or a regular
+        expression, especially for large Nodes.
+
+        Parameters:
+
+            strip : bool (optional)
+                Remove leading and trailing whitespace. Default is True
+            collapse : bool (optional)
+                Replace each run of whitespace with a single space.
+                Default is True
+            limit : int (optional)
+                The maximum length of the text
+            separator : str (optional)
+                Inserted between strings. Default is ' '
+
+        Examples:
+
+            >>> node = Soupy('<p> hi <b>there</b>\n  you</p>').find('p')
+            >>> node.text_()
+            Scalar(u'hi there you')
+            >>> node.text_(limit=5)
+            Scalar(u'hi th')
+            >>> node.text_(collapse=False, separator='')
+            Scalar(u'hi there\n  you')
+        """
+        return Scalar(_normalize_text(self._value.strings, strip, collapse,
+                                      limit, separator))
+
+    def table_rows(self):
+        """
+        A :class:`Scalar` list of the rows of this table, with the
+        text of each cell (normalized like :meth:`text_`).
+
+        The table is read in a single pass, without creating any
+        Nodes. Cells that span several columns or rows are repeated
+        in each position they cover, and short rows are padded with
+        None. Rows in ``thead`` come first, and rows in ``tfoot``
+        last. Nested tables are part of the text of their cell.
+
+        If this Node isn't a table (or a thead, tbody or tfoot),
+        the first table inside it is used.
+
+        Examples:
+
+            >>> table = Soupy('''<table>
+            ...   <tr><th>a</th><th>b</th></tr>
+            ...   <tr><td colspan="2">1</td></tr>
+            ... </table>''')
+            >>> table.table_rows().val()
+            [[u'a', u'b'], [u'1', u'1']]
+        """
+        return Scalar(_table_grid(_bs4_table(self._value))[0])
+
+    def to_records(self, header=True, columns=False):
+        """
+        Convert this table into a list of dicts, one per row,
+        like :meth:`table_rows`.
+
+        Parameters:
+
+            header : bool, or list of names (optional)
+                If True (the default), the column names come from the
+                header rows: the rows in ``thead``, or else the first
+                row. Cells spanning several header rows are combined
+                (like 'Score Math'). If False, columns are numbered.
+                A list of names is used as is (extra columns are named
+                by position), and every row is data.
+            columns : bool (optional)
+                If True, return a dict of lists (one per column)
+                instead of a list of dicts
+
+        Returns:
+
+            A Scalar(list of dicts), or a Scalar(OrderedDict of lists)
+
+        Examples:
+
+            >>> table = Soupy('''<table>
+            ...   <tr><th>a</th><th>b</th></tr>
+            ...   <tr><td>1</td><td>2</td></tr>
+            ... </table>''')
+            >>> table.to_records().val()
+            [{u'a': u'1', u'b': u'2'}]
+            >>> table.to_records(columns=True).val()
+            OrderedDict([(u'a', [u'1']), (u'b', [u'2'])])
+        """
+        return Scalar(_table_records(_bs4_table(self._value), header,
+                                     columns))
+
     @property
     def name(self):
         """
@@ -996,6 +2153,7 @@ class Node(NodeLike, Some):
         """
         return self._wrap_scalar(operator.attrgetter('name'))
 
+    @_memoized
     def find(self, *args, **kwargs):
         """
         Find a single Node among this Node's descendants.
@@ -1012,6 +2170,10 @@ class Node(NodeLike, Some):
          - node.find(func) # find tag where func(tag) is True
          - node.find(val=3)  # look for tag like <a, val=3>
         """
+        found = self._index_lookup(args, kwargs, find_all=False)
+        if found is not None:
+            return self._wrap(found[0]) if found else NullNode()
+
         op = operator.methodcaller('find', *args, **kwargs)
         return self._wrap_node(op)
 
@@ -1036,6 +2198,7 @@ class Node(NodeLike, Some):
         op = operator.methodcaller('find_previous_sibling', *args, **kwargs)
         return self._wrap_node(op)
 
+    @_memoized
     def find_all(self, *args, **kwargs):
         """
         Like :meth:`find`, but selects all matches (not just the first one).
@@ -1044,40 +2207,67 @@ class Node(NodeLike, Some):
 
         If no elements match, this returns a Collection with no items.
         """
-        op = operator.methodcaller('find_all', *args, **kwargs)
-        return self._wrap_multi(op)
+        found = self._index_lookup(args, kwargs)
+        if found is not None:
+            return Collection(map(self._wrap, found))
+
+        return self._wrap_search('find_all', args, kwargs)
 
     def find_next_siblings(self, *args, **kwargs):
         """
         Like :meth:`find_all`, but searches through :attr:`next_siblings`
         """
-        op = operator.methodcaller('find_next_siblings', *args, **kwargs)
-        return self._wrap_multi(op)
+        return self._wrap_search('find_next_siblings', args, kwargs)
 
     def find_parents(self, *args, **kwargs):
         """
         Like :meth:`find_all`, but searches through :attr:`parents`
         """
-        op = operator.methodcaller('find_parents', *args, **kwargs)
-        return self._wrap_multi(op)
+        return self._wrap_search('find_parents', args, kwargs)
 
     def find_previous_siblings(self, *args, **kwargs):
         """
         Like :meth:`find_all`, but searches through :attr:`previous_siblings`
         """
-        op = operator.methodcaller('find_previous_siblings', *args, **kwargs)
-        return self._wrap_multi(op)
+        return self._wrap_search('find_previous_siblings', args, kwargs)
 
+    @_memoized
     def select(self, selector):
         """
-        Like :meth:`find_all`, but takes a CSS selector string as input.
+        Like :meth:`find_all`, but takes a CSS selector as input.
+
+        The selector can be a string, or a :class:`CompiledSelector`.
+        Strings are compiled with :func:`compile_selector`, so
+        each distinct selector is only parsed once per process.
+
+        Examples:
+
+         - node.select('div.result > a[href]')
+         - node.select(compile_selector('div.result > a[href]'))
         """
-        op = operator.methodcaller('select', selector)
-        return self._wrap_multi(op)
+        if not isinstance(selector, CompiledSelector):
+            namespaces = getattr(self._value, '_namespaces', None) or None
+            selector = compile_selector(selector, namespaces)
+
+        doc = self._doc
+        if (doc is not None and doc.index is not None and
+                selector.query is not None and not doc.is_xml):
+            found = doc.index.find_all(self._value, selector.query)
+            if found is not None:
+                return Collection(map(self._wrap, found))
+
+        value = self._value
+        return _DeferredCollection(
+            self, lambda limit: selector.select(value, limit or 0))
 
     def prettify(self):
         return self.map(Q.prettify()).val()
 
+    def __setitem__(self, key, val):
+        if self._doc is not None:
+            self._doc.invalidate()
+        return super(Node, self).__setitem__(key, val)
+
     def __len__(self):
         return len(self._value)
 
@@ -1096,6 +2286,8 @@ class NavigableStringNode(Node):
     the NavigableString object.
     """
 
+    __slots__ = ()
+
     @property
     def attrs(self):
         """
@@ -1110,6 +2302,26 @@ class NavigableStringNode(Node):
         """
         return Scalar(self._value.string)
 
+    def text_(self, strip=True, collapse=True, limit=None, separator=' '):
+        """
+        A :class:`Scalar` of the normalized string value
+        (see :meth:`Node.text_`)
+        """
+        return Scalar(_normalize_text((self._value,), strip, collapse,
+                                      limit, separator))
+
+    def table_rows(self):
+        """
+        An empty :class:`Scalar` list
+        """
+        return Scalar([])
+
+    def to_records(self, header=True, columns=False):
+        """
+        An empty :class:`Scalar` list (or dict, for columns=True)
+        """
+        return Scalar(_table_records([], header, columns))
+
     @property
     def name(self):
         """
@@ -1167,6 +2379,8 @@ class NullNode(NodeLike, BaseNull):
     in the document.
     """
 
+    __slots__ = ()
+
     def _get_null(self):
         """
         Returns the NullNode
@@ -1194,6 +2408,24 @@ class NullNode(NodeLike, BaseNull):
     text = property(lambda self: Null())
     name = property(lambda self: Null())
 
+    def text_(self, *args, **kwargs):
+        """
+        Returns :class:`Null`
+        """
+        return Null()
+
+    def table_rows(self):
+        """
+        Returns :class:`Null`
+        """
+        return Null()
+
+    def to_records(self, *args, **kwargs):
+        """
+        Returns :class:`Null`
+        """
+        return Null()
+
     def find(self, *args, **kwargs):
         """
         Returns :class:`NullNode`
@@ -1261,100 +2493,685 @@ class NullNode(NodeLike, BaseNull):
         return 0
 
 
-def either(*funcs):
+@six.python_2_unicode_compatible
+class LxmlNode(NodeLike, Some):
+
+    """
+    A Node that wraps an lxml element, instead of a BeautifulSoup one.
+
+    Use ``Soupy(html, engine='lxml')`` to build one. LxmlNodes support
+    the same properties and methods as :class:`Node`, but searches run
+    in lxml's C code (and select uses XPath, via cssselect).
+
+    Differences from BeautifulSoup:
+
+     - Text is not split into separate nodes, so :attr:`children`,
+       :attr:`contents`, :attr:`descendants` and siblings only
+       contain elements. Use :attr:`text` to get at the text.
+     - Functions passed to ``find`` (eg ``find(lambda tag: ...)``)
+       are called with lxml elements.
+     - Names in XML documents don't include namespace prefixes
+     - Searches for strings alone (eg ``find_all(string='x')``, which
+       returns strings with BeautifulSoup) raise TypeError. Searches
+       for tags by their string (eg ``find_all('b', string='x')``)
+       are supported.
+     - LxmlNode is a :class:`NodeLike`, but not a :class:`Node`, so
+       use ``isinstance(node, NodeLike)`` to accept either kind.
+     - LxmlNodes can't be pickled, since lxml elements can't be.
+       Extract plain values (eg with ``val()`` or ``dump``) first.
     """
-    A utility function for selecting the first non-null query.
 
-    Parameters:
+    # _html is False for XML documents
+    __slots__ = ('_html',)
 
-      funcs: One or more functions
+    def __init__(self, value, html=True):
+        self._value = value
+        self._html = html
 
-    Returns:
+    @classmethod
+    def _parse(cls, val, xml=False, huge_tree=False):
+        """
+        Parse markup into an LxmlNode for the document
+        """
+        if etree is None:  # pragma: no cover
+            raise ImportError("engine='lxml' requires lxml")
 
-       A function that, when called with a :class:`Node`, will
-       pass the input to each `func`, and return the first non-Falsey
-       result.
+        if hasattr(val, 'read'):
+            val = val.read()
 
-    Examples:
+        if xml:
+            parser = etree.XMLParser(huge_tree=huge_tree)
+            if isinstance(val, six.text_type):
+                # lxml refuses text with an encoding declaration
+                val = val.encode('utf-8')
+                parser = etree.XMLParser(huge_tree=huge_tree,
+                                         encoding='utf-8')
+        else:
+            parser = etree.HTMLParser(huge_tree=huge_tree)
+            if isinstance(val, six.binary_type):
+                # detect the encoding the same way as BeautifulSoup
+                val = UnicodeDammit(val, is_html=True).unicode_markup
 
-       >>> s = Soupy("<p>hi</p>")
-       >>> s.apply(either(Q.find('a'), Q.find('p').text))
-       Scalar('hi')
-    """
-    def either(val):
-        for func in funcs:
-            result = val.apply(func)
-            if result:
-                return result
-        return Null()
+        root = etree.fromstring(val, parser) if val else None
+        if root is None:  # empty document
+            root = etree.fromstring('<html></html>', parser)
+        return cls(root.getroottree(), html=not xml)
 
-    return either
+    @classmethod
+    def _from_element(cls, element):
+        """
+        Wrap an lxml element (or tree) from any document
+        """
+        tree = element
+        if isinstance(element, etree._Element):
+            tree = element.getroottree()
+        return cls(element, html=isinstance(tree.parser, etree.HTMLParser))
 
+    def _wrap(self, val):
+        node = object.__new__(LxmlNode)
+        node._value = val
+        node._html = self._html
+        return node
 
-def _helpful_failure(method):
-    """
-    Decorator for eval_ that prints a helpful error message
-    if an exception is generated in a Q expression
-    """
+    def __reduce__(self):
+        raise TypeError("LxmlNodes can't be pickled")
 
-    @wraps(method)
-    def wrapper(self, val):
-        try:
-            return method(self, val)
-        except:
-            exc_cls, inst, tb = sys.exc_info()
+    def _wrap_node(self, val):
+        return NullNode() if val is None else self._wrap(val)
 
-            if hasattr(inst, '_RERAISE'):
-                _, expr, _, inner_val = Q.__debug_info__
-                Q.__debug_info__ = QDebug(self, expr, val, inner_val)
-                raise
+    def _axis(self, axis):
+        """
+        A Collection of every element along an axis (like _lxml_children)
+        """
+        value = self._value
+        return _DeferredCollection(
+            self, lambda limit: islice(axis(value, etree.Element, True),
+                                       limit))
 
-            if issubclass(exc_cls, KeyError):  # Overrides formatting
-                exc_cls = QKeyError
+    def _search(self, axis, positional, args, kwargs, limit=None):
+        """
+        A Collection of the elements along an axis that match a
+        BeautifulSoup-style query, stopping after limit of them
+        """
+        query = _LxmlQuery(positional, args, kwargs, self._html)
+        value = self._value
 
-            # Show val, unless it's too long
-            prettyval = repr(val)
-            if len(prettyval) > 150:
-                prettyval = "<%s instance>" % (type(val).__name__)
+        def search(search_limit):
+            limits = [n for n in (limit, query.limit, search_limit) if n]
+            elements = axis(value, query.tag, query.recursive)
+            if query.needs_check:
+                elements = filter(query.matches, elements)
+            return islice(elements, min(limits) if limits else None)
 
-            msg = "{0}\n\n\tEncountered when evaluating {1}{2}".format(
-                inst, prettyval, self)
+        return _DeferredCollection(self, search)
 
-            new_exc = exc_cls(msg)
-            new_exc._RERAISE = True
-            Q.__debug_info__ = QDebug(self, self, val, val)
+    @property
+    def children(self):
+        """
+        A :class:`Collection` of the child elements.
+        """
+        return self._axis(_lxml_children)
 
-            six.reraise(exc_cls, new_exc, tb)
+    contents = children
 
-    return wrapper
+    @property
+    def descendants(self):
+        """
+        A :class:`Collection` of all elements nested inside this Node.
+        """
+        return self._axis(_lxml_descendants)
 
+    @property
+    def parents(self):
+        """
+        A :class:`Collection` of the parent elements.
+        """
+        return self._axis(_lxml_parents)
 
-@six.python_2_unicode_compatible
-class Expression(object):
+    @property
+    def next_siblings(self):
+        """
+        A :class:`Collection` of all sibling elements after this node
+        """
+        return self._axis(_lxml_next_siblings)
 
-    """
-    Soupy expressions are a shorthand for building single-argument functions.
+    @property
+    def previous_siblings(self):
+        """
+        A :class:`Collection` of all sibling elements before this node
+        """
+        return self._axis(_lxml_previous_siblings)
 
-    Users should use the ``Q`` object, which is just an instance of Expression.
-    """
+    @property
+    def parent(self):
+        """
+        The parent :class:`LxmlNode`, or :class:`NullNode`
+        """
+        return self.parents.first()
 
-    def __str__(self):
-        return 'Q'
+    @property
+    def next_sibling(self):
+        """
+        The sibling :class:`LxmlNode` after this, or :class:`NullNode`
+        """
+        return self.next_siblings.first()
 
-    def __repr__(self):
-        return repr(str(self))[1:-1]  # trim quotes
+    @property
+    def previous_sibling(self):
+        """
+        The sibling :class:`LxmlNode` prior to this, or :class:`NullNode`
+        """
+        return self.previous_siblings.first()
 
-    def __iter__(self):
-        yield self
+    @property
+    def attrs(self):
+        """
+        A :class:`Scalar` of this Node's attribute dictionary.
 
-    def _chain(self, other):
-        return Chain(tuple(iter(self)) + tuple(iter(other)))
+        As with BeautifulSoup, multi-valued HTML attributes
+        like class are split into lists.
+        """
+        return Scalar(_lxml_attrs(self._value, self._html))
 
-    def __getattr__(self, key):
-        return self._chain(Attr(key))
+    @property
+    def text(self):
+        """
+        A :class:`Scalar` of this Node's text.
+        """
+        return Scalar(etree.tostring(self._value, method='text',
+                                     encoding=six.text_type,
+                                     with_tail=False))
 
-    def __getitem__(self, key):
-        return self._chain(GetItem(key))
+    def text_(self, strip=True, collapse=True, limit=None, separator=' '):
+        """
+        A :class:`Scalar` of this Node's normalized text
+        (see :meth:`Node.text_`)
+        """
+        element = self._value
+        if _lxml_is_tree(element):
+            element = element.getroot()
+        return Scalar(_normalize_text(element.itertext(), strip, collapse,
+                                      limit, separator))
+
+    def table_rows(self):
+        """
+        A :class:`Scalar` list of the rows of this table
+        (see :meth:`Node.table_rows`)
+        """
+        return Scalar(_table_grid(_lxml_table(self._value))[0])
+
+    def to_records(self, header=True, columns=False):
+        """
+        Convert this table into a list of dicts
+        (see :meth:`Node.to_records`)
+        """
+        return Scalar(_table_records(_lxml_table(self._value), header,
+                                     columns))
+
+    @property
+    def name(self):
+        """
+        A :class:`Scalar` of this Node's tag name.
+        """
+        return Scalar(_lxml_name(self._value))
+
+    def find(self, *args, **kwargs):
+        """
+        Find a single Node among this Node's descendants.
+
+        Takes the same arguments as :meth:`Node.find`.
+        """
+        return self._search(_lxml_descendants, _LxmlQuery.find,
+                            args, kwargs, 1).first()
+
+    def find_next_sibling(self, *args, **kwargs):
+        """
+        Like :meth:`find`, but searches through :attr:`next_siblings`
+        """
+        return self._search(_lxml_next_siblings, _LxmlQuery.siblings,
+                            args, kwargs, 1).first()
+
+    def find_parent(self, *args, **kwargs):
+        """
+        Like :meth:`find`, but searches through :attr:`parents`
+        """
+        return self._search(_lxml_parents, _LxmlQuery.parents,
+                            args, kwargs, 1).first()
+
+    def find_previous_sibling(self, *args, **kwargs):
+        """
+        Like :meth:`find`, but searches through :attr:`previous_siblings`
+        """
+        return self._search(_lxml_previous_siblings, _LxmlQuery.siblings,
+                            args, kwargs, 1).first()
+
+    def find_all(self, *args, **kwargs):
+        """
+        Like :meth:`find`, but selects all matches (not just the first one).
+        """
+        return self._search(_lxml_descendants, _LxmlQuery.find_all,
+                            args, kwargs)
+
+    def find_next_siblings(self, *args, **kwargs):
+        """
+        Like :meth:`find_all`, but searches through :attr:`next_siblings`
+        """
+        return self._search(_lxml_next_siblings, _LxmlQuery.siblings,
+                            args, kwargs)
+
+    def find_parents(self, *args, **kwargs):
+        """
+        Like :meth:`find_all`, but searches through :attr:`parents`
+        """
+        return self._search(_lxml_parents, _LxmlQuery.parents, args, kwargs)
+
+    def find_previous_siblings(self, *args, **kwargs):
+        """
+        Like :meth:`find_all`, but searches through :attr:`previous_siblings`
+        """
+        return self._search(_lxml_previous_siblings, _LxmlQuery.siblings,
+                            args, kwargs)
+
+    def select(self, selector):
+        """
+        Like :meth:`find_all`, but takes a CSS selector as input.
+
+        The selector is translated to XPath with cssselect, which supports
+        most CSS3 selectors.
+        """
+        namespaces = None
+        if isinstance(selector, CompiledSelector):
+            selector, namespaces = selector.selector, selector.namespaces
+        xpath = _lxml_selector(selector, self._html, namespaces)
+
+        # XPath finds every match at once, so there's nothing to limit
+        value = self._value
+        found = [element for element in xpath(value) if element is not value]
+        return _DeferredCollection(self, lambda limit: found)
+
+    def prettify(self):
+        return etree.tostring(self._value, pretty_print=True,
+                              method='html' if self._html else 'xml',
+                              encoding=six.text_type)
+
+    def __getitem__(self, key):
+        return self.attrs[key]
+
+    def __setitem__(self, key, val):
+        element = self._value
+        if isinstance(val, (list, tuple)):
+            val = ' '.join(val)
+        element.set(key, val)
+
+    def __len__(self):
+        if _lxml_is_tree(self._value):
+            return 1
+        return len(self._value)
+
+    def __bool__(self):
+        return True
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        value = self._value
+        if _lxml_is_tree(value):
+            value = value.getroot()
+        return "%s(%s)" % (type(self).__name__, etree.tostring(
+            value, encoding=six.text_type, with_tail=False))
+
+
+class _LxmlQuery(object):
+
+    """
+    The arguments to a BeautifulSoup search method (name, attrs,
+    string, etc), evaluated against lxml elements.
+    """
+
+    # the positional arguments of each kind of search method
+    find = ('name', 'attrs', 'recursive', 'string')
+    find_all = ('name', 'attrs', 'recursive', 'string', 'limit')
+    siblings = ('name', 'attrs', 'string', 'limit')
+    parents = ('name', 'attrs', 'limit')
+
+    def __init__(self, positional, args, kwargs, html):
+        if len(args) > len(positional):
+            raise TypeError("Too many positional arguments")
+
+        params = dict(zip(positional, args))
+        for key, value in kwargs.items():
+            if key in params:
+                raise TypeError("Got multiple values for %r" % key)
+            params[key] = value
+
+        name = params.pop('name', None)
+        attrs = params.pop('attrs', None) or {}
+        string = params.pop('string', None)
+        text = params.pop('text', None)
+        if string is None:
+            string = text
+        self.recursive = params.pop('recursive', True)
+        self.limit = params.pop('limit', None)
+
+        if not isinstance(attrs, dict):
+            attrs = {'class': attrs}
+        if 'class_' in params:
+            params['class'] = params.pop('class_')
+        attrs = dict(attrs, **params)
+
+        # plain tag names are matched by lxml itself
+        self.tag = etree.Element
+        if isinstance(name, six.string_types):
+            self.tag = name if html or '}' in name else '{*}' + name
+            name = None
+        elif name is True:
+            name = None
+
+        self.name = name
+        self.attrs = list(attrs.items())
+        self.string = string
+        self.html = html
+        self.needs_check = (name is not None or bool(self.attrs) or
+                            string is not None)
+
+        # BeautifulSoup returns strings, rather than tags, for these
+        if (string is not None and self.tag is etree.Element and
+                name is None and not self.attrs):
+            raise TypeError("engine='lxml' doesn't support searching "
+                            "for strings without a tag name or attributes")
+
+    def matches(self, element):
+        if not isinstance(element.tag, six.string_types):
+            return False  # the document
+
+        name = self.name
+        if name is not None:
+            if callable(name) and not hasattr(name, 'search'):
+                if not name(element):
+                    return False
+            elif not _lxml_match(name, _lxml_name(element)):
+                return False
+
+        for key, matcher in self.attrs:
+            value = _lxml_attr(element, key, self.html)
+            if not _lxml_match(matcher, value):
+                return False
+
+        if self.string is not None:
+            return _lxml_match(self.string, _lxml_string(element))
+        return True
+
+
+def _lxml_is_tree(value):
+    return hasattr(value, 'getroot')
+
+
+def _lxml_children(value, tag, recursive=True):
+    if _lxml_is_tree(value):
+        root = value.getroot()
+        return iter([root] if next(root.iter(tag), None) is root else [])
+    return value.iterchildren(tag)
+
+
+def _lxml_descendants(value, tag, recursive=True):
+    if not recursive:
+        return _lxml_children(value, tag)
+    if _lxml_is_tree(value):
+        return value.getroot().iter(tag)
+    return value.iterdescendants(tag)
+
+
+def _lxml_parents(value, tag, recursive=True):
+    if _lxml_is_tree(value):
+        return iter([])
+    # like BeautifulSoup, the document is the last parent
+    document = [value.getroottree()] if tag is etree.Element else []
+    return chain(value.iterancestors(tag), document)
+
+
+def _lxml_next_siblings(value, tag, recursive=True):
+    if _lxml_is_tree(value):
+        return iter([])
+    return value.itersiblings(tag)
+
+
+def _lxml_previous_siblings(value, tag, recursive=True):
+    if _lxml_is_tree(value):
+        return iter([])
+    return value.itersiblings(tag, preceding=True)
+
+
+def _lxml_name(value):
+    if _lxml_is_tree(value):
+        return '[document]'
+    return _local_name(value.tag)
+
+
+def _lxml_table(value):
+    """
+    The sections of the table at (or inside) an lxml element
+    """
+    element = value.getroot() if _lxml_is_tree(value) else value
+    if _lxml_name(element) not in ('table', 'thead', 'tbody', 'tfoot'):
+        element = next((child for child in element.iterdescendants()
+                        if _lxml_name(child) == 'table'), None)
+        if element is None:
+            return []
+
+    return _table_sections(
+        element,
+        lambda element: (child for child in element.iterchildren()
+                         if isinstance(child.tag, six.string_types)),
+        _lxml_name,
+        _lxml_cell_text)
+
+
+def _lxml_cell_text(cell):
+    """
+    The normalized text of a table cell
+    """
+    if not len(cell):
+        return ' '.join((cell.text or '').split())
+    return _normalize_text(cell.itertext())
+
+
+def _lxml_attr(element, key, html):
+    value = element.get(key)
+    if value is not None and html and _is_list_attr(element.tag, key):
+        return value.split()
+    return value
+
+
+def _lxml_attrs(value, html):
+    if _lxml_is_tree(value):
+        return {}
+    return dict((_local_name(key), _lxml_attr(value, key, html))
+                for key in value.keys())
+
+
+def _is_list_attr(tag, key):
+    """
+    Whether an HTML attribute holds a list of values, like class
+    """
+    lists = HTMLTreeBuilder.DEFAULT_CDATA_LIST_ATTRIBUTES
+    return key in lists.get('*', ()) or key in lists.get(tag, ())
+
+
+def _lxml_string(element):
+    """
+    The equivalent of a BeautifulSoup tag's .string: its text, if it only
+    contains a single string (possibly nested in other tags), or None
+    """
+    while True:
+        children = list(element)
+        if not children:
+            return element.text
+        if len(children) > 1 or element.text or children[0].tail:
+            return None
+        element = children[0]
+
+
+def _lxml_match(matcher, value):
+    """
+    Whether a value matches part of a BeautifulSoup-style query
+    """
+    if matcher is True:
+        return value is not None
+    if matcher is None or matcher is False:
+        return value is None
+    if isinstance(value, list):
+        # multi-valued attributes match on any value, or all of them
+        return (any(_lxml_match(matcher, item) for item in value) or
+                _lxml_match(matcher, ' '.join(value)))
+    if isinstance(matcher, six.string_types):
+        return value == matcher
+    if hasattr(matcher, 'search'):
+        return value is not None and matcher.search(value) is not None
+    if callable(matcher):
+        return bool(matcher(value))
+    return any(_lxml_match(item, value) for item in matcher)
+
+
+# _lxml_selector's cache
+_LXML_SELECTORS = OrderedDict()
+
+
+def _lxml_selector(selector, html, namespaces=None):
+    """
+    Translate a CSS selector to a (cached) XPath expression
+    """
+    key = (selector, html,
+           namespaces and tuple(sorted(namespaces.items())))
+    if CSSSelector is None:  # pragma: no cover
+        raise ImportError("select with engine='lxml' requires cssselect")
+
+    return _lru_cached(
+        _LXML_SELECTORS, key,
+        lambda: CSSSelector(selector, namespaces=namespaces,
+                            translator='html' if html else 'xml'),
+        _MAX_SELECTORS)
+
+
+def either(*funcs):
+    """
+    A utility function for selecting the first non-null query.
+
+    Parameters:
+
+      funcs: One or more functions
+
+    Returns:
+
+       A function that, when called with a :class:`Node`, will
+       pass the input to each `func`, and return the first non-Falsey
+       result.
+
+    Examples:
+
+       >>> s = Soupy("<p>hi</p>")
+       >>> s.apply(either(Q.find('a'), Q.find('p').text))
+       Scalar('hi')
+    """
+    def either(val):
+        for func in funcs:
+            result = val.apply(func)
+            if result:
+                return result
+        return Null()
+
+    return either
+
+
+def _helpful_failure(method):
+    """
+    Decorator for eval_ that prints a helpful error message
+    if an exception is generated in a Q expression
+    """
+
+    @wraps(method)
+    def wrapper(self, val):
+        try:
+            return method(self, val)
+        except:
+            _reraise_helpful(self, val, sys.exc_info())
+
+    return wrapper
+
+
+def _reraise_helpful(expr, val, exc_info):
+    """
+    Re-raise the exception in exc_info, raised while evaluating
+    expr on val, with a helpful message and debug information
+    """
+    exc_cls, inst, tb = exc_info
+
+    if hasattr(inst, '_RERAISE'):
+        _, inner_expr, _, inner_val = _DEBUG_INFO.get()
+        _DEBUG_INFO.set(QDebug(expr, inner_expr, val, inner_val))
+        six.reraise(*exc_info)
+
+    if issubclass(exc_cls, KeyError):  # Overrides formatting
+        exc_cls = QKeyError
+
+    # Show val, unless it's too long
+    prettyval = repr(val)
+    if len(prettyval) > 150:
+        prettyval = "<%s instance>" % (type(val).__name__)
+
+    msg = "{0}\n\n\tEncountered when evaluating {1}{2}".format(
+        inst, prettyval, expr)
+
+    new_exc = exc_cls(msg)
+    new_exc._RERAISE = True
+    _DEBUG_INFO.set(QDebug(expr, expr, val, val))
+
+    six.reraise(exc_cls, new_exc, tb)
+
+
+@six.python_2_unicode_compatible
+class Expression(object):
+
+    """
+    Soupy expressions are a shorthand for building single-argument functions.
+
+    Users should use the ``Q`` object, which is just an instance of Expression.
+    """
+
+    def __str__(self):
+        return 'Q'
+
+    def __repr__(self):
+        return repr(str(self))[1:-1]  # trim quotes
+
+    def __reduce__(self):
+        # __getattr__ builds new expressions, which confuses the
+        # default pickle protocol
+        return Expression, ()
+
+    def __iter__(self):
+        yield self
+
+    def _key(self):
+        """
+        A hashable key, which is equal for expressions that do the
+        same thing (``==`` builds a BinaryOp, so expressions can't be
+        compared directly).
+
+        Raises TypeError if the expression holds unhashable values.
+        """
+        if type(self) is Expression:
+            return (Expression,)
+        # unknown subclasses are only equal to themselves
+        return (type(self), id(self))
+
+    def _chain(self, other):
+        return Chain(tuple(iter(self)) + tuple(iter(other)))
+
+    def __getattr__(self, key):
+        return self._chain(Attr(key))
+
+    def __getitem__(self, key):
+        return self._chain(GetItem(key))
 
     def __call__(self, *args, **kwargs):
         return self._chain(Call(args, kwargs))
@@ -1429,6 +3246,10 @@ class Expression(object):
         If no exceptions have been triggered from expression evaluation,
         then each field is None.
 
+        The information is stored separately for each thread (and,
+        on Python 3.7+, each asyncio task), so this reports the last
+        error raised in the caller's own context.
+
         Examples:
 
             >>> Scalar('test').map(Q.upper().foo)
@@ -1446,11 +3267,64 @@ class Expression(object):
             >>> dbg.inner_val
             'TEST'
         """
-        result = self.__debug_info__
+        result = _DEBUG_INFO.get()
         if isinstance(result, QDebug):
             return result
         return QDebug(None, None, None, None)
 
+    def compile_(self):
+        """
+        Compile this expression into a single, specialized function.
+
+        The compiled function evaluates the whole expression without
+        the per-step bookkeeping that :meth:`eval_` performs. Chains of
+        attribute lookups, method calls and item lookups are collapsed
+        into ``operator.attrgetter``, ``methodcaller`` and ``itemgetter``
+        calls where possible.
+
+        If the compiled function raises an exception, it is re-raised with
+        the same helpful error message (and :meth:`debug_` information)
+        as :meth:`eval_` builds, naming the step of the expression that
+        failed.
+
+        The result is cached, so repeated calls are cheap. Soupy compiles
+        expressions automatically when they are passed to methods like
+        :meth:`Collection.each` or :meth:`Some.map`.
+
+        Examples:
+
+            >>> func = Q.find('a')['href'].compile_()
+            >>> func(Soupy('<a href="x"></a>'))
+            Scalar(u'x')
+        """
+        compiled = self.__dict__.get('_compiled')
+        if compiled is None:
+            compiled = _compile_expression(self)
+            self.__dict__['_compiled'] = compiled
+        return compiled
+
+    def explain_(self):
+        """
+        Describe the steps that the compiled form of this
+        expression (see :meth:`compile_`) runs.
+
+        Examples:
+
+            >>> print(Q.find('a')['href'].strip().explain_())
+            Q.find('a')['href'].strip()
+              1. .find('a')  (method call)
+              2. ['href']  (item lookup)
+              3. .strip()  (method call)
+        """
+        return '\n'.join([six.text_type(self)] + list(_explain(self, 1)))
+
+    def _compile(self):
+        """
+        Return a plain function that evaluates this expression,
+        without any error reporting.
+        """
+        return _identity
+
 
 @six.python_2_unicode_compatible
 class Call(Expression):
@@ -1461,10 +3335,22 @@ class Call(Expression):
         self._args = args
         self._kwargs = kwargs
 
+    def __reduce__(self):
+        return Call, (self._args, self._kwargs)
+
+    def _key(self):
+        return Call, _value_key(self._args), _value_key(self._kwargs)
+
     @_helpful_failure
     def eval_(self, val):
         return val.__call__(*self._args, **self._kwargs)
 
+    def _compile(self):
+        args, kwargs = self._args, self._kwargs
+        if kwargs:
+            return lambda val: val(*args, **kwargs)
+        return lambda val: val(*args)
+
     def __str__(self):
         result = list(map(_uniquote, self._args))
         if self._kwargs:
@@ -1483,6 +3369,13 @@ class BinaryOp(Expression):
         self.right = right
         self.symbol = symbol
 
+    def __reduce__(self):
+        return BinaryOp, (self.op, self.symbol, self.left, self.right)
+
+    def _key(self):
+        return (BinaryOp, self.op, _value_key(self.left),
+                _value_key(self.right))
+
     @_helpful_failure
     def eval_(self, val):
         left = self.left
@@ -1495,6 +3388,23 @@ class BinaryOp(Expression):
 
         return self.op(left, right)
 
+    def _compile(self):
+        op, left, right = self.op, self.left, self.right
+
+        if isinstance(right, Expression):
+            rfunc = right._compile()
+            if isinstance(left, Expression):
+                lfunc = left._compile()
+                return lambda val: op(lfunc(val), rfunc(val))
+            return lambda val: op(left, rfunc(val))
+
+        if type(left) is Expression:  # bare Q
+            return lambda val: op(val, right)
+        if isinstance(left, Expression):
+            lfunc = left._compile()
+            return lambda val: op(lfunc(val), right)
+        return lambda val: op(left, right)
+
     def __str__(self):
         l, r = self.left, self.right
         if isinstance(l, BinaryOp):
@@ -1513,10 +3423,19 @@ class Attr(Expression):
     def __init__(self, attribute_name):
         self._name = attribute_name
 
+    def __reduce__(self):
+        return Attr, (self._name,)
+
+    def _key(self):
+        return Attr, self._name
+
     @_helpful_failure
     def eval_(self, val):
         return operator.attrgetter(self._name)(val)
 
+    def _compile(self):
+        return operator.attrgetter(self._name)
+
     def __str__(self):
         return '.%s' % self._name
 
@@ -1529,10 +3448,19 @@ class GetItem(Expression):
     def __init__(self, key):
         self._name = key
 
+    def __reduce__(self):
+        return GetItem, (self._name,)
+
+    def _key(self):
+        return GetItem, _value_key(self._name)
+
     @_helpful_failure
     def eval_(self, val):
         return operator.itemgetter(self._name)(val)
 
+    def _compile(self):
+        return operator.itemgetter(self._name)
+
     def __str__(self):
         return "[%s]" % _uniquote(self._name)
 
@@ -1545,6 +3473,12 @@ class Chain(Expression):
     def __init__(self, items):
         self._items = items
 
+    def __reduce__(self):
+        return Chain, (self._items,)
+
+    def _key(self):
+        return (Chain,) + tuple(item._key() for item in self._items)
+
     def __iter__(self):
         for item in self._items:
             yield item
@@ -1555,24 +3489,613 @@ class Chain(Expression):
             val = item.eval_(val)
         return val
 
+    def _compile(self):
+        return _run_steps(tuple(_fuse_steps(self._items)))
+
     def __str__(self):
         return ''.join(map(_uniquote, self._items))
 
 
-def _make_callable(func):
-    # If func is an expression, we call via eval_
-    # otherwise, we call func directly
-    if func is None:
-        func = Q
-    return getattr(func, 'eval_', func)
-
-
+def _value_key(value):
+    """
+    A hashable key for a value held by an expression, for _key
+    """
+    if isinstance(value, Expression):
+        return value._key()
+    if isinstance(value, (list, tuple)):
+        return (type(value),) + tuple(_value_key(item) for item in value)
+    if isinstance(value, dict):
+        return dict, frozenset((key, _value_key(item))
+                               for key, item in value.items())
+    hash(value)  # TypeError for unhashable values
+    # keep 1, 1.0 and True apart
+    return type(value), value
+
+
+def _fuse_steps(items):
+    """
+    Turn the items of a Chain into as few plain functions as possible.
+    """
+    return (func for _, _, func in _plan_steps(items))
+
+
+def _plan_steps(items):
+    """
+    Plan how to evaluate the items of a Chain.
+
+    Attribute lookups followed by a call become a single methodcaller,
+    and runs of attribute lookups become a single dotted attrgetter.
+
+    Yields a (label, item, function) tuple for each step, where item
+    is the Expression that the step evaluates (a Chain for fused steps).
+    """
+    # chains start with the bare Q, which does nothing
+    items = [item for item in items if type(item) is not Expression]
+    attrs = []
+
+    while items:
+        item = items.pop(0)
+        if type(item) is Attr and '.' not in item._name:
+            if items and type(items[0]) is Call:
+                call = items.pop(0)
+                if attrs:
+                    yield _attr_step(attrs)
+                    attrs = []
+                yield ('.%s%s' % (item._name, call), Chain((item, call)),
+                       operator.methodcaller(item._name, *call._args,
+                                             **call._kwargs))
+            else:
+                attrs.append(item)
+            continue
+
+        if attrs:
+            yield _attr_step(attrs)
+            attrs = []
+        yield six.text_type(item), item, item._compile()
+
+    if attrs:
+        yield _attr_step(attrs)
+
+
+def _attr_step(attrs):
+    name = '.'.join(attr._name for attr in attrs)
+    return '.' + name, Chain(tuple(attrs)), operator.attrgetter(name)
+
+
+def _run_steps(steps):
+    """
+    Build a function that passes a value through each step in turn
+    """
+    if not steps:
+        return _identity
+    if len(steps) == 1:
+        return steps[0]
+    if len(steps) == 2:
+        first, second = steps
+        return lambda val: second(first(val))
+
+    def chain(val):
+        for step in steps:
+            val = step(val)
+        return val
+
+    return chain
+
+
+# how explain_ describes each kind of step
+_STEP_KINDS = {operator.attrgetter: 'attribute lookup',
+               operator.methodcaller: 'method call',
+               operator.itemgetter: 'item lookup'}
+
+
+def _explain(expr, depth):
+    """
+    Yield the lines of Expression.explain_, after the first one
+    """
+    indent = '  ' * depth
+    if isinstance(expr, BinaryOp):
+        yield '%s%s  (binary op)' % (indent, expr.symbol)
+        for side, value in (('left', expr.left), ('right', expr.right)):
+            if not isinstance(value, Expression):
+                yield '%s  %s: %s' % (indent, side, _uniquote(value))
+                continue
+            yield '%s  %s: %s' % (indent, side, value)
+            for line in _explain(value, depth + 2):
+                yield line
+        return
+
+    items = expr._items if isinstance(expr, Chain) else (expr,)
+    steps = list(_plan_steps(items))
+    if not steps:
+        yield '%s(identity)' % indent
+
+    for i, (label, item, func) in enumerate(steps, 1):
+        if isinstance(item, BinaryOp):
+            yield '%s%i. (%s)' % (indent, i, label)
+            for line in _explain(item, depth + 1):
+                yield line
+            continue
+        kind = _STEP_KINDS.get(type(func), 'call')
+        yield '%s%i. %s  (%s)' % (indent, i, label, kind)
+
+
+def _compile_expression(expr, fast=None):
+    """
+    Build the function returned by Expression.compile_, around
+    expr's plain function (or ``fast``, if given)
+    """
+    if fast is None and isinstance(expr, Chain):
+        return _compile_chain(expr)
+    if fast is None:
+        fast = expr._compile()
+
+    def compiled(val):
+        try:
+            return fast(val)
+        except Exception:
+            _reraise_helpful(expr, val, sys.exc_info())
+
+    return compiled
+
+
+def _compile_chain(expr):
+    """
+    Build the function returned by Chain.compile_, which keeps
+    track of the step being run, to report errors without running
+    the expression a second time
+    """
+    steps = tuple((item, func) for _, item, func in _plan_steps(expr._items))
+    if not steps:
+        return _identity
+
+    def compiled(val):
+        inner_val = val
+        try:
+            for inner_expr, func in steps:
+                inner_val = func(inner_val)
+            return inner_val
+        except Exception:
+            _reraise_step(expr, val, inner_expr, inner_val, sys.exc_info())
+
+    return compiled
+
+
+def _reraise_step(expr, val, inner_expr, inner_val, exc_info):
+    """
+    Re-raise exc_info, raised by the step inner_expr of expr on
+    inner_val, with the messages and debug info that evaluating expr
+    on val without compiling it gives.
+    """
+    try:
+        inner_expr, inner_val = _failing_item(inner_expr, inner_val)
+        _reraise_helpful(inner_expr, inner_val, exc_info)
+    except Exception:
+        _reraise_helpful(expr, val, sys.exc_info())
+
+
+def _failing_item(step, val):
+    """
+    Find the item of a fused step (see _plan_steps) that raised an
+    exception on val, by looking up its attributes again one by one.
+
+    Returns the item and its input, like uncompiled evaluation
+    reports them, or (step, val) if the failure isn't in a lookup
+    or a call of a fused step.
+    """
+    if not isinstance(step, Chain):
+        return step, val
+
+    inner_val = val
+    for item in step._items:
+        if type(item) is not Attr:
+            # the lookups worked, so the method call failed
+            return item, inner_val
+        try:
+            inner_val = getattr(inner_val, item._name)
+        except Exception:
+            return item, inner_val
+    return step, val
+
+
+def _identity(val):
+    return val
+
+
+def _make_callable(func):
+    # If func is an expression, we call its compiled form
+    # otherwise, we call func directly
+    if func is None:
+        func = Q
+    if isinstance(func, Expression):
+        profiler = _PROFILE.get()
+        if profiler is not None:
+            return profiler._callable(func)
+        return func.compile_()
+    return getattr(func, 'eval_', func)
+
+
+def profile():
+    """
+    Record how long each step of Q expressions takes.
+
+    While the returned :class:`Profile` is active (in a ``with``
+    block), expressions passed to Soupy methods (like :meth:`Node.dump`,
+    :meth:`Collection.each` or :meth:`Some.map`) are evaluated with
+    timers around each of their steps. Outside of a ``with profile()``
+    block, expressions run without any instrumentation.
+
+    Like :meth:`Expression.debug_`, profiling only applies to the
+    current thread (or asyncio task).
+
+    Examples:
+
+        with soupy.profile() as prof:
+            rows.dump(title=Q.find('h2').text, link=Q.find('a')['href'])
+        print(prof.report())
+    """
+    return Profile()
+
+
+class Profile(object):
+
+    """
+    The call counts, cumulative times and Null counts for each step
+    of the Q expressions evaluated inside a ``with`` block.
+
+    Use :func:`profile` to build one.
+    """
+
+    def __init__(self, timer=default_timer):
+        self._timer = timer
+        self._rows = []
+        self._compiled = {}
+        self._previous = []
+
+    def __enter__(self):
+        self._previous.append(_PROFILE.get())
+        _PROFILE.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _PROFILE.set(self._previous.pop())
+        return False
+
+    def stats(self):
+        """
+        Return a list of :class:`ProfileStats`. Each profiled expression
+        has a row (with step=None), followed by a row for each step.
+
+        The time of a step includes the time of any steps nested
+        inside it (eg the operands of a binary operation).
+        """
+        return [ProfileStats(expr, step, depth, stat[0], stat[1], stat[2])
+                for expr, step, depth, stat in self._rows]
+
+    def report(self):
+        """
+        Return the stats as a printable table.
+        """
+        rows = [('expression / step', 'calls', 'time (s)', 'nulls')]
+        for stat in self.stats():
+            if stat.step is None:
+                label = stat.expr
+            else:
+                label = '  ' * stat.depth + stat.step
+            rows.append((label, str(stat.calls), '%.6f' % stat.time,
+                         str(stat.nulls)))
+
+        width = max(len(row[0]) for row in rows)
+        return '\n'.join('%s  %8s  %10s  %6s' % ((label.ljust(width),) +
+                                                 rest)
+                         for label, rest in ((r[0], r[1:]) for r in rows))
+
+    def __str__(self):
+        return self.report()
+
+    def _callable(self, expr):
+        """
+        Build (or reuse) the instrumented version of expr.compile_()
+        """
+        try:
+            return self._compiled[id(expr)][1]
+        except KeyError:
+            pass
+
+        label = six.text_type(expr)
+        total = self._stat(label, None, 0)
+        timed = self._timed(self._instrument(expr, label, 1), total)
+        func = _compile_expression(expr, timed)
+
+        # holding on to expr keeps its id from being reused
+        self._compiled[id(expr)] = (expr, func)
+        return func
+
+    def _instrument(self, expr, root, depth):
+        """
+        Build a function that evaluates expr, timing each step
+        """
+        if isinstance(expr, BinaryOp):
+            op = expr.op
+            left = self._operand(expr.left, root, depth)
+            right = self._operand(expr.right, root, depth)
+            return lambda val: op(left(val), right(val))
+
+        items = expr._items if isinstance(expr, Chain) else (expr,)
+        steps = []
+        for label, item, func in _plan_steps(items):
+            stat = self._stat(root, label, depth)
+            if isinstance(item, BinaryOp):
+                func = self._instrument(item, root, depth + 1)
+            steps.append(self._timed(func, stat))
+        return _run_steps(tuple(steps))
+
+    def _operand(self, value, root, depth):
+        if isinstance(value, Expression):
+            return self._instrument(value, root, depth + 1)
+        return lambda val: value
+
+    def _stat(self, expr, step, depth):
+        stat = [0, 0.0, 0]  # calls, time, nulls
+        self._rows.append((expr, step, depth, stat))
+        return stat
+
+    def _timed(self, func, stat):
+        timer = self._timer
+
+        def timed(val):
+            start = timer()
+            try:
+                result = func(val)
+            finally:
+                stat[0] += 1
+                stat[1] += timer() - start
+            if isinstance(result, BaseNull):
+                stat[2] += 1
+            return result
+
+        return timed
+
+
 def _unwrap(val):
     if isinstance(val, Wrapper):
         return val.val()
     return val
 
 
+def _dump_result(names, values):
+    """
+    Pack the values of dump fields into a tuple, or a dict
+    """
+    if names is None:
+        return tuple(values)
+    return dict(zip(names, values))
+
+
+# _dump_plan's cache
+_DUMP_PLANS = OrderedDict()
+_MAX_DUMP_PLANS = 1000
+
+
+def _dump_plan(funcs):
+    """
+    Plan how to evaluate the fields of a dump, so that Q expressions
+    starting with the same steps (like ``Q.find('h1').text`` and
+    ``Q.find('h1')['id']``) share the result of those steps.
+
+    Plans are cached, so dumping the same fields again (like
+    ``Q.dump`` inside ``each``) doesn't plan them again.
+
+    Returns a function that takes a wrapper, and returns a list of
+    field values. Returns None if no fields share any steps, or
+    while profiling.
+    """
+    if _PROFILE.get() is not None:
+        return None
+
+    try:
+        # other functions are only equal to themselves
+        key = tuple(func._key() if isinstance(func, Expression)
+                    else (type(func), id(func)) for func in funcs)
+        hash(key)
+    except TypeError:  # unhashable arguments
+        return _build_dump_plan(funcs)
+
+    # the plan keeps funcs alive, so their ids aren't reused
+    return _lru_cached(_DUMP_PLANS, key,
+                       lambda: _build_dump_plan(tuple(funcs)),
+                       _MAX_DUMP_PLANS)
+
+
+def _build_dump_plan(funcs):
+    """
+    Build the function returned by _dump_plan. The expressions are
+    arranged into a tree of their steps, which is walked once per item.
+    """
+    # each node is a (children, fields) pair, where children maps
+    # the key of a step to (items, child node)
+    root = (OrderedDict(), [])
+    plain = set()
+    for index, func in enumerate(funcs):
+        if not isinstance(func, Expression):
+            plain.add(index)
+            continue
+
+        try:
+            steps = _dump_steps(func)
+        except TypeError:  # unhashable arguments
+            plain.add(index)
+            continue
+
+        node = root
+        for key, items in steps:
+            if key not in node[0]:
+                node[0][key] = (items, (OrderedDict(), []))
+            node = node[0][key][1]
+        node[1].append(index)
+
+    def size(node):
+        return len(node[1]) + sum(size(child)
+                                  for _, child in node[0].values())
+
+    if not any(size(child) > 1 for _, child in root[0].values()):
+        return None
+
+    run = _dump_runner(root)
+
+    def evaluate(wrapper):
+        values = [None] * len(funcs)
+        failures = {}
+        run(wrapper, values, failures, (), wrapper, None)
+
+        # report failures, run the other fields and unwrap the values
+        # in the order that dump would evaluate them one by one
+        for index, func in enumerate(funcs):
+            if index in failures:
+                failures[index].reraise(func, wrapper)
+            if index in plain:
+                values[index] = _make_callable(func)(wrapper)
+            values[index] = _unwrap(Wrapper.wrap(values[index]))
+        return values
+
+    return evaluate
+
+
+def _dump_steps(expr):
+    """
+    Split an expression into (key, items) steps for _dump_plan.
+    Method calls (an Attr followed by a Call) are a single step.
+    """
+    steps = []
+    for item in expr:
+        if type(item) is Expression:  # the bare Q at the start
+            continue
+        if type(item) is Call and steps and type(steps[-1][-1]) is Attr:
+            steps[-1].append(item)
+        else:
+            steps.append([item])
+    return [(tuple(item._key() for item in items), items)
+            for items in steps]
+
+
+class _StepFailure(Exception):
+
+    """
+    An exception raised by a step of a dump plan, which is
+    reported once dump reaches a field that uses the step
+    """
+
+    def __init__(self, expr, val, exc_info):
+        super(_StepFailure, self).__init__()
+        self.expr, self.val, self.exc_info = expr, val, exc_info
+
+    def reraise(self, field, wrapper):
+        # like running the field on its own (see _compile_chain)
+        _reraise_step(field, wrapper, self.expr, self.val, self.exc_info)
+
+
+def _dump_runner(node):
+    """
+    Build a function that evaluates the tree of steps below node.
+
+    The function takes the value at node, a list to store the value
+    of each field in, a dict to store the _StepFailure of each field
+    whose steps raise an exception, and the steps that computed the
+    value from its parent (with the parent's value, or a function
+    that computes the parent's value again).
+    """
+    children, fields = node
+    fields = tuple(fields)
+    indices = fields
+    branches = []
+    for items, child in children.values():
+        items = list(items)
+        # steps without a branch run as one function
+        while len(child[0]) == 1 and not child[1]:
+            more, child = next(iter(child[0].values()))
+            items.extend(more)
+        steps = tuple((item, func) for _, item, func in _plan_steps(items))
+        branch = _dump_runner(child)
+        branches.append((steps, branch))
+        indices += branch.indices
+    shared = len(branches) + len(fields) > 1
+
+    def run(val, values, failures, steps, parent, parent_source):
+        if shared and not _reiterable(val):
+            # each user of val computes it again, as if
+            # the fields were evaluated one by one
+            unused = [val]
+
+            def source():
+                if unused:
+                    return unused.pop()
+                if parent_source is not None:
+                    return _run_dump_steps(steps, parent_source())
+                return _run_dump_steps(steps, parent)
+        else:
+            source = None
+
+        for index in fields:
+            try:
+                values[index] = val if source is None else source()
+            except _StepFailure as failure:
+                failures[index] = failure
+
+        for child_steps, branch in branches:
+            try:
+                child = _run_dump_steps(child_steps,
+                                        val if source is None else source())
+            except _StepFailure as failure:
+                for index in branch.indices:
+                    failures[index] = failure
+                continue
+            branch(child, values, failures, child_steps, val, source)
+
+    run.indices = indices
+    return run
+
+
+def _run_dump_steps(steps, val):
+    """
+    Run the (expression, function) steps of a dump plan on val,
+    raising _StepFailure if one of them fails
+    """
+    inner_val = val
+    try:
+        for inner_expr, func in steps:
+            inner_val = func(inner_val)
+        return inner_val
+    except Exception:
+        raise _StepFailure(inner_expr, inner_val, sys.exc_info())
+
+
+def _reiterable(val):
+    """
+    Whether the value of a dump step can be shared by several fields
+    """
+    if isinstance(val, LazyCollection):
+        return False
+    if isinstance(val, Scalar):
+        val = val._value
+    return not isinstance(val, Iterator)
+
+
+def _typed_column(column, typecode):
+    """
+    Convert a list into an array.array or NumPy array, for dump_columns
+    """
+    if typecode is None:
+        return column
+
+    if isinstance(typecode, six.string_types) and len(typecode) == 1:
+        return array.array(str(typecode), column)
+
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("NumPy is required for typecode %r" % (typecode,))
+    return np.asarray(column, dtype=typecode)
+
+
 def _dequote(str):
     try:
         return QUOTED_STR.findall(str)[0]
@@ -1604,12 +4127,1772 @@ def _repr(value):
     return value
 
 
+# stands in for arguments that weren't given, where None means something
+_MISSING = object()
+
+
+class _SimpleQuery(object):
+
+    """
+    A find-style query that only restricts tag names, ids and classes.
+    """
+
+    _positional = ('name', 'attrs', 'recursive', 'string', 'limit')
+
+    def __init__(self, name=None, id=None, class_=None, limit=None):
+        self.name = name
+        self.id = id
+        self.class_ = class_
+        self.limit = limit
+
+    @classmethod
+    def parse(cls, args, kwargs, find_all=True):
+        """
+        Build a _SimpleQuery from the arguments to find_all (or find,
+        if find_all is False).
+
+        Returns None if the arguments use any other features
+        (regular expressions, functions, non-recursive searches, etc),
+        or aren't valid (like a limit for find)
+        """
+        positional = cls._positional if find_all else cls._positional[:-1]
+        if len(args) > len(positional):
+            return None
+        if not find_all and 'limit' in kwargs:
+            return None
+
+        params = dict(zip(positional, args))
+        for key, value in kwargs.items():
+            if key in params:
+                return None
+            params[key] = value
+
+        name = params.pop('name', None)
+        attrs = params.pop('attrs', None) or {}
+        limit = params.pop('limit', None)
+        if not params.pop('recursive', True):
+            return None
+        if params.pop('string', None) is not None:
+            return None
+        if params.pop('text', None) is not None:
+            return None
+
+        if isinstance(attrs, six.string_types):
+            attrs = {'class': attrs}
+        if not isinstance(attrs, dict):
+            return None
+
+        if 'class_' in params:
+            params['class'] = params.pop('class_')
+        for key in params:
+            if key in attrs:
+                return None
+        attrs = dict(attrs, **params)
+
+        tag_id = attrs.pop('id', _MISSING)
+        class_ = attrs.pop('class', _MISSING)
+        if attrs:
+            return None
+
+        # bs4 reads None and False as "the attribute is absent"
+        if tag_id is None or tag_id is False:
+            return None
+        if class_ is None or class_ is False:
+            return None
+        tag_id = None if tag_id is _MISSING else tag_id
+        class_ = None if class_ is _MISSING else class_
+
+        if name is not None and (not isinstance(name, six.string_types) or
+                                 ':' in name):
+            return None
+        if tag_id is not None and not isinstance(tag_id, six.string_types):
+            return None
+        if class_ is not None and (not isinstance(class_, six.string_types)
+                                   or class_.split() != [class_]):
+            return None
+        if name is None and tag_id is None and class_ is None:
+            return None
+
+        return cls(name, tag_id, class_, limit)
+
+    @classmethod
+    def from_selector(cls, selector):
+        """
+        Build a _SimpleQuery from a CSS selector like ``tag#id.class``.
+
+        Returns None for any other selector. Tag names are lowercased,
+        so the query is only valid for HTML documents.
+        """
+        match = SIMPLE_SELECTOR.match(selector.strip())
+        if match is None:
+            return None
+
+        name, rest = match.groups()
+        found = {'#': None, '.': None}
+        for kind, value in SELECTOR_TOKEN.findall(rest):
+            if found[kind] is not None:
+                return None
+            found[kind] = value
+
+        if name is None and not rest:
+            return None
+        return cls(name and name.lower(), found['#'], found['.'])
+
+    def matches(self, tag):
+        if self.name is not None and tag.name != self.name:
+            return False
+        if self.id is not None and tag.get('id') != self.id:
+            return False
+        if self.class_ is not None:
+            return self.class_ in _class_tokens(tag)
+        return True
+
+
+def _class_tokens(tag):
+    classes = tag.get('class')
+    if classes is None:
+        return ()
+    if isinstance(classes, six.string_types):
+        return (classes,)
+    return classes
+
+
+class _DocumentIndex(object):
+
+    """
+    Maps tag names, ids and class tokens to the elements that use them.
+
+    The index is built lazily, in a single pass through the document.
+    Elements are numbered in document order, so that the descendants
+    of any element form a contiguous range of positions.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Discard the index, so that it is rebuilt on the next query
+        """
+        self._elements = None
+
+    def _build(self):
+        elements = []
+        spans = {}
+        names, ids, classes = {}, {}, {}
+
+        todo = [(self.root, iter(self.root.children), 0)]
+        while todo:
+            parent, children, start = todo[-1]
+            for child in children:
+                if not isinstance(child, Tag):
+                    continue
+
+                pos = len(elements)
+                elements.append(child)
+                names.setdefault(child.name, []).append(pos)
+                tag_id = child.get('id')
+                if isinstance(tag_id, six.string_types):
+                    ids.setdefault(tag_id, []).append(pos)
+                for token in _class_tokens(child):
+                    classes.setdefault(token, []).append(pos)
+
+                todo.append((child, iter(child.children), pos + 1))
+                break
+            else:
+                todo.pop()
+                spans[id(parent)] = (start, len(elements))
+
+        self._elements = elements
+        self._spans = spans
+        self._keys = (names, ids, classes)
+
+    def find_all(self, tag, query, limit=None):
+        """
+        Return the descendants of tag that match a _SimpleQuery,
+        or None if tag isn't part of the index.
+        """
+        if self._elements is None:
+            self._build()
+
+        span = self._spans.get(id(tag))
+        if span is None:
+            return None
+
+        # scan the shortest list of candidates
+        candidates = None
+        for key, table in zip((query.name, query.id, query.class_),
+                              self._keys):
+            if key is None:
+                continue
+            positions = table.get(key, ())
+            if candidates is None or len(positions) < len(candidates):
+                candidates = positions
+
+        lo, hi = span
+        first = bisect_left(candidates, lo)
+        last = bisect_left(candidates, hi, first)
+
+        elements = self._elements
+        result = []
+        for pos in candidates[first:last]:
+            element = elements[pos]
+            if query.matches(element):
+                result.append(element)
+                if limit and len(result) >= limit:
+                    break
+        return result
+
+
+class _QueryCache(object):
+
+    """
+    A bounded, least-recently-used cache of Node query results.
+
+    Keys start with id(element). Since ids can be reused once an
+    element is garbage collected, each entry also holds on to the element,
+    and only matches the same object.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key, element, compute):
+        entries = self._entries
+        entry = entries.pop(key, None)
+        if entry is None or entry[0] is not element:
+            entry = (element, compute())
+
+        entries[key] = entry  # most recently used
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        return entry[1]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Document(object):
+
+    """
+    State shared by all the Nodes in a document.
+    """
+
+    def __init__(self, root, index=False, cache=0):
+        self.root = root
+        self.is_xml = getattr(root, 'is_xml', True)
+        self.index = _DocumentIndex(root) if index else None
+        self.cache = _QueryCache(cache) if cache else None
+
+    def invalidate(self):
+        """
+        Called when the document is modified
+        """
+        if self.index is not None:
+            self.index.invalidate()
+        if self.cache is not None:
+            self.cache.clear()
+
+
 class Soupy(Node):
 
+    """
+    The Node at the root of a document.
+
+    Parameters:
+
+        val : str, bytes or BeautifulSoup element
+            The markup to parse, or an already-parsed element
+        index : bool (optional)
+            If True, build an index of the tag names, ids and classes
+            in the document, the first time it is searched. Simple
+            calls to :meth:`Node.find` and :meth:`Node.find_all`
+            (like ``find('a')``, ``find(id='main')`` or
+            ``find_all('td', class_='price')``) are then answered from
+            the index, instead of scanning the document.
+            The index assumes that the document is only modified
+            through Soupy (eg ``node['id'] = 'x'``).
+        cache : int (optional)
+            If given, remember the results of up to this many calls to
+            :meth:`Node.find`, :meth:`Node.find_all`, :meth:`Node.select`,
+            :attr:`Node.text` and :attr:`Node.attrs` anywhere in the
+            document, so that queries which repeat a sub-query (like
+            several dump fields starting with ``Q.find('table', 'specs')``)
+            only search once. The least recently used results are
+            discarded first. Like the index, the cache is cleared
+            when the document is modified through Soupy.
+        parse_only : SoupStrainer, query, or list of queries (optional)
+            Only parse the parts of the document that match. Queries
+            (Q expressions or dump specs) are converted with
+            :func:`strainer`.
+        engine : 'bs4' or 'lxml' (optional)
+            With 'lxml', the document is parsed into an lxml tree
+            instead of a BeautifulSoup one, and an :class:`LxmlNode` is
+            returned. Searches are much faster, but a few details differ
+            (see LxmlNode). The document is parsed as HTML, unless
+            the features argument is 'xml' or 'lxml-xml'. This engine
+            doesn't support the index, cache or parse_only options.
+        huge_tree : bool (optional)
+            With engine='lxml', turn off libxml2's limits on the depth
+            of documents and the size of text nodes. These limits guard
+            against malicious input, so only use this for trusted
+            documents.
+        args, kwargs :
+            Passed to the BeautifulSoup constructor
+
+    Examples:
+
+        >>> Soupy('<p id="a">hi</p>', index=True).find(id='a').text
+        Scalar(u'hi')
+        >>> doc = Soupy('<p>hi</p>', cache=1000)
+        >>> doc.find('p') is doc.find('p')
+        True
+        >>> query = Q.find('b').text
+        >>> Soupy('<a>a</a><b>b</b>', parse_only=query)
+        Soupy(<b>b</b>)
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, val, *args, **kwargs):
+        engine = kwargs.pop('engine', 'bs4')
+        if engine == 'bs4':
+            return super(Soupy, cls).__new__(cls, val)
+        if engine != 'lxml':
+            raise ValueError("Unknown engine %r" % (engine,))
+
+        # LxmlNodes aren't Soupy instances, so __init__ isn't called
+        features = kwargs.pop('features', args[0] if args else None)
+        huge_tree = kwargs.pop('huge_tree', False)
+        if kwargs or len(args) > 1:
+            raise TypeError("Unsupported arguments for engine='lxml'")
+        return LxmlNode._parse(val, xml=features in ('xml', 'lxml-xml'),
+                               huge_tree=huge_tree)
+
     def __init__(self, val, *args, **kwargs):
+        kwargs.pop('engine', None)
+        index = kwargs.pop('index', False)
+        cache = kwargs.pop('cache', 0)
+        parse_only = kwargs.get('parse_only')
+        if parse_only is not None and not isinstance(parse_only,
+                                                     SoupStrainer):
+            kwargs['parse_only'] = strainer(parse_only)
+
         if not isinstance(val, PageElement):
             val = BeautifulSoup(val, *args, **kwargs)
         super(Soupy, self).__init__(val)
+        if index or cache:
+            self._doc = _Document(val, index=index, cache=cache)
+
+    @classmethod
+    def iterparse(cls, source, tag, html=False, features=None):
+        """
+        Incrementally parse a large document, one element at a time.
+
+        The document is read with a streaming parser, and each
+        ``tag`` element is converted into a :class:`Node` as soon as
+        it is complete. Once the Node has been processed, the element is
+        discarded, so that arbitrarily large documents can be processed
+        with bounded memory.
+
+        Parameters:
+
+            source : filename or file object
+                The document to parse
+            tag : str
+                The name of the elements to extract (without any
+                namespace prefix). Matches nested inside another
+                match are part of the outer Node.
+            html : bool (optional)
+                If True, parse the source as (possibly malformed) HTML.
+                This requires lxml. Otherwise, the source must be XML.
+            features : str (optional)
+                The BeautifulSoup tree builder used to build each Node.
+                Defaults to 'xml' if lxml is installed, 'html.parser'
+                otherwise.
+
+        Returns:
+
+            A :class:`LazyCollection` of Nodes
+
+        Examples:
+
+            items = Soupy.iterparse('feed.xml', 'item')
+            for row in items.dump(title=Q.find('title').text):
+                ...
+        """
+        return LazyCollection(_iterparse(source, tag, html, features))
+
+    @classmethod
+    def from_bytes(cls, data, *args, **kwargs):
+        """
+        Parse an undecoded document, like the body of an HTTP response.
+
+        Passing bytes to :class:`Soupy` makes BeautifulSoup guess their
+        encoding, which is slow for large documents. Instead, this
+        decodes the bytes with the first of these that applies:
+
+         1. A byte order mark
+         2. The ``encoding`` argument, or the charset of ``content_type``
+         3. A ``<meta charset>`` tag or XML declaration in the first
+            1024 bytes (unless ``prescan`` is False)
+         4. UTF-8, if the bytes are valid UTF-8
+         5. BeautifulSoup's encoding detection
+
+        Encodings that are unknown, or that can't decode the bytes,
+        are skipped. :func:`encoding_stats` counts how often each
+        step is used.
+
+        Parameters:
+
+            data : bytes
+                The document to parse
+            encoding : str (optional)
+                The encoding of the document, if known
+            content_type : str (optional)
+                A Content-Type header, like ``text/html; charset=utf-8``
+            prescan : bool (optional)
+                Whether to look for an encoding declared in the document.
+                Default is True
+            args, kwargs :
+                Passed to :class:`Soupy`
+
+        Returns:
+
+            A :class:`Soupy` (or :class:`LxmlNode`, with engine='lxml').
+            For BeautifulSoup documents, the encoding is stored in
+            ``original_encoding``, as if BeautifulSoup had detected it.
+
+        Examples:
+
+            resp = requests.get(url)
+            doc = Soupy.from_bytes(resp.content, 'lxml',
+                                   content_type=resp.headers['Content-Type'])
+        """
+        encoding = kwargs.pop('encoding', None)
+        content_type = kwargs.pop('content_type', None)
+        prescan = kwargs.pop('prescan', True)
+        if isinstance(data, six.text_type):
+            raise TypeError("from_bytes expects bytes, not text")
+
+        text, encoding = _decode(bytes(data), encoding, content_type, prescan)
+        result = cls(text, *args, **kwargs)
+        if isinstance(result._value, BeautifulSoup):
+            result._value.original_encoding = encoding
+        return result
+
+    def save(self, path):
+        """
+        Write this document to a compact binary file, which
+        :meth:`Soupy.load` reads back without parsing any markup.
+
+        The file holds a table of the distinct strings in the document
+        (tag names, attributes and text), a fixed-size record for
+        each element and string, and a table of attributes.
+        Source line numbers aren't saved.
+
+        Parameters:
+
+            path : filename or binary file object
+                Where to write the document
+
+        Examples:
+
+            Soupy(html, 'lxml').save('page.soupy')
+        """
+        _save_tree(self._value, path)
+
+    @classmethod
+    def load(cls, path, tag=None, features=None, **kwargs):
+        """
+        Read a document written by :meth:`Soupy.save`.
+
+        The tree is rebuilt directly from the file's records, which
+        is much faster than parsing HTML.
+
+        Parameters:
+
+            path : filename or binary file object
+                The saved document
+            tag : str (optional)
+                If given, only rebuild the elements with this name
+                (without any namespace prefix), one at a time, as
+                they are needed. Matches nested inside another
+                match are part of the outer Node.
+            features : str (optional)
+                The BeautifulSoup tree builder to use. Defaults to the
+                builder that parsed the saved document.
+            kwargs :
+                Passed to :class:`Soupy` (like index or cache), when
+                loading the whole document
+
+        Returns:
+
+            A :class:`Soupy`, or a :class:`LazyCollection` of Nodes
+            if tag is given
+
+        Examples:
+
+            doc = Soupy.load('page.soupy', index=True)
+            for item in Soupy.load('feed.soupy', 'item'):
+                ...
+        """
+        saved = _SavedTree(path)
+        if tag is not None:
+            return LazyCollection(saved.subtrees(tag, features))
+        return cls(saved.build(features), **kwargs)
+
+
+# The number of documents decoded by each step of Soupy.from_bytes
+_ENCODING_STATS = dict.fromkeys(
+    ('bom', 'declared', 'prescan', 'utf-8', 'detected'), 0)
+_ENCODING_LOCK = threading.Lock()
+
+# the UTF-32 LE BOM starts with the UTF-16 LE one, so it comes first
+_BOMS = ((codecs.BOM_UTF8, 'utf-8'),
+         (codecs.BOM_UTF32_LE, 'utf-32-le'),
+         (codecs.BOM_UTF32_BE, 'utf-32-be'),
+         (codecs.BOM_UTF16_LE, 'utf-16-le'),
+         (codecs.BOM_UTF16_BE, 'utf-16-be'))
+
+
+def encoding_stats(reset=False):
+    """
+    Count how often :meth:`Soupy.from_bytes` decoded documents
+    with each of its steps, in this process.
+
+    Parameters:
+
+        reset : bool (optional)
+            If True, set the counts back to zero
+
+    Returns:
+
+        A dict mapping 'bom', 'declared', 'prescan', 'utf-8' and
+        'detected' to the number of documents decoded that way
+
+    Examples:
+
+        >>> stats = encoding_stats()
+        >>> stats['detected'] / float(sum(stats.values()))  # doctest: +SKIP
+        0.002
+    """
+    with _ENCODING_LOCK:
+        stats = dict(_ENCODING_STATS)
+        if reset:
+            for key in _ENCODING_STATS:
+                _ENCODING_STATS[key] = 0
+    return stats
+
+
+def _decode(data, encoding, content_type, prescan):
+    """
+    Decode bytes for Soupy.from_bytes.
+
+    Returns the text, and the name of its encoding
+    """
+    for bom, name in _BOMS:
+        if data.startswith(bom):
+            _count_encoding('bom')
+            return data[len(bom):].decode(name, 'replace'), name
+
+    for step, name in _candidate_encodings(data, encoding, content_type,
+                                           prescan):
+        try:
+            name = codecs.lookup(name).name
+            text = data.decode(name)
+        except (LookupError, UnicodeDecodeError):
+            continue
+        _count_encoding(step)
+        return text, name
+
+    _count_encoding('detected')
+    dammit = UnicodeDammit(data, is_html=True)
+    if dammit.unicode_markup is None:  # pragma: no cover
+        return data, None
+    return dammit.unicode_markup, dammit.original_encoding
+
+
+def _candidate_encodings(data, encoding, content_type, prescan):
+    """
+    Yield the (step, encoding) pairs that _decode tries, in order
+    """
+    if encoding is None and content_type:
+        match = HEADER_CHARSET.search(content_type)
+        encoding = match and match.group(1)
+    if encoding:
+        yield 'declared', encoding
+
+    if prescan:
+        head = data[:1024]
+        match = XML_ENCODING.match(head) or META_CHARSET.search(head)
+        if match is not None:
+            name = match.group(1).decode('ascii')
+            # ASCII-compatible markup can't really be UTF-16
+            if name.lower().startswith('utf-16'):
+                name = 'utf-8'
+            yield 'prescan', name
+
+    yield 'utf-8', 'utf-8'
+
+
+def _count_encoding(step):
+    with _ENCODING_LOCK:
+        _ENCODING_STATS[step] += 1
+
+
+def _iterparse(source, tag, html, features):
+    if html:
+        if etree is None:
+            raise ImportError("Parsing HTML with iterparse requires lxml")
+        context = etree.iterparse(source, events=('start', 'end'),
+                                  html=True)
+    else:
+        context = (etree or ElementTree).iterparse(source,
+                                                   events=('start', 'end'))
+
+    if features is None:
+        features = 'xml' if etree is not None and not html else 'html.parser'
+
+    stack = []
+    depth = 0  # number of open elements matching tag
+
+    for event, element in context:
+        matches = _local_name(element.tag) == tag
+
+        if event == 'start':
+            stack.append(element)
+            depth += matches
+            continue
+
+        stack.pop()
+        depth -= matches
+        if depth:
+            continue
+
+        if matches:
+            yield Node(_etree_to_soup(element, features))
+
+        # free every finished subtree outside of a match, so the
+        # partial tree doesn't grow with the document
+        element.clear()
+        if stack:
+            stack[-1].remove(element)
+
+
+def _local_name(name):
+    """
+    Strip the namespace from an ElementTree tag or attribute name.
+
+    Returns None for comments and processing instructions.
+    """
+    if not isinstance(name, six.string_types):
+        return None
+    return name.rsplit('}', 1)[-1]
+
+
+def _etree_to_soup(element, features):
+    """
+    Convert an ElementTree (or lxml) element into a BeautifulSoup Tag
+    """
+    soup = BeautifulSoup('', features)
+
+    # (element, tail) to open, or (tag name, tail) to close, in an
+    # explicit stack so deeply nested elements don't hit the
+    # recursion limit
+    pending = [(True, element, None)]
+    while pending:
+        opening, item, tail = pending.pop()
+        if not opening:
+            soup.handle_endtag(item)
+        else:
+            name = _local_name(item.tag)
+            if name is not None:
+                attrs = dict((_local_name(key), value)
+                             for key, value in item.attrib.items())
+                soup.handle_starttag(name, None, None, attrs)
+                if item.text:
+                    soup.handle_data(item.text)
+                pending.append((False, name, tail))
+                pending.extend((True, child, child.tail)
+                               for child in reversed(item))
+                continue
+        if tail:
+            soup.handle_data(tail)
+
+    soup.endData()
+    return soup.contents[0]
+
+
+# Soupy.save files hold a header, a table of strings, records of four
+# uint32s for each element and string, and an attribute table. Strings
+# are (class name, text, 0, position + 1) records, and tags are
+# (_NO_STRING, name, attributes, end) records, where end is the position
+# after the tag's last descendant. Attributes point to a run of
+# (namespace, prefix, count, name, value, name, value...) in the
+# attribute table, or are _NO_STRING. Integers are little-endian, and
+# sections are padded to 4 bytes.
+_SAVE_MAGIC = b'SOUPYDOC'
+_SAVE_VERSION = 1
+_SAVE_HEADER = struct.Struct(str('<8s5I'))
+_RECORD_SIZE = 4
+_NO_STRING = 0xFFFFFFFF
+_UINT32 = str('I') if array.array(str('I')).itemsize == 4 else str('L')
+_STRING_ERRORS = 'surrogatepass' if six.PY3 else 'strict'
+
+
+def _uint32_bytes(values):
+    if sys.byteorder == 'big':  # pragma: no cover
+        values = array.array(_UINT32, values)
+        values.byteswap()
+    return values.tobytes() if six.PY3 else values.tostring()
+
+
+def _uint32_array(data):
+    values = array.array(_UINT32)
+    if six.PY3:
+        values.frombytes(data)
+    else:  # pragma: no cover
+        values.fromstring(data)
+    if sys.byteorder == 'big':  # pragma: no cover
+        values.byteswap()
+    return values
+
+
+def _save_tree(element, path):
+    """
+    Write element (and its descendants) in the format of Soupy.save
+    """
+    strings = {}
+
+    def intern(string):
+        if string is None:
+            return _NO_STRING
+        try:
+            return strings[string]
+        except KeyError:
+            strings[string] = len(strings)
+            return strings[string]
+
+    # the first string is the name of the builder
+    root = element
+    while root.parent is not None:
+        root = root.parent
+    features = getattr(getattr(root, 'builder', None), 'NAME', None)
+    if features is None:
+        features = 'xml' if element._is_xml else 'html.parser'
+    intern(features)
+
+    records = array.array(_UINT32)
+    attrs = array.array(_UINT32)
+    if isinstance(element, BeautifulSoup):
+        todo = [iter(element.contents)]
+    else:
+        todo = [iter([element])]
+    open_tags = []
+
+    while todo:
+        for child in todo[-1]:
+            pos = len(records) // _RECORD_SIZE
+            if not isinstance(child, Tag):
+                records.extend((intern(type(child).__name__), intern(child),
+                                0, pos + 1))
+                continue
+
+            name, prefix = child.name, child.prefix
+            if prefix and name.startswith(prefix + ':'):
+                name = name[len(prefix) + 1:]
+            if child.attrs or child.namespace or prefix:
+                first = len(attrs)
+                attrs.extend((intern(child.namespace), intern(prefix),
+                              len(child.attrs)))
+                for key, value in child.attrs.items():
+                    if isinstance(value, list):
+                        value = ' '.join(value)
+                    attrs.extend((intern(six.text_type(key)),
+                                  intern(six.text_type(value))))
+            else:
+                first = _NO_STRING
+            records.extend((_NO_STRING, intern(name), first, 0))
+            open_tags.append(pos)
+            todo.append(iter(child.contents))
+            break
+        else:
+            todo.pop()
+            if open_tags and len(open_tags) == len(todo):
+                pos = open_tags.pop()
+                records[pos * _RECORD_SIZE + 3] = len(records) // _RECORD_SIZE
+
+    encoded = [string.encode('utf-8', _STRING_ERRORS)
+               for string in sorted(strings, key=strings.get)]
+    offsets = array.array(_UINT32, [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    data = b''.join(encoded)
+
+    header = _SAVE_HEADER.pack(_SAVE_MAGIC, _SAVE_VERSION, len(encoded),
+                               len(data), len(records) // _RECORD_SIZE,
+                               len(attrs))
+    sections = [header, _uint32_bytes(offsets), data,
+                b'\0' * (-len(data) % 4),
+                _uint32_bytes(records), _uint32_bytes(attrs)]
+
+    if hasattr(path, 'write'):
+        path.writelines(sections)
+    else:
+        with open(path, 'wb') as outfile:
+            outfile.writelines(sections)
+
+
+class _SavedTree(object):
+
+    """
+    A document written by Soupy.save.
+
+    Strings are only decoded when they are needed.
+    """
+
+    def __init__(self, path):
+        if hasattr(path, 'read'):
+            data = path.read()
+        else:
+            with open(path, 'rb') as infile:
+                data = infile.read()
+
+        try:
+            (magic, version, num_strings, strings_size, num_records,
+             num_attrs) = _SAVE_HEADER.unpack_from(data, 0)
+        except struct.error:
+            raise ValueError("Not a saved Soupy document")
+        if magic != _SAVE_MAGIC or version != _SAVE_VERSION:
+            raise ValueError("Not a saved Soupy document")
+
+        pos = _SAVE_HEADER.size
+        size = 4 * (num_strings + 1)
+        self._offsets = _uint32_array(data[pos:pos + size])
+        self._data = data[pos + size:pos + size + strings_size]
+        pos += size + strings_size + -strings_size % 4
+        size = 4 * _RECORD_SIZE * num_records
+        self._records = _uint32_array(data[pos:pos + size])
+        pos += size
+        self._attrs = _uint32_array(data[pos:pos + 4 * num_attrs])
+        if (len(self._offsets) != num_strings + 1 or
+                len(self._records) != _RECORD_SIZE * num_records or
+                len(self._attrs) != num_attrs):
+            raise ValueError("Not a saved Soupy document")
+        self._strings = [None] * num_strings
+        self.features = self.string(0)
+
+    def string(self, index):
+        if index == _NO_STRING:
+            return None
+        result = self._strings[index]
+        if result is None:
+            start, end = self._offsets[index], self._offsets[index + 1]
+            result = self._data[start:end].decode('utf-8', _STRING_ERRORS)
+            self._strings[index] = result
+        return result
+
+    def build(self, features=None, start=0, stop=None):
+        """
+        Rebuild the records in [start, stop) as a BeautifulSoup document.
+
+        Rather than replaying the document through the builder, the
+        elements are created directly and linked together.
+        """
+        num_records = len(self._records) // _RECORD_SIZE
+        if stop is None:
+            stop = num_records
+        soup = BeautifulSoup('', features or self.features)
+        builder, is_xml = soup.builder, soup.is_xml
+        records, attrs, string = self._records, self._attrs, self.string
+        if stop - start == num_records:
+            # every string is needed, so decode them all at once
+            text = self._decode_all().__getitem__
+        else:
+            text = string
+        string_classes = {}
+
+        stack = [(stop, soup)]  # (end, tag) of the open tags
+        previous = None
+        for pos in range(start, stop):
+            while stack[-1][0] == pos:
+                stack.pop()
+            parent = stack[-1][1]
+
+            i = pos * _RECORD_SIZE
+            kind, name, first, end = records[i:i + _RECORD_SIZE]
+            if kind != _NO_STRING:
+                cls = string_classes.get(kind)
+                if cls is None:
+                    cls = getattr(bs4_element, string(kind), None)
+                    if not (isinstance(cls, type) and
+                            issubclass(cls, NavigableString)):
+                        cls = NavigableString
+                    string_classes[kind] = cls
+                element = cls(text(name))
+            else:
+                if first == _NO_STRING:
+                    namespace = prefix = None
+                    tag_attrs = {}
+                else:
+                    namespace = string(attrs[first])
+                    prefix = string(attrs[first + 1])
+                    tag_attrs = dict(
+                        (text(attrs[j]), text(attrs[j + 1]))
+                        for j in range(first + 3,
+                                       first + 3 + 2 * attrs[first + 2], 2))
+                    if is_xml:
+                        _register_namespaces(soup, tag_attrs)
+
+                element = Tag(soup, builder, text(name), namespace, prefix,
+                              tag_attrs)
+                element._namespaces = soup._namespaces
+                stack.append((end, element))
+
+            element.parent = parent
+            element.previous_element = previous
+            element.next_element = element.next_sibling = None
+            if previous is not None:
+                previous.next_element = element
+            siblings = parent.contents
+            if siblings:
+                element.previous_sibling = siblings[-1]
+                siblings[-1].next_sibling = element
+            else:
+                element.previous_sibling = None
+            siblings.append(element)
+            previous = element
+
+        soup._most_recent_element = previous
+        return soup
+
+    def _decode_all(self):
+        offsets, data = self._offsets, self._data
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8',
+                                                       _STRING_ERRORS)
+                for i in range(len(offsets) - 1)]
+
+    def subtrees(self, tag, features=None):
+        """
+        Yield a Node for each element named tag, building
+        each one when it is reached
+        """
+        target = self._find_string(tag)
+        records = self._records
+        pos, stop = 0, len(records) // _RECORD_SIZE
+        while target is not None and pos < stop:
+            i = pos * _RECORD_SIZE
+            if records[i] != _NO_STRING or records[i + 1] != target:
+                pos += 1
+                continue
+            end = records[i + 3]
+            soup = self.build(features, pos, end)
+            yield Node(soup.contents[0])
+            pos = end
+
+    def _find_string(self, value):
+        """
+        The index of a string in the table, or None
+        """
+        data = value.encode('utf-8', _STRING_ERRORS)
+        offsets = self._offsets
+        for index in range(len(self._strings)):
+            if (offsets[index + 1] - offsets[index] == len(data) and
+                    self._data[offsets[index]:offsets[index + 1]] == data):
+                return index
+        return None
+
+
+def _register_namespaces(soup, attrs):
+    """
+    Record the namespace prefixes declared by a tag's attributes,
+    like BeautifulSoup's XML builder does
+    """
+    for key, value in attrs.items():
+        if key.startswith('xmlns:'):
+            prefix = key[len('xmlns:'):]
+            if prefix not in soup._namespaces:
+                soup._namespaces[prefix] = value
+
+
+def strainer(*queries):
+    """
+    Build a SoupStrainer that only keeps the parts of a document
+    needed by some queries.
+
+    The strainer is derived from the leading ``find`` or ``find_all``
+    call of each query. Passing it as the ``parse_only`` argument to
+    :class:`Soupy` (or BeautifulSoup) skips building the rest
+    of the document, which saves time and memory.
+
+    Note that the queries only see the matching elements (and their
+    contents) in the parsed document, not the ancestors or siblings
+    of those elements.
+
+    Parameters:
+
+        queries : Q expressions, or dicts/lists/tuples of expressions
+
+    Returns:
+
+        A SoupStrainer, or None if some query needs the whole document
+        (for example, if it doesn't start with a find call)
+
+    Examples:
+
+        strainer(Q.find('table', id='prices').find_all('tr'))
+        strainer({'title': Q.find('h1').text,
+                  'links': Q.find_all('a').each(Q['href'])})
+    """
+    specs = []
+    for query in _iter_queries(queries):
+        spec = _leading_search(query)
+        if spec is None:
+            return None
+        specs.append(spec)
+
+    if not specs:
+        return None
+
+    names = []
+    for name, _ in specs:
+        if name not in names:
+            names.append(name)
+    attrs = specs[0][1]
+
+    if all(spec_attrs == attrs for _, spec_attrs in specs):
+        if None in names:
+            return SoupStrainer(None, attrs)
+        return SoupStrainer(names if len(names) > 1 else names[0], attrs)
+
+    # Different attribute restrictions can't be combined into
+    # one strainer, but the tag names still narrow things down
+    if None in names:
+        return None
+    return SoupStrainer(names)
+
+
+def _iter_queries(queries):
+    for query in queries:
+        if isinstance(query, dict):
+            query = list(query.values())
+        if isinstance(query, (list, tuple)):
+            for item in _iter_queries(query):
+                yield item
+        else:
+            yield query
+
+
+def _leading_search(query):
+    """
+    Extract the (name, attrs) of the find/find_all call at the start
+    of an expression, or None if the expression doesn't start
+    with a search that a SoupStrainer can reproduce.
+    """
+    if not isinstance(query, Chain):
+        return None
+
+    items = [item for item in query if type(item) is not Expression]
+    if (len(items) < 2 or type(items[0]) is not Attr or
+            items[0]._name not in ('find', 'find_all') or
+            type(items[1]) is not Call):
+        return None
+
+    call = items[1]
+    if len(call._args) > len(_SimpleQuery._positional):
+        return None
+    params = dict(zip(_SimpleQuery._positional, call._args))
+    params.update(call._kwargs)
+
+    params.pop('limit', None)
+    if not params.pop('recursive', True):
+        return None
+    if params.pop('string', None) is not None:
+        return None
+    if params.pop('text', None) is not None:
+        return None
+
+    name = params.pop('name', None)
+    attrs = params.pop('attrs', None) or {}
+    if isinstance(attrs, six.string_types):
+        attrs = {'class': attrs}
+    attrs = dict(attrs)
+    if 'class_' in params:
+        params['class'] = params.pop('class_')
+    attrs.update(params)
+
+    # functions are called with different arguments while parsing
+    if callable(name) or (name is None and not attrs):
+        return None
+    # None and False ask for tags without the attribute,
+    # which is left to a full parse
+    if any(value is None or value is False for value in attrs.values()):
+        return None
+    return name, attrs
+
+
+class Schema(object):
+
+    """
+    A set of fields (Q expressions) to extract from Nodes, like
+    the arguments to :meth:`Node.dump`.
+
+    Calling a Schema on a Node gives the same result as
+    ``node.dump(*args, **kwargs)``. However, the leading ``find``,
+    ``find_all`` or ``select`` call of every field is answered from
+    a single walk through the Node's descendants, instead of one
+    search per field. Fields that start with the same search share
+    its result.
+
+    Only simple searches are merged: tag names, ids and single
+    classes (like ``find('td', class_='price')`` or
+    ``select('div#main')``). Other fields, and every field of
+    Nodes from documents with an index (see :class:`Soupy`),
+    are evaluated as usual.
+
+    Parameters:
+
+        args, kwargs :
+            The fields, as passed to :meth:`Node.dump`
+
+    Examples:
+
+        product = Schema(title=Q.find('h1').text,
+                         price=Q.find('span', 'price').text.orelse(None),
+                         links=Q.find_all('a').each(Q['href']))
+        product(node)
+        products.each(product)
+    """
+
+    def __init__(self, *args, **kwargs):
+        if args and kwargs:
+            raise ValueError('Cannot pass both arguments and '
+                             'keywords to Schema')
+
+        self._args = args
+        self._kwargs = kwargs
+        fields = list(args) if args else list(kwargs.values())
+
+        # the distinct leading searches, and the (search, rest) of each
+        # field (search is None for fields evaluated as usual)
+        self._searches = []
+        self._plans = []
+        for field in fields:
+            plan = _schema_plan(field)
+            if plan is None:
+                self._plans.append((None, None))
+                continue
+            search, rest = plan
+            if search not in self._searches:
+                self._searches.append(search)
+            steps = () if rest is None else tuple(
+                (item, func) for _, item, func in _plan_steps(rest._items))
+            self._plans.append((self._searches.index(search), steps))
+
+    def __call__(self, node):
+        if (type(node) not in (Node, Soupy) or
+                (node._doc is not None and node._doc.index is not None) or
+                not self._searches):
+            return node.dump(*self._args, **self._kwargs)
+
+        found = _schema_walk(node._value, self._searches)
+        results = []
+        for search, elements in zip(self._searches, found):
+            if elements is None:
+                results.append(None)
+            elif search[0] == 'find':
+                results.append(node._wrap(elements[0]) if elements
+                               else NullNode())
+            else:
+                results.append(Collection._from_wrappers(
+                    map(node._wrap, elements)))
+
+        fields = self._args or list(self._kwargs.values())
+        values = []
+        for field, (i, steps) in zip(fields, self._plans):
+            if i is None or results[i] is None:
+                values.append(_unwrap(node.apply(field)))
+                continue
+            value = results[i]
+            try:
+                for inner_expr, func in steps:
+                    value = func(value)
+            except Exception:
+                # describe the error the same way as dump does
+                _reraise_step(field, node, inner_expr, value,
+                              sys.exc_info())
+            values.append(_unwrap(Wrapper.wrap(value)))
+
+        if self._args:
+            return Wrapper.wrap(tuple(values))
+        return Wrapper.wrap(dict(zip(self._kwargs, values)))
+
+    def __repr__(self):
+        fields = [six.text_type(field) for field in self._args]
+        fields.extend('%s=%s' % (name, field)
+                      for name, field in self._kwargs.items())
+        return 'Schema(%s)' % ', '.join(fields)
+
+
+def _schema_plan(field):
+    """
+    Split a Schema field into its leading search and the rest
+    of the expression.
+
+    Returns ((method, query, limit), rest), where rest is None if
+    the field is just the search, or None if the field doesn't start
+    with a search that _schema_walk can answer.
+    """
+    if not isinstance(field, Chain):
+        return None
+
+    items = [item for item in field if type(item) is not Expression]
+    if (len(items) < 2 or type(items[0]) is not Attr or
+            type(items[1]) is not Call):
+        return None
+
+    method, call = items[0]._name, items[1]
+    if method in ('find', 'find_all'):
+        query = _SimpleQuery.parse(call._args, call._kwargs,
+                                   method == 'find_all')
+        if query is None:
+            return None
+        limit = 1 if method == 'find' else query.limit
+    elif method == 'select':
+        if call._kwargs or len(call._args) != 1:
+            return None
+        selector = call._args[0]
+        if isinstance(selector, CompiledSelector):
+            query = selector.query
+        elif isinstance(selector, six.string_types):
+            query = _SimpleQuery.from_selector(selector)
+        else:
+            return None
+        if query is None:
+            return None
+        limit = None
+    else:
+        return None
+
+    key = (method, (query.name, query.id, query.class_), limit or None)
+    rest = Chain(items[2:]) if len(items) > 2 else None
+    return key, rest
+
+
+def _schema_walk(element, searches):
+    """
+    Find the descendants of element matching each of a Schema's
+    searches, in a single pass.
+
+    Returns a list of elements for each search, or None for searches
+    that can't be answered for this element.
+    """
+    found = [[] for _ in searches]
+    queries = {}
+    for i, (method, key, limit) in enumerate(searches):
+        # selectors lowercase tag names, which only works for HTML
+        if method == 'select' and getattr(element, '_is_xml', True):
+            found[i] = None
+            continue
+        queries[i] = (_SimpleQuery(*key), limit)
+
+    def dispatch():
+        by_name, generic = {}, []
+        for i, (query, _) in queries.items():
+            if query.name is None:
+                generic.append(i)
+            else:
+                by_name.setdefault(query.name, []).append(i)
+        return by_name, generic
+
+    by_name, generic = dispatch()
+    unlimited = sum(1 for _, limit in queries.values() if not limit)
+
+    for tag in element.descendants:
+        if not isinstance(tag, Tag):
+            continue
+
+        candidates = by_name.get(tag.name, [])
+        if generic:
+            candidates = candidates + generic
+
+        for i in candidates:
+            query, limit = queries[i]
+            if not query.matches(tag):
+                continue
+            found[i].append(tag)
+            if limit and len(found[i]) >= limit:
+                del queries[i]
+                by_name, generic = dispatch()
+
+        if not unlimited and not queries:
+            break
+
+    return found
+
+
+class CompiledSelector(object):
+
+    """
+    A parsed CSS selector, which can be passed to :meth:`Node.select`.
+
+    Use :func:`compile_selector` to build these.
+    """
+
+    def __init__(self, selector, namespaces=None, flags=0):
+        self.selector = selector
+        self.namespaces = namespaces
+        self.flags = flags
+
+        if soupsieve is not None:
+            self._pattern = soupsieve.compile(selector, namespaces, flags)
+        else:  # pragma: no cover
+            self._pattern = None
+
+        # the equivalent find_all query, for indexed documents
+        self.query = _SimpleQuery.from_selector(selector)
+
+    def select(self, element, limit=0):
+        """
+        Return a list of the elements inside ``element`` that match
+        """
+        if self._pattern is None:  # pragma: no cover
+            return element.select(self.selector)
+        return self._pattern.select(element, limit)
+
+    def match(self, element):
+        """
+        Return whether ``element`` matches the selector
+        """
+        if self._pattern is None:  # pragma: no cover
+            raise NotImplementedError("match requires soupsieve")
+        return self._pattern.match(element)
+
+    def __reduce__(self):
+        return compile_selector, (self.selector, self.namespaces, self.flags)
+
+    def __repr__(self):
+        return 'CompiledSelector(%r)' % self.selector
+
+
+# compile_selector's cache, and its maximum size
+_SELECTORS = OrderedDict()
+_MAX_SELECTORS = 1000
+_CACHE_LOCK = threading.Lock()
+
+
+def _lru_cached(cache, key, build, size):
+    """
+    Look up key in a least-recently-used cache of at most size
+    items, calling build() to make its value if it's missing
+    """
+    with _CACHE_LOCK:
+        result = cache.pop(key, _MISSING)
+        if result is _MISSING:
+            result = build()
+        cache[key] = result  # most recently used
+        if len(cache) > size:
+            cache.popitem(last=False)
+    return result
+
+
+def compile_selector(selector, namespaces=None, flags=0):
+    """
+    Parse a CSS selector once, so that it can be re-used.
+
+    Compiled selectors are cached for the lifetime of the process,
+    so calling this again with the same selector is cheap.
+
+    Parameters:
+
+        selector : str
+            The CSS selector
+        namespaces : dict (optional)
+            Namespace prefixes used in the selector, for XML documents
+        flags : int (optional)
+            Flags passed to ``soupsieve.compile``
+
+    Returns:
+
+        A :class:`CompiledSelector`
+
+    Examples:
+
+        links = compile_selector('div.result > a[href]')
+        for page in pages:
+            Soupy(page).select(links)
+    """
+    key = (selector, namespaces and tuple(sorted(namespaces.items())), flags)
+    return _lru_cached(
+        _SELECTORS, key,
+        lambda: CompiledSelector(selector, namespaces, flags),
+        _MAX_SELECTORS)
+
+
+def batch(query, documents, workers=None, chunksize=1, ordered=True,
+          capture=False, **kwargs):
+    """
+    Evaluate a query over many documents, using a pool of processes.
+
+    Each document is parsed with :class:`Soupy` in a worker process,
+    and the query is applied to it. Queries and results are sent
+    between processes with pickle, so the query should be
+    a Q expression, a module-level function, or a dump spec.
+
+    Parameters:
+
+        query : Expression, function(Node), dict or tuple
+            What to extract from each document. A dict or tuple
+            is treated as the keywords or arguments to :meth:`Node.dump`
+        documents : iterable
+            The markup of each document
+        workers : int (optional)
+            The number of worker processes. Defaults to the number of CPUs.
+            If 0, documents are processed in the current process.
+        chunksize : int (optional)
+            How many documents to send to a worker at a time
+        ordered : bool (optional)
+            If True (the default), results are yielded in the same order
+            as ``documents``. Otherwise, they are yielded as they finish.
+        capture : bool (optional)
+            If True, exceptions raised while processing a document
+            (including :class:`NullValueError` for Null results) are
+            stored in the result, instead of being re-raised.
+        kwargs :
+            Extra keywords passed to :class:`Soupy`, like ``features``
+
+    Returns:
+
+        An iterator of :class:`BatchResult` namedtuples, with the index
+        of each document, the extracted (unwrapped) value, and the
+        captured exception (or None)
+
+    Examples:
+
+        for result in batch(Q.find('title').text, pages, workers=4):
+            print(result.index, result.value)
+    """
+    chunks = _iter_chunks(enumerate(documents), chunksize)
+
+    if workers == 0:
+        for chunk in chunks:
+            for result in _batch_worker(query, chunk, capture, kwargs):
+                yield result
+        return
+
+    if futures is None:  # pragma: no cover
+        raise ImportError("batch requires concurrent.futures "
+                          "(install the 'futures' package on Python 2)")
+
+    workers = workers or multiprocessing.cpu_count()
+    pending = deque()
+
+    # Only keep a few chunks in flight, so that arbitrarily long
+    # iterators of documents can be processed with bounded memory
+    with futures.ProcessPoolExecutor(workers) as pool:
+        try:
+            for chunk in chunks:
+                pending.append(pool.submit(_batch_worker, query, chunk,
+                                           capture, kwargs))
+                if len(pending) < 2 * workers:
+                    continue
+
+                for result in _finish_batch(pending, ordered):
+                    yield result
+
+            while pending:
+                for result in _finish_batch(pending, ordered):
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _iter_chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _finish_batch(pending, ordered):
+    """
+    Remove a completed chunk from the pending queue, and return its results
+    """
+    if ordered:
+        return pending.popleft().result()
+
+    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+    future = done.pop()
+    pending.remove(future)
+    return future.result()
+
+
+def _batch_worker(query, chunk, capture, kwargs):
+    result = []
+    for index, document in chunk:
+        try:
+            value = _extract(query, document, kwargs)
+        except Exception as exc:
+            if not capture:
+                raise
+            result.append(BatchResult(index, None, exc))
+        else:
+            result.append(BatchResult(index, value, None))
+    return result
+
+
+def _extract(query, document, kwargs):
+    """
+    Parse a document, and return the unwrapped result of a query or dump spec
+    """
+    node = Soupy(document, **kwargs)
+    if isinstance(query, dict):
+        return node.dump(**query).val()
+    if isinstance(query, (tuple, list)):
+        return node.dump(*query).val()
+    return _unwrap(node.apply(query))
+
+
+def aextract(source, query, executor=None, **kwargs):
+    """
+    Parse a document and evaluate a query, without blocking the event loop.
+
+    The parsing and querying are run in ``executor``, and the
+    returned future resolves to the same (unwrapped) value that
+    :func:`batch` would produce for the document.
+
+    Parameters:
+
+        source : markup or awaitable
+            The document, or an awaitable (e.g. a coroutine that fetches
+            a page) that resolves to the document
+        query : Expression, function(Node), dict or tuple
+            What to extract from the document. A dict or tuple
+            is treated as the keywords or arguments to :meth:`Node.dump`
+        executor : concurrent.futures.Executor (optional)
+            Where to do the work. Defaults to the event loop's default
+            executor (a thread pool). A ProcessPoolExecutor requires
+            the query to be picklable.
+        kwargs :
+            Extra keywords passed to :class:`Soupy`, like ``features``
+
+    Returns:
+
+        An asyncio Future. aextract must be called while an event
+        loop is running (from a coroutine or callback), and raises
+        RuntimeError otherwise.
+
+    Examples:
+
+        title = await aextract(fetch(url), Q.find('title').text)
+    """
+    try:
+        loop = _event_loop()
+    except RuntimeError:
+        if asyncio.iscoroutine(source):
+            source.close()  # don't warn that it was never awaited
+        raise
+    result = loop.create_future()
+
+    def run(document):
+        work = loop.run_in_executor(executor, _extract, query,
+                                    document, kwargs)
+        _chain_future(work, result)
+
+    if _isawaitable(source):
+        fetch = asyncio.ensure_future(source, loop=loop)
+        _chain_future(fetch, result, run)
+    else:
+        run(source)
+
+    return result
+
+
+def abatch(query, sources, executor=None, concurrency=4, ordered=True,
+           capture=False, **kwargs):
+    """
+    Evaluate a query over many documents, as an asynchronous iterator.
+
+    This is the asyncio counterpart to :func:`batch`. At most
+    ``concurrency`` documents are fetched or processed at a time, and
+    new sources are only taken from ``sources`` as results are
+    consumed, so a slow consumer applies backpressure to the crawl.
+
+    Parameters:
+
+        query : Expression, function(Node), dict or tuple
+            What to extract from each document (see :func:`aextract`)
+        sources : iterable
+            The markup of each document, or awaitables that resolve
+            to the markup. Generators are consumed lazily.
+        executor : concurrent.futures.Executor (optional)
+            Where to parse and query documents (see :func:`aextract`)
+        concurrency : int (optional)
+            The maximum number of documents in flight
+        ordered : bool (optional)
+            If True (the default), results are yielded in the same order
+            as ``sources``. Otherwise, they are yielded as they finish.
+        capture : bool (optional)
+            If True, exceptions raised while processing a document
+            are stored in the result, instead of being re-raised.
+        kwargs :
+            Extra keywords passed to :class:`Soupy`, like ``features``
+
+    Returns:
+
+        An asynchronous iterator of :class:`BatchResult` namedtuples
+
+    Examples:
+
+        async for result in abatch(Q.find('title').text,
+                                   (fetch(url) for url in urls)):
+            print(result.index, result.value)
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    return _AsyncBatch(query, sources, executor, concurrency,
+                       ordered, capture, kwargs)
+
+
+class _AsyncBatch(object):
+
+    """
+    The asynchronous iterator returned by :func:`abatch`
+    """
+
+    def __init__(self, query, sources, executor, concurrency,
+                 ordered, capture, kwargs):
+        self._query = query
+        self._sources = enumerate(sources)
+        self._executor = executor
+        self._concurrency = concurrency
+        self._ordered = ordered
+        self._capture = capture
+        self._kwargs = kwargs
+        self._pending = deque()
+        self._index = {}
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        loop = _event_loop()
+        result = loop.create_future()
+        self._fill()
+
+        if not self._pending:
+            result.set_exception(StopAsyncIteration())
+            return result
+
+        def finish(future):
+            # leave the document pending if nobody is waiting for it
+            if result.done():
+                return
+
+            index = self._index.pop(future)
+            self._pending.remove(future)
+            if future.cancelled():
+                result.cancel()
+                return
+
+            exc = future.exception()
+            if exc is None:
+                result.set_result(BatchResult(index, future.result(), None))
+            elif self._capture:
+                result.set_result(BatchResult(index, None, exc))
+            else:
+                result.set_exception(exc)
+
+        if self._ordered:
+            self._pending[0].add_done_callback(finish)
+            return result
+
+        def first_done(future):
+            for other in self._pending:
+                other.remove_done_callback(first_done)
+            finish(future)
+
+        for future in self._pending:
+            future.add_done_callback(first_done)
+        return result
+
+    def _fill(self):
+        """
+        Start work on new sources, until ``concurrency`` are in flight
+        """
+        while len(self._pending) < self._concurrency:
+            try:
+                index, source = next(self._sources)
+            except StopIteration:
+                return
+            future = aextract(source, self._query, self._executor,
+                              **self._kwargs)
+            self._index[future] = index
+            self._pending.append(future)
+
+    def aclose(self):
+        """
+        Cancel any documents that are still in flight
+        """
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        return asyncio.sleep(0)
+
+
+def _event_loop():
+    if asyncio is None:  # pragma: no cover
+        raise ImportError("aextract and abatch require asyncio")
+
+    if not hasattr(asyncio, 'get_running_loop'):  # pragma: no cover
+        return asyncio.get_event_loop()  # Python < 3.7
+
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        raise RuntimeError("aextract and abatch must be called "
+                           "from a running event loop")
+
+
+def _isawaitable(value):
+    return (hasattr(value, '__await__') or
+            asyncio.iscoroutine(value) or
+            isinstance(value, asyncio.Future))
+
+
+def _chain_future(source, target, callback=None):
+    """
+    Copy the outcome of ``source`` to ``target`` when it finishes,
+    or pass its result to ``callback`` instead. Cancelling
+    ``target`` cancels ``source``.
+    """
+    def done(future):
+        if target.cancelled():
+            return
+        if future.cancelled():
+            target.cancel()
+        elif future.exception() is not None:
+            target.set_exception(future.exception())
+        elif callback is not None:
+            callback(future.result())
+        else:
+            target.set_result(future.result())
+
+    def cancelled(future):
+        if future.cancelled():
+            source.cancel()
+
+    source.add_done_callback(done)
+    target.add_done_callback(cancelled)
 
 
 Q = Expression()
@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, division, unicode_literals
+import array
+import codecs
+from io import BytesIO
 import operator
+import pickle
+import re
+import threading
+
+try:
+    import asyncio
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    asyncio = None
 
 import pytest
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
 from six import PY3, text_type
 
-from soupy import (Soupy, Node, NullValueError, NullNode,
-                   Collection, NullCollection, Null, Q, Some,
+from soupy import (Soupy, Node, LxmlNode, NullValueError, NullNode,
+                   Collection, LazyCollection, NullCollection, Null, Q, Some,
                    Scalar, Wrapper, NavigableStringNode, either, QDebug,
-                   _dequote)
+                   batch, BatchResult, strainer, aextract, abatch,
+                   compile_selector, CompiledSelector, profile, Profile,
+                   ProfileStats, Schema, encoding_stats, _dequote,
+                   QKeyError, _SimpleQuery, _normalize_text, NodeLike,
+                   _dump_plan)
 
 
 COLLECTION_PROPS = ('children',
@@ -149,6 +165,1064 @@ class TestNode(object):
 
         assert s.prettify() == s.val().prettify()
 
+    @pytest.mark.parametrize(('kwargs', 'expected'), [
+        ({}, 'hi there , you x'),
+        ({'limit': 7}, 'hi ther'),
+        ({'limit': 0}, ''),
+        ({'limit': 100}, 'hi there , you x'),
+        ({'separator': ''}, 'hi there, youx'),
+        ({'collapse': False}, 'hi   there , \n  you x'),
+        ({'strip': False}, ' hi there , you x '),
+        ({'strip': False, 'collapse': False, 'separator': ''},
+         ' hi  there, \n  youx '),
+    ])
+    def test_text_(self, kwargs, expected):
+        node = Soupy('<p> hi  <b>there</b>, \n  you<i>x </i></p>',
+                     'html.parser').find('p')
+        assert node.text_(**kwargs).val() == expected
+
+    def test_text_matches_text(self):
+        node = Soupy('<div>a<!-- c --><script>s</script> <b>b\n</b></div>',
+                     'html.parser')
+        assert node.text_(separator='').val() == \
+            ' '.join(node.text.val().split())
+
+    def test_text_stops_at_limit(self):
+        def strings():
+            yield 'abc  def'
+            raise AssertionError('read too far')
+
+        assert _normalize_text(strings(), limit=5) == 'abc d'
+
+    def test_text_negative_limit(self):
+        node = Soupy('<p>abc</p>', 'html.parser').find('p')
+        with pytest.raises(ValueError):
+            node.text_(limit=-1)
+        with pytest.raises(ValueError):
+            node.contents[0].text_(limit=-1)
+
+    def test_text_default(self):
+        # NodeLike subclasses get text_ from their text
+        node = Soupy('<p> hi  <b>there</b>\n</p>', 'html.parser').find('p')
+        assert NodeLike.text_(node).val() == 'hi there'
+        assert NodeLike.text_(node, limit=4).val() == 'hi t'
+        assert NodeLike.text_(NullNode()) is Null()
+
+
+class TestTable(object):
+
+    html = """
+    <div><table>
+      <caption>ignored</caption>
+      <tfoot><tr><td>f</td><td>f</td><td>f</td></tr></tfoot>
+      <thead>
+        <tr><th rowspan="2">Name</th><th colspan="2">Score</th></tr>
+        <tr><th>Math</th><th>Art</th></tr>
+      </thead>
+      <tbody>
+        <tr><td rowspan="2"> Ann  <b>B</b></td><td>1</td><td>2</td></tr>
+        <tr><td>3</td><td>4<table><tr><td>n</td></tr></table></td></tr>
+        <tr><td colspan="2x">z</td></tr>
+      </tbody>
+    </table></div>
+    """
+
+    rows = [['Name', 'Score', 'Score'],
+            ['Name', 'Math', 'Art'],
+            ['Ann B', '1', '2'],
+            ['Ann B', '3', '4 n'],
+            ['z', 'z', None],
+            ['f', 'f', 'f']]
+
+    @pytest.fixture(params=['bs4', 'lxml'])
+    def doc(self, request):
+        if request.param == 'lxml':
+            pytest.importorskip('lxml')
+            return Soupy(self.html, engine='lxml')
+        return Soupy(self.html, 'html.parser')
+
+    def test_table_rows(self, doc):
+        assert doc.table_rows().val() == self.rows
+        assert doc.find('table').table_rows().val() == self.rows
+
+    def test_section(self, doc):
+        assert doc.find('thead').table_rows().val() == self.rows[:2]
+
+    def test_records(self, doc):
+        records = doc.to_records().val()
+        assert records[0] == {'Name': 'Ann B', 'Score Math': '1',
+                              'Score Art': '2'}
+        assert len(records) == 4
+
+    def test_columns(self, doc):
+        columns = doc.to_records(columns=True).val()
+        assert list(columns) == ['Name', 'Score Math', 'Score Art']
+        assert columns['Score Art'] == ['2', '4 n', None, 'f']
+
+    def test_no_header(self, doc):
+        records = doc.to_records(header=False).val()
+        assert records[0] == {0: 'Name', 1: 'Score', 2: 'Score'}
+        assert len(records) == 6
+
+    def test_header_names(self, doc):
+        records = doc.to_records(header=['a', 'b', 'c', 'd']).val()
+        assert records[-1] == {'a': 'f', 'b': 'f', 'c': 'f', 'd': None}
+
+    def test_short_header_names(self, doc):
+        records = doc.to_records(header=['a']).val()
+        assert records[-1] == {'a': 'f', '1': 'f', '2': 'f'}
+        columns = doc.to_records(header=['a'], columns=True).val()
+        assert list(columns) == ['a', '1', '2']
+
+    def test_no_table(self, doc):
+        assert doc.find('td').table_rows().val() == []
+        assert doc.find('td').to_records().val() == []
+
+    def test_nodelike_default(self, doc):
+        # NodeLike subclasses don't have to read tables
+        with pytest.raises(NotImplementedError):
+            NodeLike.table_rows(doc)
+        with pytest.raises(NotImplementedError):
+            NodeLike.to_records(doc)
+
+    @pytest.mark.parametrize(('html', 'expected'), [
+        # first row is the header, without th cells
+        ('<tr><td>a</td><td>b</td></tr><tr><td>1</td><td>2</td></tr>',
+         [{'a': '1', 'b': '2'}]),
+        # without a thead, only the first row is the header
+        ('<tr><th>a</th><th>b</th></tr><tr><th>c</th><th></th></tr>'
+         '<tr><td>1</td><td>2</td></tr>',
+         [{'a': 'c', 'b': ''}, {'a': '1', 'b': '2'}]),
+        # all the thead rows are the header
+        ('<thead><tr><th>a</th><th>b</th></tr><tr><td>c</td></tr></thead>'
+         '<tr><td>1</td><td>2</td></tr>',
+         [{'a c': '1', 'b': '2'}]),
+        # empty and duplicate names
+        ('<tr><th>a</th><th>a</th><th></th></tr><tr><td>1</td></tr>',
+         [{'a': '1', 'a.1': None, '2': None}]),
+        # rowspan=0 spans the rest of the section
+        ('<tr><th>a</th><th>b</th></tr>'
+         '<tr><td rowspan="0">1</td><td>2</td></tr><tr><td>3</td></tr>',
+         [{'a': '1', 'b': '2'}, {'a': '1', 'b': '3'}]),
+        ('', []),
+    ])
+    def test_header_inference(self, html, expected):
+        doc = Soupy('<table>%s</table>' % html, 'html.parser')
+        assert doc.to_records().val() == expected
+
+
+class TestIndex(object):
+
+    html = """
+    <div id="main" class="a b">
+      <p class="a">1</p>
+      <p class="b c" id="x">2<span class="a">s</span></p>
+      <table><tr><td class="x">1</td><td>2</td></tr>
+             <tr><td class="x y">3</td><td class="X">4</td></tr></table>
+    </div>
+    <p id="main">3</p>
+    <div><span class="a b"><p>4</p></span></div>
+    """
+
+    queries = [
+        (('p',), {}),
+        (('div',), {}),
+        (('p', 'a'), {}),
+        (('p',), {'class_': 'b'}),
+        ((), {'class_': 'a'}),
+        ((), {'id': 'main'}),
+        ((), {'id': 'x'}),
+        (('span',), {'attrs': {'class': 'a'}}),
+        (('td',), {'class_': 'x'}),
+        (('td', 'X'), {}),
+        (('p',), {'id': 'main', 'class_': 'a'}),
+        (('nope',), {}),
+        (('p',), {'limit': 2}),
+    ]
+
+    def setup_method(self, method):
+        self.indexed = Soupy(self.html, 'html.parser', index=True)
+        self.plain = Soupy(self.html, 'html.parser')
+
+    @pytest.mark.parametrize(('args', 'kwargs'), queries)
+    def test_matches_find_all(self, args, kwargs):
+        assert _SimpleQuery.parse(args, kwargs) is not None
+
+        for start in ([], ['div'], ['table'], ['span']):
+            indexed, plain = self.indexed, self.plain
+            for name in start:
+                indexed, plain = indexed.find(name), plain.find(name)
+
+            assert (indexed.find_all(*args, **kwargs).val() ==
+                    plain.find_all(*args, **kwargs).val())
+            if 'limit' in kwargs:
+                continue
+            assert (indexed.find(*args, **kwargs).orelse(None).val() ==
+                    plain.find(*args, **kwargs).orelse(None).val())
+
+    @pytest.mark.parametrize(('args', 'kwargs'), [
+        (('p',), {'recursive': False}),
+        ((['p', 'span'],), {}),
+        ((True,), {}),
+        ((), {}),
+        (('p',), {'class_': 'a b'}),
+        (('p',), {'string': '1'}),
+        (('p',), {'data-x': '1'}),
+        ((lambda tag: True,), {}),
+        # None and False ask for tags without the attribute
+        (('p',), {'id': None}),
+        (('p',), {'id': False}),
+        (('p',), {'class_': None}),
+        (('p',), {'attrs': {'id': None}}),
+        ((), {'id': None, 'class_': 'a'}),
+    ])
+    def test_fallback(self, args, kwargs):
+        assert _SimpleQuery.parse(args, kwargs) is None
+        assert (self.indexed.find_all(*args, **kwargs).val() ==
+                self.plain.find_all(*args, **kwargs).val())
+
+    @pytest.mark.parametrize(('args', 'kwargs'), [
+        (('p',), {'limit': 3}),
+        (('p', None, True, None, 3), {}),
+    ])
+    def test_find_has_no_limit(self, args, kwargs):
+        assert _SimpleQuery.parse(args, kwargs, find_all=False) is None
+        with pytest.raises(TypeError):
+            self.plain.find(*args, **kwargs)
+        with pytest.raises(TypeError):
+            self.indexed.find(*args, **kwargs)
+
+    def test_index_is_used(self):
+        node = self.indexed.find('table')
+        doc = node._doc
+        assert doc is self.indexed._doc
+        assert doc.index._elements is not None
+        assert node.find_all('td').first()._doc is doc
+
+    def test_setitem_invalidates(self):
+        node = self.indexed.find('p')
+        assert self.indexed.find(id='new').isnull()
+        node['id'] = 'new'
+        assert self.indexed.find(id='new').val() is node.val()
+
+    def test_navigable_strings(self):
+        node = self.indexed.find('p').contents[0]
+        assert isinstance(node.find('p'), NullNode)
+        assert len(node.find_all('p')) == 0
+
+
+class TestCache(object):
+
+    html = """
+    <table class="specs"><tr><td>a</td><td>b</td></tr></table>
+    <p class="x" id="p1">one</p><p>two</p>
+    """
+
+    def setup_method(self, method):
+        self.doc = Soupy(self.html, 'html.parser', cache=100)
+
+    def test_results_are_cached(self):
+        doc = self.doc
+        assert doc.find('table', 'specs') is doc.find('table', 'specs')
+        assert doc.find_all('td') is doc.find_all('td')
+        assert doc.select('p.x') is doc.select('p.x')
+        p = doc.find('p')
+        assert p.text is p.text
+        assert p.attrs is p.attrs
+        assert p.text.val() == 'one'
+
+    def test_keys(self):
+        doc = self.doc
+        assert doc.find('p') is not doc.find('p', 'x')
+        assert doc.find('p').val() is not doc.find_all('p')[1].val()
+        assert doc.find_all('p', limit=1) is not doc.find_all('p')
+        assert doc.find('table').find('td') is not doc.find('td').parent
+
+    def test_shared_by_document(self):
+        table = self.doc.find('table')
+        assert table.find('td') is self.doc.find('table').find('td')
+        assert len(self.doc._doc.cache) == 2
+
+    def test_unhashable_arguments(self):
+        doc = self.doc
+        result = doc.find_all('p', attrs={'class': 'x'})
+        assert result.val() == doc.find_all('p', 'x').val()
+        assert result is not doc.find_all('p', attrs={'class': 'x'})
+
+    def test_lru(self):
+        doc = Soupy(self.html, 'html.parser', cache=2)
+        td = doc.find('td')
+        doc.find('p')
+        assert doc.find('td') is td
+        doc.find('table')  # evicts find('p')
+        assert doc.find('td') is td
+        assert len(doc._doc.cache) == 2
+
+    def test_setitem_invalidates(self):
+        doc = self.doc
+        p = doc.find('p')
+        assert doc.find(id='new').isnull()
+        assert p.attrs.val() == {'class': ['x'], 'id': 'p1'}
+
+        p['id'] = 'new'
+        assert doc.find(id='new').val() is p.val()
+        assert p.attrs.val()['id'] == 'new'
+
+    def test_with_index(self):
+        doc = Soupy(self.html, 'html.parser', index=True, cache=10)
+        assert doc.find('p', 'x') is doc.find('p', 'x')
+        assert doc.find('p', 'x').text.val() == 'one'
+
+    def test_disabled_by_default(self):
+        doc = Soupy(self.html, 'html.parser')
+        assert doc.find('p') is not doc.find('p')
+        assert doc.find('p').val() is doc.find('p').val()
+
+
+class TestSelector(object):
+
+    html = TestIndex.html
+
+    selectors = ['p', 'P', 'p.a', '.a', '#main', 'p#x.b', 'td.x',
+                 'div p', 'div > p', 'p.b.c', 'td:first-child', '[id]']
+
+    def setup_method(self, method):
+        self.indexed = Soupy(self.html, 'html.parser', index=True)
+        self.plain = Soupy(self.html, 'html.parser')
+
+    def test_cached(self):
+        selector = compile_selector('div > p')
+        assert isinstance(selector, CompiledSelector)
+        assert compile_selector('div > p') is selector
+        assert compile_selector('div > p', flags=1) is not selector
+        assert pickle.loads(pickle.dumps(selector)) is selector
+        assert repr(selector) == "CompiledSelector(%r)" % 'div > p'
+
+    def test_cache_keeps_recent_selectors(self, monkeypatch):
+        monkeypatch.setattr('soupy._MAX_SELECTORS', 3)
+        hot = compile_selector('div.hot')
+        cold = []
+        for i in range(10):
+            cold.append(compile_selector('p.cold%i' % i))
+            assert compile_selector('div.hot') is hot
+
+        # the least recently used selectors are dropped
+        assert compile_selector('p.cold9') is cold[9]
+        assert compile_selector('p.cold0') is not cold[0]
+
+    @pytest.mark.parametrize('selector', selectors)
+    def test_select(self, selector):
+        expected = self.plain.val().select(selector)
+        for doc in (self.plain, self.indexed):
+            assert doc.select(selector).val() == expected
+            assert doc.select(compile_selector(selector)).val() == expected
+
+            table = doc.find('table')
+            assert (table.select(selector).val() ==
+                    table.val().select(selector))
+
+    @pytest.mark.parametrize(('selector', 'query'), [
+        ('p', ('p', None, None)),
+        ('P', ('p', None, None)),
+        ('#main', (None, 'main', None)),
+        ('.a', (None, None, 'a')),
+        (' td.x ', ('td', None, 'x')),
+        ('p#x.b', ('p', 'x', 'b')),
+        ('p.b#x', ('p', 'x', 'b')),
+        ('p.b.c', None),
+        ('p#a#b', None),
+        ('div p', None),
+        ('#1', None),
+        ('[id]', None),
+        ('p:first-child', None),
+        ('*', None),
+    ])
+    def test_simple_query(self, selector, query):
+        result = _SimpleQuery.from_selector(selector)
+        if query is None:
+            assert result is None
+        else:
+            assert (result.name, result.id, result.class_) == query
+
+    def test_index_is_used(self):
+        selector = compile_selector('td.x')
+        assert self.indexed.select(selector).count().val() == 2
+        assert self.indexed._doc.index._elements is not None
+
+    def test_xml_documents_skip_index(self):
+        doc = Soupy('<root><Item/><item/></root>', 'xml', index=True)
+        assert doc.select('Item').count().val() == 1
+        assert doc._doc.index._elements is None
+
+    def test_match(self):
+        selector = compile_selector('p.a')
+        assert selector.match(self.plain.find('p').val())
+        assert not selector.match(self.plain.find('div').val())
+
+    def test_null_nodes(self):
+        selector = compile_selector('p')
+        assert isinstance(NullNode().select(selector), NullCollection)
+
+
+class TestStrainer(object):
+
+    html = """
+    <h1>Title</h1>
+    <div class="nav"><a href="/">home</a></div>
+    <table id="prices"><tr><td>1</td></tr><tr><td>2</td></tr></table>
+    <table id="other"><tr><td>3</td></tr></table>
+    <p class="x">a</p><p>b</p>
+    """
+
+    @pytest.mark.parametrize('queries', [
+        [Q.find('table', id='prices').find_all('td').each(Q.text)],
+        [Q.find_all('p', 'x').each(Q.text)],
+        [Q.find(id='other').text],
+        [Q.find('h1').text, Q.find_all('a').each(Q['href'])],
+        [{'title': Q.find('h1').text, 'x': Q.find('p', class_='x').text}],
+        [(Q.find('table', id='prices').text, Q.find('table', id='other'))],
+    ])
+    def test_same_results(self, queries):
+        full = Soupy(self.html, 'html.parser')
+        part = Soupy(self.html, 'html.parser', parse_only=queries)
+        assert len(part.descendants) < len(full.descendants)
+
+        for query in queries:
+            if isinstance(query, dict):
+                assert part.dump(**query).val() == full.dump(**query).val()
+            elif isinstance(query, tuple):
+                assert part.dump(*query).val() == full.dump(*query).val()
+            else:
+                assert part.apply(query).val() == full.apply(query).val()
+
+    @pytest.mark.parametrize('queries', [
+        [Q.text],
+        [Q.find('a').text, Q.children],
+        [Q.find('a', recursive=False)],
+        [Q.find('a', string='x')],
+        [Q.find(lambda tag: True)],
+        [Q.find()],
+        [Q.find('a', id='b'), Q.find(id='c')],
+        [Q.find_all('table', id=None)],
+        [Q.find('p', class_=False)],
+        [Q.find('p', attrs={'id': None})],
+        [lambda node: node],
+        [],
+    ])
+    def test_unstrainable(self, queries):
+        assert strainer(*queries) is None
+        part = Soupy(self.html, 'html.parser', parse_only=queries)
+        assert part.val() == Soupy(self.html, 'html.parser').val()
+
+    def test_raw_strainer(self):
+        part = Soupy(self.html, 'html.parser',
+                     parse_only=strainer(Q.find('h1')))
+        assert part.find_all('p').val() == []
+        assert part.find('h1').text.val() == 'Title'
+
+
+class TestSchema(object):
+
+    html = """
+    <h1>Title</h1>
+    <div class="nav"><a href="/">home</a><a href="/x" class="x">x</a></div>
+    <table id="prices"><tr><td>1</td></tr><tr><td>2</td></tr></table>
+    <p class="x y">a</p><p>b</p><P>c</P>
+    """
+
+    fields = dict(
+        title=Q.find('h1').text,
+        links=Q.find_all('a').each(Q['href']).val(),
+        first_link=Q.find_all('a', limit=1).each(Q.text).val(),
+        x=Q.find(class_='x').name,
+        prices=Q.find('table', id='prices').find_all('td').each(Q.text).val(),
+        cells=Q.find_all('td').count(),
+        p=Q.select('p.x').each(Q.text).val(),
+        compiled=Q.select(compile_selector('div.nav > a')).count(),
+        missing=Q.find('span').text.orelse(None),
+        regex=Q.find_all(re.compile('^t')).count(),
+        name=Q.name,
+        plain=lambda node: 3,
+    )
+
+    def test_same_as_dump(self):
+        node = Soupy(self.html, 'html.parser')
+        schema = Schema(**self.fields)
+        assert schema(node).val() == node.dump(**self.fields).val()
+
+    def test_positional(self):
+        node = Soupy(self.html, 'html.parser')
+        fields = list(self.fields.values())
+        schema = Schema(*fields)
+        assert schema(node).val() == node.dump(*fields).val()
+
+    def test_single_walk(self, monkeypatch):
+        node = Soupy(self.html, 'html.parser')
+        schema = Schema(title=Q.find('h1').text,
+                        cells=Q.find_all('td').count(),
+                        p=Q.select('p').count())
+
+        def fail(*args, **kwargs):
+            raise AssertionError('searched')
+
+        monkeypatch.setattr(Tag, 'find_all', fail)
+        assert schema(node).val() == {'title': 'Title', 'cells': 2, 'p': 3}
+
+    def test_shared_searches(self):
+        schema = Schema(a=Q.find('td').text, b=Q.find('td').name,
+                        c=Q.find('td', limit=3), d=Q.find_all('td'))
+        assert len(schema._searches) == 2
+
+    def test_each(self):
+        rows = Soupy(self.html, 'html.parser').find_all('tr')
+        schema = Schema(cell=Q.find('td').text)
+        assert rows.each(schema).val() == [{'cell': '1'}, {'cell': '2'}]
+        assert rows.dump(cell=Q.find('td').text).val() == \
+            rows.each(schema).val()
+
+    @pytest.mark.parametrize('field', [
+        Q.find('span').text,
+        Q.find('h1')['missing'],
+        Q.find('h1').foo(),
+    ])
+    def test_errors(self, field):
+        node = Soupy(self.html, 'html.parser')
+        with pytest.raises(Exception) as expected:
+            node.dump(f=field)
+        expected_debug = Q.debug_()
+        with pytest.raises(Exception) as actual:
+            Schema(f=field)(node)
+        actual_debug = Q.debug_()
+        assert type(actual.value) is type(expected.value)
+        assert str(actual.value) == str(expected.value)
+        assert str(actual_debug.inner_expr) == \
+            str(expected_debug.inner_expr)
+        assert str(actual_debug.expr) == str(expected_debug.expr)
+
+    def test_error_runs_field_once(self):
+        node = Soupy(self.html, 'html.parser')
+        calls = []
+
+        def fail(text):
+            calls.append(text)
+            raise ValueError('bad')
+
+        with pytest.raises(ValueError):
+            Schema(f=Q.find('h1').text.map(fail))(node)
+        assert calls == ['Title']
+
+    @pytest.mark.parametrize('field', [
+        Q.find('a', class_=None).text,
+        Q.find_all('td', id=None).count(),
+        Q.find_all('p', class_=False).each(Q.text).val(),
+        Q.find('td', id=False).text,
+    ])
+    def test_absent_attributes(self, field):
+        # None and False ask for tags without the attribute
+        node = Soupy(self.html, 'html.parser')
+        schema = Schema(f=field)
+        assert schema._searches == []
+        assert schema(node).val() == node.dump(f=field).val()
+
+    def test_xml(self):
+        node = Soupy('<a><B class="x">1</B><b>2</b></a>', 'xml')
+        schema = Schema(find=Q.find('B').text, select=Q.select('B').count())
+        assert schema(node).val() == {'find': '1', 'select': 1}
+
+    @pytest.mark.parametrize('kwargs', [{'index': True}, {'cache': 10}])
+    def test_options(self, kwargs):
+        node = Soupy(self.html, 'html.parser', **kwargs)
+        schema = Schema(**self.fields)
+        assert schema(node).val() == node.dump(**self.fields).val()
+
+    def test_other_wrappers(self):
+        schema = Schema(title=Q.find('h1').text.orelse(None))
+        assert schema(NullNode()) is NullNode().dump(
+            title=Q.find('h1').text.orelse(None))
+        lxml = Soupy(self.html, engine='lxml')
+        assert schema(lxml).val() == {'title': 'Title'}
+
+    def test_args_and_kwargs(self):
+        with pytest.raises(ValueError):
+            Schema(Q.name, name=Q.name)
+
+    def test_repr(self):
+        schema = Schema(Q.find('a'), Q.name)
+        assert repr(schema) == "Schema(Q.find('a'), Q.name)"
+
+
+class TestLxml(object):
+
+    html = """
+    <html><body>
+    <div id="main" class="a b">
+      <p class="x">one <b>bold</b></p>
+      <p>two</p>
+      <a href="/1" rel="nofollow">link</a>
+      <span><p class="x y">three</p></span>
+    </div>
+    <!-- comment -->
+    <ul><li>1</li><li>2</li><li class="x">3</li></ul>
+    </body></html>
+    """
+
+    def setup_method(self, method):
+        pytest.importorskip('lxml')
+        self.bs4 = Soupy(self.html, 'lxml')
+        self.lxml = Soupy(self.html, engine='lxml')
+
+    @pytest.mark.parametrize('query', [
+        Q.find('p').text,
+        Q.find('div').attrs,
+        Q.find('a').attrs,
+        Q.find('a')['href'],
+        Q.find('b').parent.name,
+        Q.find('b').parents.each(Q.name),
+        Q.find_all('p').each(Q.text),
+        Q.find_all('p', 'x').each(Q.text),
+        Q.find_all('p', class_='y').each(Q.text),
+        Q.find_all('p', {'class': 'x y'}).each(Q.text),
+        Q.find_all(['li', 'b']).each(Q.text),
+        Q.find_all(id='main').count(),
+        Q.find_all(href=True).count(),
+        Q.find_all('p', string='two').count(),
+        Q.find_all(re.compile('^[ab]$')).each(Q.name),
+        Q.find_all('li', limit=2).each(Q.text),
+        Q.find('div').find_all('p', recursive=False).each(Q.text),
+        Q.find('p').find_next_siblings('p').each(Q.text),
+        Q.find('a').find_previous_sibling().text,
+        Q.find('li', 'x').find_previous_siblings().each(Q.text),
+        Q.find('b').find_parent('div')['id'],
+        Q.find('b').find_parents('p').count(),
+        Q.find('li').next_sibling.text,
+        Q.find('li').next_siblings.each(Q.text),
+        Q.select('div > p').each(Q.text),
+        Q.select('span p.y').each(Q.text),
+        Q.find('div').select('p').count(),
+        Q.find('nope').text.orelse('missing'),
+        Q.find('div').text_(),
+        Q.find('div').text_(limit=12, separator=''),
+        Q.text_(),
+        Q.find('ul').dump(first=Q.find('li').text, n=Q.find_all('li').count()),
+    ])
+    def test_matches_bs4(self, query):
+        assert self.lxml.apply(query).val() == self.bs4.apply(query).val()
+
+    def test_wrappers(self):
+        doc = self.lxml
+        assert isinstance(doc, LxmlNode)
+        assert isinstance(doc.find('p'), LxmlNode)
+        assert isinstance(doc.find('nope'), NullNode)
+        assert isinstance(doc.find_all('nope').first(), NullNode)
+        assert repr(doc.find('b')) == 'LxmlNode(<b>bold</b>)'
+        assert doc.name.val() == '[document]'
+        assert doc.find('html').parent.name.val() == '[document]'
+
+    def test_wrap_elements(self):
+        b = self.lxml.find('b')
+        parent = b.map(lambda element: element.getparent())
+        assert isinstance(parent, LxmlNode)
+        assert parent.find('b').text.val() == 'bold'
+
+        wrapped = Wrapper.wrap(self.lxml.val())
+        assert isinstance(wrapped, LxmlNode)
+        assert wrapped.find('b').val() is b.val()
+
+        xml = Soupy('<r><Item/></r>', 'xml', engine='lxml')
+        item = Wrapper.wrap(xml.find('Item').val())
+        assert item.name.val() == 'Item'
+        assert item.parent.find('Item').val() is item.val()
+
+    def test_unsupported(self):
+        with pytest.raises(TypeError):
+            self.lxml.find_all(string='two')
+        with pytest.raises(TypeError):
+            self.lxml.find(text=re.compile('t'))
+        with pytest.raises(TypeError):
+            pickle.dumps(self.lxml.find('p'))
+
+    def test_elements_only(self):
+        # unlike BeautifulSoup, text isn't split into separate nodes
+        div = self.lxml.find('div')
+        assert div.children.each(Q.name).val() == ['p', 'p', 'a', 'span']
+        assert div.contents.count().val() == 4
+        assert div.descendants.count().val() == 6
+
+    def test_callable_name(self):
+        found = self.lxml.find_all(lambda el: el.get('rel') == 'nofollow')
+        assert found.each(Q.text).val() == ['link']
+
+    def test_setitem(self):
+        a = self.lxml.find('a')
+        a['href'] = '/2'
+        a['class'] = ['c', 'd']
+        assert self.lxml.find('a', 'd')['href'].val() == '/2'
+
+    def test_compiled_selector(self):
+        selector = compile_selector('li.x')
+        assert self.lxml.select(selector).first().text.val() == '3'
+
+    def test_xml(self):
+        doc = Soupy('<?xml version="1.0" encoding="latin-1"?>'
+                    '<r xmlns:g="urn:g"><Item a="1" class="p q">t</Item>'
+                    '<g:Item/></r>', 'xml', engine='lxml')
+        assert doc.find_all('Item').count().val() == 2
+        assert doc.find('Item').attrs.val() == {'a': '1', 'class': 'p q'}
+        assert doc.find_all('item').count().val() == 0
+        assert '<Item' in doc.find('Item').prettify()
+
+    def test_bytes(self):
+        doc = Soupy('<p>\xe9</p>'.encode('utf-8'), engine='lxml')
+        assert doc.find('p').text.val() == '\xe9'
+
+    def test_empty(self):
+        assert Soupy('', engine='lxml').find('p').isnull()
+
+    def test_huge_tree(self):
+        # libxml2's depth limit stays on unless asked for
+        etree = pytest.importorskip('lxml.etree')
+        deep = '<div>' * 300 + 'x' + '</div>' * 300
+        with pytest.raises(etree.XMLSyntaxError):
+            Soupy(deep, 'xml', engine='lxml')
+
+        doc = Soupy(deep, 'xml', engine='lxml', huge_tree=True)
+        assert doc.find_all('div').count().val() == 300
+
+    def test_bad_arguments(self):
+        with pytest.raises(ValueError):
+            Soupy(self.html, engine='nope')
+        with pytest.raises(TypeError):
+            Soupy(self.html, engine='lxml', index=True)
+
+    def test_batch(self):
+        result = batch(Q.find('a')['href'], [self.html], workers=0,
+                       engine='lxml')
+        assert [r.value for r in result] == ['/1']
+
+
+class TestFromBytes(object):
+
+    text = '<p>h\xe9llo \u2603</p>'
+
+    def setup_method(self, method):
+        encoding_stats(reset=True)
+
+    def _check(self, data, step, expected, **kwargs):
+        doc = Soupy.from_bytes(data, 'html.parser', **kwargs)
+        assert doc.find('p').text.val() == 'h\xe9llo \u2603'
+        assert doc.val().original_encoding == expected
+        stats = encoding_stats()
+        assert stats[step] == 1
+        assert sum(stats.values()) == 1
+
+    def test_utf8(self):
+        self._check(self.text.encode('utf-8'), 'utf-8', 'utf-8')
+
+    def test_declared(self):
+        data = self.text.encode('utf-16-le')
+        self._check(data, 'declared', 'utf-16-le', encoding='UTF-16LE')
+
+    def test_content_type(self):
+        data = self.text.encode('utf-16-be')
+        self._check(data, 'declared', 'utf-16-be',
+                    content_type='text/html; Charset="utf-16-be"')
+
+    def test_encoding_beats_content_type(self):
+        data = self.text.encode('utf-16-be')
+        self._check(data, 'declared', 'utf-16-be', encoding='utf-16-be',
+                    content_type='text/html; charset=utf-8')
+
+    @pytest.mark.parametrize('head', [
+        '<meta charset="koi8-r">',
+        "<META http-equiv=Content-Type content='text/html; charset=KOI8-R'>",
+    ])
+    def test_meta(self, head):
+        data = (head + '<p>\u043f\u0440\u0438</p>').encode('koi8-r')
+        doc = Soupy.from_bytes(data, 'html.parser')
+        assert doc.find('p').text.val() == '\u043f\u0440\u0438'
+        assert doc.val().original_encoding == 'koi8-r'
+        assert encoding_stats()['prescan'] == 1
+
+    def test_meta_too_late(self):
+        data = (' ' * 1024 + '<meta charset="koi8-r"><p>\u043f</p>')
+        Soupy.from_bytes(data.encode('koi8-r'), 'html.parser')
+        # BeautifulSoup's detection still finds it
+        assert encoding_stats()['prescan'] == 0
+        assert encoding_stats()['detected'] == 1
+
+    def test_no_prescan(self):
+        data = '<meta charset="latin-1"><p>\u2603</p>'.encode('utf-8')
+        doc = Soupy.from_bytes(data, 'html.parser', prescan=False)
+        assert doc.find('p').text.val() == '\u2603'
+        assert encoding_stats()['utf-8'] == 1
+
+    def test_xml_declaration(self):
+        data = ('<?xml version="1.0" encoding="iso-8859-1"?>'
+                '<p>\xe9</p>').encode('latin-1')
+        doc = Soupy.from_bytes(data, 'xml')
+        assert doc.find('p').text.val() == '\xe9'
+        assert encoding_stats()['prescan'] == 1
+
+    @pytest.mark.parametrize(('bom', 'name'), [
+        (codecs.BOM_UTF8, 'utf-8'),
+        (codecs.BOM_UTF16_LE, 'utf-16-le'),
+        (codecs.BOM_UTF16_BE, 'utf-16-be'),
+        (codecs.BOM_UTF32_LE, 'utf-32-le'),
+        (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    ])
+    def test_bom(self, bom, name):
+        data = bom + self.text.encode(name)
+        self._check(data, 'bom', name, encoding='latin-1')
+
+    @pytest.mark.parametrize('kwargs', [
+        {'encoding': 'no-such-codec'},
+        {'encoding': 'utf-8'},
+        {'content_type': 'text/html'},
+    ])
+    def test_detected(self, kwargs):
+        data = '<p>h\xe9llo</p>'.encode('windows-1252')
+        doc = Soupy.from_bytes(data, 'html.parser', **kwargs)
+        assert doc.find('p').text.val() == 'h\xe9llo'
+        assert encoding_stats()['detected'] == 1
+
+    def test_same_as_soupy(self):
+        data = ('<html><head><meta charset="utf-8"></head><body>%s</body>'
+                '</html>' % self.text).encode('utf-8')
+        doc = Soupy.from_bytes(data, 'html.parser', index=True)
+        assert doc.val() == Soupy(data, 'html.parser').val()
+        assert doc.find('p').text.val() == 'h\xe9llo \u2603'
+
+    def test_lxml_engine(self):
+        doc = Soupy.from_bytes(self.text.encode('utf-8'), engine='lxml')
+        assert isinstance(doc, LxmlNode)
+        assert doc.find('p').text.val() == 'h\xe9llo \u2603'
+
+    def test_text(self):
+        with pytest.raises(TypeError):
+            Soupy.from_bytes(self.text)
+
+    def test_reset(self):
+        Soupy.from_bytes(b'<p></p>', 'html.parser')
+        assert encoding_stats(reset=True)['utf-8'] == 1
+        assert encoding_stats()['utf-8'] == 0
+
+
+class TestSaveLoad(object):
+
+    html = """<!DOCTYPE html>
+    <html><head><title>T</title><script>if (a < b) {}</script></head>
+    <body><!-- note --><p class="a b" id="x">h\xe9llo<br>\u2603</p>
+    <ul><li>1</li><li><b>2</b><ul><li>3</li></ul></li></ul>
+    <pre>  x  </pre><a rel="next" href="/2">next</a></body></html>
+    """
+
+    xml = ('<?xml version="1.0"?><?pi x?>'
+           '<feed xmlns:a="urn:a"><a:item k="1">x<![CDATA[<y>]]></a:item>'
+           '<item k="2"/></feed>')
+
+    def _round_trip(self, doc, tmpdir, **kwargs):
+        path = str(tmpdir.join('doc.soupy'))
+        doc.save(path)
+        return Soupy.load(path, **kwargs)
+
+    @pytest.mark.parametrize('features', ['html.parser', 'lxml'])
+    def test_round_trip(self, features, tmpdir):
+        doc = Soupy(self.html, features)
+        loaded = self._round_trip(doc, tmpdir)
+
+        assert type(loaded) is Soupy
+        assert text_type(loaded.val()) == text_type(doc.val())
+        assert loaded.val().builder.NAME == doc.val().builder.NAME
+        expected = list(doc.val().descendants)
+        actual = list(loaded.val().descendants)
+        assert [type(x) for x in actual] == [type(x) for x in expected]
+        assert actual == expected
+
+    def test_tree_links(self, tmpdir):
+        doc = self._round_trip(Soupy(self.html, 'html.parser'), tmpdir)
+        elements = list(doc.val().descendants)
+        for before, after in zip(elements, elements[1:]):
+            assert before.next_element is after
+            assert after.previous_element is before
+        for tag in doc.val().find_all(True):
+            for child in tag.contents:
+                assert child.parent is tag
+            for left, right in zip(tag.contents, tag.contents[1:]):
+                assert left.next_sibling is right
+                assert right.previous_sibling is left
+
+    def test_node_api(self, tmpdir):
+        doc = self._round_trip(Soupy(self.html, 'html.parser'), tmpdir)
+        assert doc.find('p')['class'].val() == ['a', 'b']
+        assert doc.find('a')['rel'].val() == ['next']
+        assert doc.find(id='x').text.val() == 'h\xe9llo\u2603'
+        assert doc.select('ul ul li').each(Q.text).val() == ['3']
+        assert doc.find('br').val().is_empty_element
+        assert doc.find('pre').text.val() == '  x  '
+
+        doc.find('p')['id'] = 'y'
+        assert doc.find(id='y').name.val() == 'p'
+
+    def test_xml(self, tmpdir):
+        doc = Soupy(self.xml, 'xml')
+        loaded = self._round_trip(doc, tmpdir)
+        assert text_type(loaded.val()) == text_type(doc.val())
+        assert loaded.find('item')['k'].val() == '1'
+        assert loaded.select('a|item').count().val() == 1
+
+    def test_options(self, tmpdir):
+        doc = self._round_trip(Soupy(self.html, 'html.parser'), tmpdir,
+                               index=True, cache=10)
+        assert doc.find('li').text.val() == '1'
+        assert doc._doc.index is not None
+
+    def test_features(self, tmpdir):
+        doc = self._round_trip(Soupy(self.html, 'html.parser'), tmpdir,
+                               features='lxml')
+        assert doc.val().builder.NAME == 'lxml'
+
+    def test_subtrees(self, tmpdir):
+        path = str(tmpdir.join('doc.soupy'))
+        Soupy(self.html, 'html.parser').save(path)
+        items = Soupy.load(path, 'li')
+        assert isinstance(items, LazyCollection)
+        # nested matches are part of the outer match
+        assert items.each(Q.text).val() == ['1', '23']
+        assert Soupy.load(path, 'missing').val() == []
+
+    def test_subtrees_read_once(self, tmpdir):
+        path = str(tmpdir.join('doc.soupy'))
+        Soupy(self.html, 'html.parser').save(path)
+        items = Soupy.load(path, 'li')
+        # the file can change once load returns
+        Soupy('<li>other</li>', 'html.parser').save(path)
+        assert items.each(Q.text).val() == ['1', '23']
+
+    def test_builder_setup(self, tmpdir):
+        # tags are set up by the tree builder, like when parsing
+        html = '<meta charset="latin-1"><p class="a">x</p><p class="a">y</p>'
+        doc = Soupy(html, 'html.parser')
+        loaded = self._round_trip(doc, tmpdir)
+        meta, expected = loaded.find('meta').val(), doc.find('meta').val()
+        assert type(meta['charset']) is type(expected['charset'])
+
+        first, second = loaded.find_all('p').val()
+        first['class'].append('b')
+        assert second['class'] == ['a']
+
+    def test_subtrees_xml(self, tmpdir):
+        path = str(tmpdir.join('doc.soupy'))
+        Soupy(self.xml, 'xml').save(path)
+        assert Soupy.load(path, 'item').each(Q['k']).val() == ['1', '2']
+
+    def test_subtree_save(self, tmpdir):
+        doc = Soupy(self.html, 'html.parser')
+        loaded = self._round_trip(Soupy(doc.find('ul').val()), tmpdir)
+        assert text_type(loaded.val()) == text_type(doc.find('ul').val())
+
+    def test_file_objects(self):
+        out = BytesIO()
+        Soupy(self.html, 'html.parser').save(out)
+        out.seek(0)
+        assert Soupy.load(out).find('title').text.val() == 'T'
+
+    @pytest.mark.parametrize('data', [b'', b'<html></html>',
+                                      b'SOUPYDOC\xff\0\0\0' + b'\0' * 20])
+    def test_invalid(self, data):
+        with pytest.raises(ValueError):
+            Soupy.load(BytesIO(data))
+
+    def test_truncated(self):
+        out = BytesIO()
+        Soupy(self.html, 'html.parser').save(out)
+        with pytest.raises(ValueError):
+            Soupy.load(BytesIO(out.getvalue()[:-4]))
+
+    def test_empty(self, tmpdir):
+        doc = self._round_trip(Soupy('', 'html.parser'), tmpdir)
+        assert doc.val().contents == []
+
+
+class TestIterParse(object):
+
+    xml = b"""<?xml version="1.0"?>
+    <feed xmlns:g="http://example.com/g">
+      <meta>ignored</meta>
+      <channel>
+        <item id="1"><title>One</title><g:price>1.5</g:price></item>
+        <item id="2"><title>Two</title>text<b>bold</b>tail</item>
+        <item id="3"><title>Three</title><item id="3a"></item></item>
+      </channel>
+    </feed>
+    """
+
+    def items(self, **kwargs):
+        return Soupy.iterparse(BytesIO(self.xml), 'item', **kwargs)
+
+    def test_nodes(self):
+        items = self.items()
+        assert isinstance(items, LazyCollection)
+
+        nodes = list(items)
+        assert len(nodes) == 3
+        assert all(isinstance(node, Node) for node in nodes)
+        assert [n.name.val() for n in nodes] == ['item'] * 3
+        assert [n['id'].val() for n in nodes] == ['1', '2', '3']
+
+    def test_content(self):
+        items = self.items()
+        first = items.first()
+        assert first.find('title').text.val() == 'One'
+        assert first.find('price').text.val() == '1.5'
+
+        second = items.first()
+        assert second.text.val() == 'Twotextboldtail'
+
+        third = items.first()
+        assert third.find('item')['id'].val() == '3a'
+        assert isinstance(items.first(), NullNode)
+
+    def test_dump(self):
+        result = self.items().dump(id=Q['id'], title=Q.find('title').text)
+        assert result.val() == [{'id': '1', 'title': 'One'},
+                                {'id': '2', 'title': 'Two'},
+                                {'id': '3', 'title': 'Three'}]
+
+    def test_no_matches(self):
+        assert Soupy.iterparse(BytesIO(self.xml), 'missing').val() == []
+
+    def test_deep_nesting(self, monkeypatch):
+        # ElementTree (unlike lxml) doesn't limit the depth
+        monkeypatch.setattr('soupy.etree', None)
+        xml = b'<r><item>' + b'<b>' * 3000 + b'x' + b'</b>' * 3000 + \
+            b'</item></r>'
+        items = Soupy.iterparse(BytesIO(xml), 'item')
+        assert items.each(Q.text).val() == ['x']
+
+    def test_frees_finished_elements(self, monkeypatch):
+        lxml_etree = pytest.importorskip('lxml.etree')
+        seen = []
+
+        class Recorder(object):
+            @staticmethod
+            def iterparse(*args, **kwargs):
+                for event, element in lxml_etree.iterparse(*args, **kwargs):
+                    seen.append(element)
+                    yield event, element
+
+        monkeypatch.setattr('soupy.etree', Recorder)
+        assert len(self.items().val()) == 3
+
+        # only the root is left, without any children
+        assert [e for e in seen if e.getparent() is not None] == []
+        assert len(seen[0]) == 0
+
+    def test_html(self):
+        pytest.importorskip('lxml')
+        html = b"<html><body><ul><li>1<li>2</ul><li>3</body></html>"
+        items = Soupy.iterparse(BytesIO(html), 'li', html=True)
+        assert items.each(Q.text).val() == ['1', '2', '3']
+
 
 class TestNavigableString(object):
 
@@ -166,6 +1240,16 @@ class TestNavigableString(object):
     def test_text(self):
         assert self.node.text.val() == 'hi'
 
+    def test_text_(self):
+        node = Node(BeautifulSoup('<b> h  i </b>', 'html.parser').b.string)
+        assert node.text_().val() == 'h i'
+        assert node.text_(limit=1, strip=False).val() == ' '
+
+    def test_table(self):
+        assert self.node.table_rows().val() == []
+        assert self.node.to_records().val() == []
+        assert self.node.to_records(columns=True).val() == {}
+
     def test_name(self):
         assert self.node.name.val() == ''
 
@@ -371,6 +1455,13 @@ class TestNullNode(object):
         node = NullNode()
         assert isinstance(getattr(node, attr), Null)
 
+    def test_text_(self):
+        assert NullNode().text_(limit=3) is Null()
+
+    def test_table(self):
+        assert NullNode().table_rows() is Null()
+        assert NullNode().to_records(header=False) is Null()
+
     def test_orelse_returns_other(self):
         assert NullNode().orelse(3).val() == 3
 
@@ -523,6 +1614,153 @@ class TestCollection(object):
         lbls = Collection([Scalar('a'), Scalar('b')])
         assert c.dictzip(lbls).val() == expected
 
+    def test_dump_columns(self):
+        c = self.node.find_all('a')
+        result = c.dump_columns(text=Q.text, num=Q.text.map(int))
+        assert result.val() == {'text': ['1', '2', '3'], 'num': [1, 2, 3]}
+
+        result = c.dump_columns(Q.text, Q.name)
+        assert result.val() == (['1', '2', '3'], ['a', 'a', 'a'])
+
+        with pytest.raises(ValueError):
+            c.dump_columns(Q.text, a=Q.text)
+
+    def test_dump_columns_matches_dump(self):
+        c = self.node.find_all('a')
+        fields = dict(a=Q.text, b=Q.find('b').orelse(None), c=Q.name)
+        rows = c.dump(**fields).val()
+        columns = c.dump_columns(**fields).val()
+        assert [dict((k, v[i]) for k, v in columns.items())
+                for i in range(3)] == rows
+
+    def test_dump_columns_typed(self):
+        c = self.node.find_all('a')
+        result = c.dump_columns(x=(Q.text.map(float), 'd'),
+                                y=(Q.text.map(int), 'l')).val()
+        assert result['x'] == array.array('d', [1., 2., 3.])
+        assert result['y'] == array.array('l', [1, 2, 3])
+
+    def test_dump_columns_numpy(self):
+        np = pytest.importorskip('numpy')
+        c = self.node.find_all('a')
+        result = c.dump_columns(x=(Q.text.map(int), np.int32)).val()['x']
+        assert result.dtype == np.int32
+        assert result.tolist() == [1, 2, 3]
+
+    def test_dump_columns_null(self):
+        with pytest.raises(NullValueError):
+            self.node.find_all('a').dump_columns(x=Q.find('b'))
+
+    def test_dump_columns_lazy(self):
+        c = self.node.find_all('a').lazy()
+        assert c.dump_columns(Q.text).val() == (['1', '2', '3'],)
+
+    def test_values_array(self):
+        np = pytest.importorskip('numpy')
+        c = Collection([Scalar('1.5'), Null(), Scalar(3), Null()])
+        result = c.values_array().val()
+        assert isinstance(result, np.ma.MaskedArray)
+        assert result.dtype == np.float64
+        assert result.mask.tolist() == [False, True, False, True]
+        assert result.compressed().tolist() == [1.5, 3.0]
+
+    def test_values_array_dtype(self):
+        np = pytest.importorskip('numpy')
+        c = Collection([Scalar(1), Null(), Scalar(3)])
+        assert c.values_array(np.int32).val().dtype == np.int32
+        inferred = Collection([Scalar('a'), Null()]).values_array(None).val()
+        assert inferred.compressed().tolist() == ['a']
+
+    def test_values_array_no_nulls(self):
+        pytest.importorskip('numpy')
+        result = self.node.find_all('a').each(Q.text).values_array().val()
+        assert result.tolist() == [1.0, 2.0, 3.0]
+        assert not result.mask.any()
+        assert Collection([]).values_array().val().tolist() == []
+
+    def test_values_array_lazy(self):
+        pytest.importorskip('numpy')
+        c = self.node.find_all('a').lazy().each(Q.text)
+        assert c.values_array().val().tolist() == [1.0, 2.0, 3.0]
+
+    def test_values_array_conversion_error(self):
+        pytest.importorskip('numpy')
+        with pytest.raises(ValueError):
+            Collection([Scalar('x')]).values_array()
+
+    @pytest.mark.parametrize(('func', 'expected'), [
+        (Q * 10, [10.0, None, 30.0, 45.0]),
+        ((Q - 1) / 2, [0.0, None, 1.0, 1.75]),
+        (Q > 2, [False, None, True, True]),
+        (Q.cumsum(), [1.0, None, 4.0, 8.5]),
+    ])
+    def test_vmap(self, func, expected):
+        pytest.importorskip('numpy')
+        c = Collection([Scalar(1), Null(), Scalar(3), Scalar(4.5)])
+        assert c.vmap(func).val().tolist() == expected
+
+    def test_vmap_ufunc(self):
+        np = pytest.importorskip('numpy')
+        c = Collection([Scalar(1), Null(), Scalar(100)])
+        assert c.vmap(np.log10).val().tolist() == [0.0, None, 2.0]
+        assert c.vmap(Q.sum()).val() == 101
+        assert c.vmap(len).val() == 3
+
+    def test_vmap_matches_each(self):
+        pytest.importorskip('numpy')
+        c = Collection(Scalar(i) if i % 3 else Null() for i in range(20))
+        expr = (Q - 4) * 1.5 + 2
+        expected = c.each(expr.orelse(None)).val()
+        assert c.vmap(expr).val().tolist() == expected
+
+    def test_match(self):
+        c = Collection([Scalar('Price: 3'), Null(), Scalar('Tax: 1'),
+                        Scalar(42)])
+        assert c.match(r'Price: \d').val() == ['Price: 3']
+        assert c.match('tax', re.I).val() == ['Tax: 1']
+        assert c.match('4').val() == [42]
+        assert c.match(re.compile('T'), mask=True).val() == \
+            [False, False, True, False]
+
+    def test_match_nodes(self):
+        node = Soupy('<p> $3</p><p>free $</p><p>$1</p>', 'html.parser')
+        c = node.find_all('p')
+        assert c.match(r'\s*\$').each(Q.text).val() == [' $3', '$1']
+        assert c.lazy().match('f').each(Q.text).val() == ['free $']
+
+    @pytest.mark.parametrize(('substr', 'expected'), [
+        ('cat', [True, False, False, True, False]),
+        ('a', [True, False, True, True, False]),
+        ('t\x00a', [False, False, False, False, False]),
+        ('at ', [True, False, False, False, False]),
+        ('', [True, False, True, True, True]),
+    ])
+    def test_contains(self, substr, expected):
+        c = Collection([Scalar('a cat ate'), Null(), Scalar('a dog'),
+                        Scalar('cat'), Scalar('')])
+        assert c.contains(substr, mask=True).val() == expected
+        assert c.contains(substr).val() == \
+            [item.val() for item, hit in zip(c, expected) if hit]
+
+    def test_contains_matches_filter(self):
+        texts = ['ab' * (i % 4) + 'c' * (i % 3) for i in range(50)]
+        c = Collection(map(Scalar, texts))
+        for substr in ('a', 'bab', 'bc', 'cab', 'abcc'):
+            assert c.contains(substr).val() == \
+                c.filter(Q.map(lambda t: substr in t)).val()
+
+    def test_extract(self):
+        c = Collection([Scalar('$3.50'), Scalar('free'), Null(),
+                        Scalar('$4 or $5')])
+        assert c.extract(r'\$([\d.]+)').each(Q.orelse(None)).val() == \
+            ['3.50', None, None, '4']
+        assert c.extract(r'\$\d').each(Q.orelse(None)).val() == \
+            ['$3', None, None, '$4']
+        result = c.extract(r'(?P<dollars>\d)(\.(\d+))?', group='dollars')
+        assert result.each(Q.orelse(None)).val() == ['3', None, None, '4']
+        result = c.extract(r'\d(\.(\d+))?', group=2)
+        assert result.each(Q.orelse(None)).val() == ['50', None, None, None]
+
     def test_list(self):
 
         items = list(map(Scalar, [1, 2]))
@@ -556,6 +1794,252 @@ class TestCollection(object):
         assert c.all().val()  # this is python's behavior for empty lists
 
 
+class TestLazyCollection(object):
+
+    def setup_method(self, method):
+        self.consumed = []
+
+    def items(self, n=5):
+        for i in range(n):
+            self.consumed.append(i)
+            yield Scalar(i)
+
+    def test_val(self):
+        c = LazyCollection(self.items())
+        assert c.val() == [0, 1, 2, 3, 4]
+        assert c.val() == [0, 1, 2, 3, 4]
+
+    def test_lazy(self):
+        c = Collection(map(Scalar, [1, 2]))
+        assert isinstance(c.lazy(), LazyCollection)
+        assert c.lazy().val() == [1, 2]
+        assert c.lazy().lazy().val() == [1, 2]
+        assert isinstance(NullCollection().lazy(), NullCollection)
+
+    @pytest.mark.parametrize('func', COLLECTION_TO_COLLECTION)
+    def test_methods_are_lazy(self, func):
+        c = LazyCollection(self.items())
+        result = getattr(c, func)(Q < 10)
+        assert isinstance(result, LazyCollection)
+        assert self.consumed == []
+
+    def test_fused_pipeline(self):
+        c = LazyCollection(self.items())
+        result = c.each(Q * 10).filter(Q > 10).first()
+        assert result.val() == 20
+        assert self.consumed == [0, 1, 2]
+
+    def test_dump(self):
+        c = LazyCollection(self.items())
+        result = c.dump(a=Q + 1)
+        assert self.consumed == []
+        assert result.val() == [{'a': i + 1} for i in range(5)]
+
+    def test_first_empty(self):
+        assert isinstance(LazyCollection([]).first(), NullNode)
+
+    def test_slice(self):
+        c = LazyCollection(self.items())
+        result = c[1:3]
+        assert isinstance(result, LazyCollection)
+        assert result.val() == [1, 2]
+        assert self.consumed == [0, 1, 2]
+
+        assert LazyCollection(self.items())[::-1].val() == [4, 3, 2, 1, 0]
+
+    def test_index_materializes(self):
+        c = LazyCollection(self.items())
+        assert c[-1].val() == 4
+        assert c[0].val() == 0
+        assert isinstance(c[10], NullNode)
+
+    def test_len(self):
+        c = LazyCollection(self.items())
+        assert len(c) == 5
+        assert c.count().val() == 5
+
+    def test_list(self):
+        # list() calls len() after starting to iterate
+        c = LazyCollection(self.items())
+        assert [item.val() for item in list(c)] == [0, 1, 2, 3, 4]
+
+    def test_bool(self):
+        c = LazyCollection(self.items())
+        assert c
+        assert self.consumed == [0]
+        assert c.val() == [0, 1, 2, 3, 4]
+        assert not LazyCollection([])
+
+    def test_all(self):
+        c = LazyCollection(map(Scalar, [True, False]))
+        assert c.any().val()
+        assert not LazyCollection(map(Scalar, [True, False])).all().val()
+
+    def test_short_circuit(self):
+        c = LazyCollection(self.items()).each(Q > 1)
+        assert c.any().val()
+        assert self.consumed == [0, 1, 2]
+
+        del self.consumed[:]
+        assert not LazyCollection(self.items()).each(Q < 1).all().val()
+        assert self.consumed == [0, 1]
+
+        del self.consumed[:]
+        assert not LazyCollection(self.items()).none().val()
+        assert self.consumed == [0, 1]
+
+
+class TestDeferredCollection(object):
+
+    html = """
+    <div><p class="a">1</p><p>2</p><span><p>3</p></span></div>
+    <div><p>4</p></div>
+    """
+
+    def setup_method(self, method):
+        self.doc = Soupy(self.html, 'html.parser')
+        self.visited = []
+
+    def match(self, name):
+        def func(tag):
+            self.visited.append(tag.name)
+            return tag.name == name
+        return func
+
+    def test_searches_when_called(self):
+        # only as far as the first match, until the rest is needed
+        result = self.doc.find_all(self.match('p'))
+        assert self.visited == ['div', 'p']
+        assert result.first().text.val() == '1'
+        assert result.any().val() and bool(result)
+        assert self.visited == ['div', 'p']
+
+        assert len(result) == 4
+        visited = list(self.visited)
+        assert visited[2:] == ['div', 'p', 'p', 'span', 'p', 'div', 'p']
+        assert result.each(Q.text).val() == ['1', '2', '3', '4']
+        assert result.first().text.val() == '1'
+        assert self.visited == visited
+
+    def test_ignores_later_changes(self):
+        result = self.doc.find_all('p')
+        children = self.doc.children
+        assert len(result) == 4 and len(children) == 5
+        self.doc.find('span').val().extract()
+        assert result.each(Q.text).val() == ['1', '2', '3', '4']
+        assert len(children) == 5
+
+    def test_first_follows_rest_of_search(self):
+        result = self.doc.find_all('p')
+        first = result.first()
+        first.val().extract()
+        assert result.first() is first
+        assert len(result) == 3
+        assert result.first().text.val() == '2'
+        assert result.first() is result[0]
+
+    def test_errors_when_called(self):
+        with pytest.raises(TypeError):
+            self.doc.find_all('p', 1, 2, 3, 4, 5, 6)
+
+    @pytest.mark.parametrize(('name', 'expected'), [('p', True),
+                                                    ('img', False)])
+    def test_any(self, name, expected):
+        result = self.doc.find_all(self.match(name))
+        assert len(self.visited) == (2 if expected else 7)
+        assert result.any().val() is expected
+        assert result.none().val() is not expected
+        assert bool(result) is expected
+        assert result.all().val()
+
+    def test_getitem(self):
+        result = self.doc.find_all(self.match('p'))
+        assert result[1].text.val() == '2'
+        visited = list(self.visited)
+        assert [result[i].text.val() for i in range(len(result))] == \
+            ['1', '2', '3', '4']
+        assert self.visited == visited
+        assert isinstance(result[10], NullNode)
+        assert result[-1].text.val() == '4'
+        assert result[1:3].each(Q.text).val() == ['2', '3']
+
+    def test_limit(self):
+        assert self.doc.find_all('p', limit=2).val() == \
+            self.doc.val().find_all('p', limit=2)
+        assert self.doc.find_all('p', limit=2).first().text.val() == '1'
+        assert self.doc.find_all('p', None, True, None, 3).count().val() == 3
+
+        p = self.doc.find('span').find('p')
+        first = p.find_parents('div').first()
+        assert first.val() is self.doc.find('div').val()
+        assert p.find_parents(limit=1).count().val() == 1
+
+    def test_generators(self):
+        result = self.doc.descendants
+        assert result.first().val() == self.doc.val().contents[0]
+        assert result.val() == list(self.doc.val().descendants)
+        assert self.doc.find('p').next_siblings.any().val()
+        assert not self.doc.find('span').next_siblings.any().val()
+
+    def test_select(self):
+        result = self.doc.select('div > p')
+        assert result.first().text.val() == '1'
+        assert result.each(Q.text).val() == ['1', '2', '4']
+
+    def test_lazy(self):
+        result = self.doc.find_all(self.match('p')).lazy()
+        assert isinstance(result, LazyCollection)
+        assert result.filter(Q.text == '2').first().text.val() == '2'
+
+        result = self.doc.descendants.lazy()
+        assert result.filter(Q.name == 'span').first().name.val() == 'span'
+
+    def test_wrap_on_access(self):
+        result = self.doc.descendants
+        assert result.val() == list(self.doc.val().descendants)
+        assert len(result) == result.count().val() == 14
+        assert not result._nodes
+
+        items = list(result)
+        assert isinstance(items[0], NavigableStringNode)
+        assert type(items[1]) is Node
+        assert [item.val() for item in items] == result.val()
+        assert result.filter(Q.name == 'p').count().val() == 4
+        assert result[-1].val() == result.val()[-1]
+
+    def test_same_nodes_on_every_access(self):
+        result = self.doc.find_all('p')
+        last = result[-1]
+        first = list(result)
+        assert all(a is b for a, b in zip(first, result))
+        assert result[-1] is last is first[-1]
+        assert result[1:3].val() == [first[1].val(), first[2].val()]
+        assert result[1:3][0] is first[1]
+        assert result.first() is first[0]
+
+    def test_cached_results_keep_nodes(self):
+        doc = Soupy(self.html, 'html.parser', cache=10)
+        first = list(doc.find_all('p'))
+        assert all(a is b for a, b in zip(first, doc.find_all('p')))
+
+    def test_wrapped_nodes_share_document(self):
+        doc = Soupy(self.html, 'html.parser', index=True)
+        for item in doc.find('div').descendants:
+            assert item._doc is doc._doc
+
+    def test_behaves_like_collection(self):
+        result = self.doc.find_all('p', 'a')
+        assert isinstance(result, Collection)
+        assert repr(result) == 'Collection([Node(<p class="a">1</p>)])'
+        copy = pickle.loads(pickle.dumps(result))
+        assert type(copy) is Collection
+        assert copy.each(Q.text).val() == ['1']
+
+    def test_typecheck(self):
+        with pytest.raises(TypeError):
+            LazyCollection([1]).val()
+
+
 class TestNullCollection(object):
 
     def test_iter_val(self):
@@ -566,6 +2050,20 @@ class TestNullCollection(object):
         with pytest.raises(NullValueError):
             return NullCollection().dump().val()
 
+    def test_dump_columns(self):
+        assert isinstance(NullCollection().dump_columns(a=Q), Null)
+
+    def test_values_array(self):
+        assert NullCollection().values_array() is Null()
+        assert NullCollection().vmap(Q * 2) is Null()
+
+    def test_text_operators(self):
+        assert isinstance(NullCollection().match('a'), NullCollection)
+        assert isinstance(NullCollection().contains('a'), NullCollection)
+        assert isinstance(NullCollection().extract('a'), NullCollection)
+        assert NullCollection().match('a', mask=True) is Null()
+        assert NullCollection().contains('a', mask=True) is Null()
+
     @pytest.mark.parametrize('func', COLLECTION_TO_COLLECTION)
     def test_collection_to_collection_methods(self, func):
         result = getattr(NullCollection(), func)(lambda x: 1)
@@ -633,6 +2131,155 @@ class TestQueries(object):
                           {'a': '2', 'b': None},
                           {'a': '3', 'b': '3'}]
 
+    def test_dump_shares_prefix(self):
+        calls = []
+
+        def search(node):
+            calls.append(node)
+            return node.find('b')
+
+        node = Soupy('<a><b x="1">hi</b></a>').find('a')
+        result = node.dump(Q.apply(search).text,
+                           Q.apply(search)['x'],
+                           Q.apply(search).find('c').orelse(None),
+                           Q.name).val()
+        assert result == ('hi', '1', None, 'a')
+        assert len(calls) == 1
+
+    def test_collection_dump_shares_prefix(self):
+        calls = []
+
+        def search(node):
+            calls.append(node)
+            return node.find('b')
+
+        node = Soupy('<a><b>1</b></a><a><b>2</b></a><a></a>')
+        result = node.find_all('a').dump(
+            text=Q.apply(search).text.orelse(None),
+            name=Q.apply(search).name.orelse(None)).val()
+        assert result == [{'text': '1', 'name': 'b'},
+                          {'text': '2', 'name': 'b'},
+                          {'text': None, 'name': None}]
+        assert len(calls) == 3
+
+    def test_dump_shared_error(self):
+        node = Soupy('<a><b>1</b></a>').find('a')
+        with pytest.raises(QKeyError) as plain:
+            node.dump(b=Q.find('b')['x'])
+        with pytest.raises(QKeyError) as shared:
+            node.dump(a=Q.find('b').text, b=Q.find('b')['x'])
+        assert str(shared.value) == str(plain.value)
+
+    def test_dump_shared_lazy(self):
+        node = Soupy('<a><b>1</b><b>2</b></a>')
+        result = node.dump(n=Q.find_all('b').lazy().count(),
+                           text=Q.find_all('b').lazy().each(Q.text).val())
+        assert result.val() == {'n': 2, 'text': ['1', '2']}
+
+    def test_dump_shared_iterators(self):
+        calls = []
+
+        def items(node):
+            calls.append(node)
+            return node.find_all('b').lazy()
+
+        def contents(tag):
+            return iter(tag.contents)
+
+        node = Soupy('<a><b>1</b><b>2</b></a>').find('a')
+        result = node.dump(Q.apply(items).count(),
+                           Q.apply(items).each(Q.text).val(),
+                           Q.map(contents).map(list),
+                           Q.map(contents).map(tuple)).val()
+        assert result[:2] == (2, ['1', '2'])
+        assert len(result[2]) == len(result[3]) == 2
+        # values that can only be iterated once are computed per field
+        assert len(calls) == 2
+
+    def test_dump_shared_error_runs_once(self):
+        calls = []
+
+        def search(node):
+            calls.append(node)
+            return node.find('b')
+
+        node = Soupy('<a><b>1</b></a>').find('a')
+        with pytest.raises(QKeyError) as plain:
+            node.dump(b=Q.find('b')['x'])
+        with pytest.raises(QKeyError) as shared:
+            node.dump(Q.apply(search).text, Q.apply(search)['x'],
+                      lambda node: calls.append('after'))
+        assert str(shared.value).replace('Q.apply(%r)' % search, 'Q') == \
+            str(plain.value).replace("Q.find('b')", 'Q')
+        assert calls == [node]
+
+    def test_dump_first_error(self):
+        node = Soupy('<a><b>1</b></a>').find('a')
+        with pytest.raises(ZeroDivisionError):
+            node.dump(Q.find('b').text, lambda node: 1 / 0,
+                      Q.find('b')['x'])
+        with pytest.raises(QKeyError):
+            node.dump(Q.find('b').text, Q.find('b')['x'],
+                      lambda node: 1 / 0)
+
+    def test_dump_null_before_error(self):
+        # an earlier field's missing value is reported first
+        calls = []
+        node = Soupy('<h1>Title</h1>')
+        with pytest.raises(NullValueError):
+            node.dump(a=Q.find('h2').text, b=Q.find('h1').name,
+                      c=Q.find('h1').text.foo)
+        with pytest.raises(NullValueError):
+            node.dump(Q.find('h2').text, Q.find('h2').name,
+                      lambda node: calls.append(node))
+        assert calls == []
+
+    @pytest.mark.parametrize('field', [
+        Q.find('b').foo.bar,
+        Q.find('b').text.foo.bar,
+        Q.find('b').text.upper().foo(),
+        Q.find('b').text.split(1, 2, 3),
+    ])
+    def test_dump_shared_error_matches_single(self, field):
+        node = Soupy('<a><b>1</b></a>').find('a')
+        with pytest.raises(Exception) as single:
+            node.dump(f=field)
+        single_debug = Q.debug_()
+        with pytest.raises(Exception) as shared:
+            node.dump(f=field, g=Q.find('b').text)
+        shared_debug = Q.debug_()
+
+        def message(exc):
+            # without the addresses of bound methods
+            return re.sub('0x[0-9a-f]+', '', str(exc))
+
+        assert type(shared.value) is type(single.value)
+        assert message(shared.value) == message(single.value)
+        assert str(shared_debug.expr) == str(single_debug.expr)
+        assert str(shared_debug.inner_expr) == \
+            str(single_debug.inner_expr)
+        assert message(repr(shared_debug.inner_val)) == \
+            message(repr(single_debug.inner_val))
+
+    def test_dump_plans_are_cached(self):
+        fields = [Q.find('b').text, Q.find('b')['x']]
+        plan = _dump_plan(fields)
+        assert plan is not None
+        assert _dump_plan([Q.find('b').text, Q.find('b')['x']]) is plan
+        assert _dump_plan([Q.find('b').text, Q.find('c')['x']]) is None
+        assert _dump_plan([Q.find('b').text, Q.find('b').name]) is not plan
+
+    def test_key(self):
+        assert Q.find('a').text._key() == Q.find('a').text._key()
+        assert Q.find('a', {'class': ['x']})._key() == \
+            Q.find('a', {'class': ['x']})._key()
+        assert Q.find('a')._key() != Q.find('b')._key()
+        assert Q.find('a', limit=1)._key() != Q.find('a', limit=True)._key()
+        assert (Q + 1)._key() == (Q + 1)._key()
+        assert (Q + 1)._key() != (Q - 1)._key()
+        with pytest.raises(TypeError):
+            Q.find(bytearray(b'a'))._key()
+
     def test_failed_search(self):
         node = Soupy('<a><b>1</b></a><a>2</a>')
 
@@ -782,13 +2429,444 @@ class TestExpression(object):
         assert dbg.val == 'test'
         assert dbg.inner_val == 'TEST'
 
-    def test_debug_method_empty(self):
-        del Q.__debug_info__
+    @pytest.mark.parametrize('expr', [
+        Q,
+        Q.upper(),
+        Q.upper().lower().strip(),
+        Q.real.imag,
+        Q[1:3].upper(),
+        Q.__len__() + 1,
+        (Q.__len__() > 2) == 1,
+        3 * (Q.count('a') + 1),
+        Q.split(',')[0].replace(**{'old': 'a', 'new': 'b'}),
+    ])
+    def test_compile_matches_eval(self, expr):
+        for val in ('a,b', 'abcabc', ''):
+            try:
+                expected = expr.eval_(val)
+            except Exception as exc:
+                with pytest.raises(type(exc)):
+                    expr.compile_()(val)
+            else:
+                assert expr.compile_()(val) == expected
+
+    def test_compile_is_cached(self):
+        expr = Q.find('a').text
+        assert expr.compile_() is expr.compile_()
+
+    def test_compiled_exception_message(self):
+        func = Q.upper().foo.compile_()
+        with pytest.raises(AttributeError) as exc:
+            func(str('test'))
+        assert exc.value.args[0] == (
+            "'str' object has no attribute 'foo'"
+            "\n\n\tEncountered when evaluating 'TEST'.foo"
+        )
+
         dbg = Q.debug_()
+        assert repr(dbg.expr) == 'Q.upper().foo'
+        assert repr(dbg.inner_expr) == '.foo'
+        assert dbg.val == 'test'
+        assert dbg.inner_val == 'TEST'
+
+    def test_compiled_failure_evaluates_once(self):
+        calls = []
+
+        def fail(val):
+            calls.append(val)
+            raise ValueError('bad')
+
+        func = Q.upper().map(fail).compile_()
+        with pytest.raises(ValueError) as exc:
+            func(Scalar('test'))
+        assert len(calls) == 1
+        assert 'Encountered when evaluating' in exc.value.args[0]
+        assert Q.debug_().val.val() == 'test'
+
+    @pytest.mark.parametrize('expr', [
+        Q.foo.bar,
+        Q.upper().foo.bar,
+        Q.upper().bar(),
+        Q.split(1, 2, 3),
+        Q.upper.foo,
+    ])
+    def test_compiled_failure_matches_eval(self, expr):
+        # fused steps report the item that failed, like eval_
+        with pytest.raises(Exception) as compiled:
+            expr.compile_()('test')
+        compiled_debug = Q.debug_()
+        with pytest.raises(Exception) as evaluated:
+            expr.eval_('test')
+        evaluated_debug = Q.debug_()
+
+        assert type(compiled.value) is type(evaluated.value)
+        assert str(compiled.value) == str(evaluated.value)
+        assert str(compiled_debug.inner_expr) == \
+            str(evaluated_debug.inner_expr)
+        assert compiled_debug.inner_val == evaluated_debug.inner_val
+        assert compiled_debug.val == evaluated_debug.val == 'test'
+
+    def test_compiled_queries(self):
+        node = Soupy('<a href="x"><b>1</b></a><a><b>2</b></a>')
+        func = Q.find_all('a').each(Q.find('b').text.map(int)).compile_()
+        assert func(node).val() == [1, 2]
+        assert isinstance(Q.find('c').find('b').compile_()(node), NullNode)
+
+    @pytest.mark.parametrize('expr', [
+        Q,
+        Q.find('a'),
+        Q.find('a', class_='b').text.strip()[0:3],
+        Q.find_all('a').each(Q['href']),
+        (Q.text.map(int) + 3) * 2,
+        Q[str('a')],
+    ])
+    def test_pickle(self, expr):
+        result = pickle.loads(pickle.dumps(expr))
+        assert type(result) is type(expr)
+        assert repr(result) == repr(expr)
+
+    def test_debug_method_empty(self):
+        with pytest.raises(AttributeError):
+            Q.upper().foo.eval_('test')
+
+        # debug info is stored per thread, and new threads start empty
+        result = []
+        thread = threading.Thread(target=lambda: result.append(Q.debug_()))
+        thread.start()
+        thread.join()
+        dbg = result[0]
 
         assert isinstance(dbg, QDebug)
         assert dbg == (None, None, None, None)
 
+    def test_debug_method_threads(self):
+        count = 4
+        barrier = threading.Barrier(count)
+        results = {}
+
+        def work(i):
+            val = str('x' * i)
+            for _ in range(20):
+                with pytest.raises(AttributeError):
+                    Q.upper().foo.eval_(val)
+                # every thread has now recorded an error
+                barrier.wait()
+                dbg = Q.debug_()
+                results.setdefault(i, []).append((dbg.val, dbg.inner_val))
+
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(results) == list(range(count))
+        for i, values in results.items():
+            assert values == [('x' * i, 'X' * i)] * 20
+
+
+class TestProfile(object):
+
+    def setup_method(self, method):
+        self.node = Soupy('<div><a href="x">1</a><a>2</a><b>3</b></div>',
+                          'html.parser')
+
+    def test_explain(self):
+        expr = Q.find('a')['href'].strip()
+        assert expr.explain_().splitlines() == [
+            "Q.find('a')['href'].strip()",
+            "  1. .find('a')  (method call)",
+            "  2. ['href']  (item lookup)",
+            "  3. .strip()  (method call)"]
+
+    def test_explain_fused_attributes(self):
+        assert Q.parent.parent.name.explain_().splitlines()[1:] == [
+            "  1. .parent.parent.name  (attribute lookup)"]
+
+    def test_explain_identity(self):
+        assert Q.explain_().splitlines() == ['Q', '  (identity)']
+
+    def test_explain_binary_op(self):
+        lines = (Q.text.strip() == 'x').explain_().splitlines()
+        assert lines[1:] == ["  ==  (binary op)",
+                             "    left: Q.text.strip()",
+                             "      1. .text  (attribute lookup)",
+                             "      2. .strip()  (method call)",
+                             "    right: 'x'"]
+
+    def test_stats(self):
+        expr = Q.find('i').text.orelse('')
+        with profile() as prof:
+            result = self.node.find_all('a').each(expr).val()
+        assert result == ['', '']
+
+        stats = prof.stats()
+        assert all(isinstance(s, ProfileStats) for s in stats)
+        assert [(s.step, s.depth, s.calls, s.nulls) for s in stats] == [
+            (None, 0, 2, 0),
+            (".find('i')", 1, 2, 2),
+            ('.text', 1, 2, 2),
+            (".orelse('')", 1, 2, 0)]
+        assert set(s.expr for s in stats) == set([text_type(expr)])
+        assert all(s.time >= 0 for s in stats)
+
+    def test_timer(self):
+        ticks = iter(range(100))
+        prof = Profile(timer=lambda: next(ticks))
+        with prof:
+            self.node.find('a').text.map(Q.strip())
+        # each step takes one tick, and the root spans both of its ticks
+        assert [s.time for s in prof.stats()] == [3, 1]
+
+    def test_binary_op(self):
+        with profile() as prof:
+            self.node.find_all('a').filter(Q.text == '1')
+        steps = [(s.step, s.depth, s.calls) for s in prof.stats()]
+        assert steps == [(None, 0, 2), ('.text', 2, 2)]
+
+    def test_report(self):
+        with profile() as prof:
+            self.node.find_all('a').each(Q.text.upper())
+        report = prof.report().splitlines()
+        assert report[0].split() == ['expression', '/', 'step', 'calls',
+                                     'time', '(s)', 'nulls']
+        assert report[1].startswith('Q.text.upper()')
+        assert report[2].startswith('  .text ')
+        assert report[3].startswith('  .upper() ')
+        assert str(prof) == prof.report()
+
+    def test_reuses_instrumentation(self):
+        expr = Q.text
+        with profile() as prof:
+            for node in self.node.find_all('a'):
+                node.map(expr)
+        assert [s.calls for s in prof.stats()] == [2, 2]
+
+    def test_only_inside_block(self):
+        with profile() as prof:
+            pass
+        self.node.find_all('a').each(Q.text)
+        assert prof.stats() == []
+
+    def test_nested(self):
+        with profile() as outer:
+            with profile() as inner:
+                self.node.find('a').map(Q.text)
+            self.node.find('b').map(Q.name)
+        assert [s.expr for s in inner.stats()] == ['Q.text', 'Q.text']
+        assert [s.expr for s in outer.stats()] == ['Q.name', 'Q.name']
+
+    def test_errors_are_reported(self):
+        with profile() as prof:
+            with pytest.raises(AttributeError):
+                self.node.find('a').text.map(Q.foo)
+        assert prof.stats()[1].calls >= 1
+        assert Q.debug_().val is not None
+
+    def test_compile_unaffected(self):
+        with profile() as prof:
+            assert Q.text.compile_()(self.node.find('a')) == '1'
+        assert prof.stats() == []
+
+
+class TestBatch(object):
+
+    docs = ['<a href="1">x</a>', '<b></b>', '<a href="3">y</a>']
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_batch(self, workers):
+        result = list(batch(Q.find('a').text.orelse(None), self.docs,
+                            workers=workers, features='html.parser'))
+        assert result == [BatchResult(0, 'x', None),
+                          BatchResult(1, None, None),
+                          BatchResult(2, 'y', None)]
+
+    def test_dump_spec(self):
+        result = batch({'href': Q.find('a')['href'].orelse(None)},
+                       self.docs, workers=0, features='html.parser')
+        assert [r.value for r in result] == [{'href': '1'}, {'href': None},
+                                             {'href': '3'}]
+
+        result = batch((Q.find('a').text,), self.docs[:1], workers=0,
+                       features='html.parser')
+        assert [r.value for r in result] == [('x',)]
+
+    def test_unordered_chunks(self):
+        docs = self.docs * 5
+        result = batch(Q.find_all('a').count(), docs, workers=2,
+                       chunksize=2, ordered=False, features='html.parser')
+        result = sorted(result)
+        assert [r.index for r in result] == list(range(15))
+        assert [r.value for r in result] == [1, 0, 1] * 5
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_capture(self, workers):
+        result = list(batch(Q.find('a').text, self.docs, workers=workers,
+                            capture=True, features='html.parser'))
+        assert result[0] == BatchResult(0, 'x', None)
+        assert result[1].value is None
+        assert isinstance(result[1].error, NullValueError)
+
+    @pytest.mark.parametrize('workers', [0, 2])
+    def test_raise(self, workers):
+        with pytest.raises(NullValueError):
+            list(batch(Q.find('a').text, self.docs, workers=workers,
+                       features='html.parser'))
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def _run(loop, func, *args, **kwargs):
+    """
+    Call func from inside the running loop, and wait
+    for the future it returns
+    """
+    outer = loop.create_future()
+    loop.call_soon(lambda: func(*args, **kwargs).add_done_callback(
+        outer.set_result))
+    return loop.run_until_complete(outer).result()
+
+
+def _drain(loop, iterator):
+    result = []
+    iterator = iterator.__aiter__()
+    while True:
+        try:
+            result.append(_run(loop, iterator.__anext__))
+        except StopAsyncIteration:
+            return result
+
+
+@pytest.mark.skipif(asyncio is None, reason='requires asyncio')
+class TestAsync(object):
+
+    docs = ['<a href="1">x</a>', '<b></b>', '<a href="3">y</a>']
+
+    def fetch(self, doc, delay=0):
+        return asyncio.sleep(delay, result=doc)
+
+    def test_aextract(self, loop):
+        result = _run(loop, aextract, self.docs[0], Q.find('a').text,
+                      features='html.parser')
+        assert result == 'x'
+
+    def test_aextract_awaitable(self, loop):
+        result = _run(loop, aextract, self.fetch(b'<a>x</a>'),
+                      {'a': Q.find('a').text}, features='html.parser')
+        assert result == {'a': 'x'}
+
+    def test_aextract_raises(self, loop):
+        with pytest.raises(NullValueError):
+            _run(loop, aextract, self.docs[1], Q.find('a').text,
+                 features='html.parser')
+
+    @pytest.mark.skipif(not hasattr(asyncio, 'get_running_loop'),
+                        reason='Python < 3.7 uses the current event loop')
+    def test_aextract_outside_loop(self):
+        with pytest.raises(RuntimeError):
+            aextract(self.docs[0], Q.find('a').text, features='html.parser')
+
+        fetch = self.fetch('<a>x</a>')
+        with pytest.raises(RuntimeError):
+            aextract(fetch, Q.find('a').text, features='html.parser')
+        # the coroutine is closed, rather than left on another loop
+        assert fetch.cr_frame is None
+
+    def test_aextract_executor(self, loop):
+        threads = []
+
+        def query(node):
+            threads.append(threading.current_thread())
+            return node.find('a').text
+
+        executor = futures.ThreadPoolExecutor(1)
+        result = _run(loop, aextract, self.docs[0], query, executor=executor,
+                      features='html.parser')
+        assert result == 'x'
+        assert threads[0] is not threading.current_thread()
+        executor.shutdown()
+
+    def test_abatch(self, loop):
+        result = _drain(loop, abatch(Q.find('a').text.orelse(None),
+                                     map(self.fetch, self.docs),
+                                     features='html.parser'))
+        assert result == [BatchResult(0, 'x', None),
+                          BatchResult(1, None, None),
+                          BatchResult(2, 'y', None)]
+
+    def test_abatch_unordered(self, loop):
+        delays = [0.03, 0.02, 0.01]
+        sources = [self.fetch(doc, delay)
+                   for doc, delay in zip(self.docs, delays)]
+        result = _drain(loop, abatch(Q.find_all('a').count(), sources,
+                                     ordered=False, features='html.parser'))
+        assert [r.index for r in result] == [2, 1, 0]
+        assert [r.value for r in result] == [1, 0, 1]
+
+    def test_abatch_backpressure(self, loop):
+        pulled = []
+
+        def sources():
+            for i in range(10):
+                pulled.append(i)
+                yield self.docs[i % 3]
+
+        iterator = abatch(Q.find_all('a').count(), sources(), concurrency=2,
+                          features='html.parser')
+        assert _run(loop, iterator.__anext__).index == 0
+        assert len(pulled) == 2
+        assert len(_drain(loop, iterator)) == 9
+        assert len(pulled) == 10
+
+    def test_abatch_capture(self, loop):
+        result = _drain(loop, abatch(Q.find('a').text, self.docs,
+                                     capture=True, features='html.parser'))
+        assert result[0] == BatchResult(0, 'x', None)
+        assert isinstance(result[1].error, NullValueError)
+
+        with pytest.raises(NullValueError):
+            _drain(loop, abatch(Q.find('a').text, self.docs,
+                                features='html.parser'))
+
+
+def test_pickle_wrappers():
+    for item in (Scalar(3), Collection([Scalar(1)]), Null(), NullNode()):
+        assert repr(pickle.loads(pickle.dumps(item))) == repr(item)
+
+
+@pytest.mark.parametrize('cls', [Null, NullNode, NullCollection])
+def test_null_singletons(cls):
+    assert cls() is cls()
+    assert pickle.loads(pickle.dumps(cls())) is cls()
+
+    with pytest.raises(AttributeError):
+        object.__setattr__(cls(), 'x', 1)
+    for name in ('x', '_value', '_items'):
+        with pytest.raises(AttributeError):
+            setattr(cls(), name, 1)
+        with pytest.raises(AttributeError):
+            delattr(cls(), name)
+
+
+@pytest.mark.parametrize('wrapper', [
+    Scalar(1),
+    Collection([]),
+    LazyCollection([]),
+    Soupy('<a></a>'),
+    Soupy('<a>b</a>').find('a'),
+    Soupy('<a>b</a>').find('a').contents[0],
+])
+def test_wrappers_have_slots(wrapper):
+    assert not hasattr(wrapper, '__dict__')
+
 
 def _public_api(cls):
     # return names of public and magic methods
@@ -811,6 +2889,7 @@ def test_node_api():
     """
     assert _public_api(Node) == _public_api(NullNode)
     assert _public_api(Node) == _public_api(NavigableStringNode)
+    assert _public_api(Node) == _public_api(LxmlNode)
 
 
 def test_collection_api():